@@ -1,32 +1,43 @@
 import argparse
 import configparser
 import datetime
-import gc
+import glob
 import gzip
 import json
 import os
 import random
-import re
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-import torch
 from tabulate import tabulate
 from tqdm import tqdm
 
-from modelteam_utils.ai_utils import eval_llm_batch_with_scores, get_model_list, init_model
 from modelteam_utils.constants import (ADDED, DELETED, TIME_SERIES, LANGS, LIBS, COMMITS, START_TIME, END_TIME,
                                        MIN_LINES_ADDED, SIGNIFICANT_CONTRIBUTION, REFORMAT_CHAR_LIMIT,
                                        TOO_BIG_TO_ANALYZE_LIMIT, TOO_BIG_TO_ANALYZE,
                                        SIGNIFICANT_CONTRIBUTION_LINE_LIMIT, MAX_DIFF_SIZE, STATS, USER, REPO, REPO_PATH,
-                                       SCORES, SIG_CODE_SNIPPETS, SKILLS, FILE, IMPORTS, T5_CHUNK_CHAR_LIMIT, VERSION,
+                                       SCORES, SIG_CODE_SNIPPETS, SKILLS, FILE, IMPORTS, T5_CHUNK_CHAR_LIMIT,
                                        PROFILES, PHC, TIMESTAMP, TEAM, SKILL_PREDICTION_LIMIT,
-                                       LIFE_OF_PY_PREDICTION_LIMIT, C2S, LIFE_OF_PY, MODEL_TYPES, I2S, SS_LC)
+                                       LIFE_OF_PY_PREDICTION_LIMIT, C2S, LIFE_OF_PY, MODEL_TYPES, I2S, SS_LC,
+                                       T5_MAX_INPUT_TOKENS)
 from modelteam_utils.constants import MT_PROFILE_JSON, PDF_STATS_JSON
 from modelteam_utils.crypto_utils import generate_hc
+from modelteam_utils.cache_utils import InferenceCache, TokenCache, TOKEN_CACHE_SIZE_MB
+from modelteam_utils.diff_utils import read_file_diffs
+from modelteam_utils.feature_utils import get_features_file_name, write_features, read_features, \
+    read_remote_repo_path, FEATURES_SUFFIX
+from modelteam_utils.git_utils import stream_git_log, stream_git_log_lines, get_diff_pathspecs, get_patch_args, \
+    GitDiffTreePool, NUMSTAT_LOG_ARGS, DIFF_TREE_NUMSTAT_ARGS
+from modelteam_utils.incremental_utils import load_repo_state, save_repo_state, merge_user_profiles, \
+    get_cutoff_yyyy_mm
+from modelteam_utils.json_utils import loads, read_jsonl, write_jsonl, make_record, PROFILE_RECORD, LIBRARY_RECORD
+from modelteam_utils.model_utils import get_model_list, get_model_tag, get_ai_utils, ModelRegistry
+from modelteam_utils.score_utils import ScoreStore
+from modelteam_utils.shard_utils import parse_shard, is_in_shard, merge_shard_pdf_stats, RepoLeases, ShardManifest
+from modelteam_utils.snippet_utils import get_snippets_file_name, SnippetWriter, SnippetReader
 from modelteam_utils.utils import break_code_snippets_to_chunks, filter_skills, yyyy_mm_to_quarter
-from modelteam_utils.utils import consistent_hash_code
 from modelteam_utils.utils import get_file_extension, run_commandline_command, timestamp_to_yyyy_mm, \
-    get_num_chars_changed, get_language_parser, normalize_docstring
+    get_num_chars_changed, get_language_parser, get_path_info, normalize_docstring
 from modelteam_utils.utils import sha256_hash, anonymize, load_repo_user_list, get_repo_user_key
 
 TRAIN_FLAG = False
@@ -35,11 +46,12 @@ ONE_WEEK = 7 * 24 * 60 * 60
 THREE_MONTH = 3 * 30 * 24 * 60 * 60
 
 args = None
+extraction_parser = None
 debug = False
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 TMP_MAX_YYYY_MM = "tmp_max_yyyy_mm"
+TMP_WATERMARK = "tmp_watermark"
 
 
 def is_huge_commit(total_added, total_deleted):
@@ -52,6 +64,17 @@ class ModelTeamGitParser:
         self.keep_only_public_libraries = True
         self.config = config
         self.pdf_stats = {}
+        # Random prefixes make it easy to split the diff into files
+        self.src_prefix = random.randint(0, 1000)
+        self.dest_prefix = random.randint(0, 1000)
+        # Used only when a single commit is analyzed. See process_commit
+        self.git_pool = GitDiffTreePool()
+        # Models and torch are loaded only when the first model is evaluated
+        self.model_registry = ModelRegistry(config)
+        # Set in __main__ unless disabled
+        self.inference_cache = None
+        # Replaced in __main__ with the --token_cache_size_mb size
+        self.token_cache = TokenCache()
 
     @staticmethod
     def add_to_time_series_stats(commits, file_extension, yyyy_mm, key, inc_count):
@@ -65,17 +88,23 @@ class ModelTeamGitParser:
         else:
             commits[LANGS][file_extension][TIME_SERIES][yyyy_mm][key] += inc_count
 
-    def get_commits_for_each_user(self, repo_path, min_months, num_months, usernames=None):
+    def get_commits_for_each_user(self, repo_path, min_months, num_months, usernames=None, processed_commits=None,
+                                  revision=None):
         """
         Get the list of commits for each user in the given repo. If username is None, then get commits for all users
         :param repo_path:
         :param usernames:
+        :param processed_commits: --incremental_dir. Map of user to commits processed by the previous run. These are
+        not returned, but still count towards min_months
+        :param revision: Commit to start from. Defaults to HEAD
         :return:
         """
         if not usernames:
             usernames = set()
+        if not processed_commits:
+            processed_commits = {}
         commits = {}
-        command = self.get_commit_log_command(repo_path, usernames, num_months)
+        command = self.get_commit_log_command(repo_path, usernames, num_months, revision)
         result = run_commandline_command(command)
         if result:
             lines = result.strip().split('\n')
@@ -96,6 +125,8 @@ class ModelTeamGitParser:
                 if author_email not in user_months:
                     user_months[author_email] = set()
                 user_months[author_email].add(timestamp_to_yyyy_mm(int(commit_timestamp)))
+                if author_email in processed_commits and commit_hash in processed_commits[author_email]:
+                    continue
                 commits[author_email][COMMITS].append((commit_hash, int(commit_timestamp)))
             for user in user_months:
                 if len(user_months[user]) < min_months:
@@ -103,24 +134,25 @@ class ModelTeamGitParser:
         return commits
 
     @staticmethod
-    def get_commit_log_command(repo_path, usernames, num_months):
+    def get_commit_log_command(repo_path, usernames, num_months, revision=None):
         if usernames:
             usernames_pattern = " ".join([f"--author={user}" for user in usernames])
-            return f'git -C {repo_path} log --regexp-ignore-case --pretty=format:"%ae%x01%ct%x01%H"  {usernames_pattern} --since="{num_months} months ago"'
+            command = f'git -C {repo_path} log --regexp-ignore-case --pretty=format:"%ae%x01%ct%x01%H"  {usernames_pattern} --since="{num_months} months ago"'
         else:
-            return f'git -C {repo_path} log --pretty=format:"%ae%x01%ct%x01%H" --since="{num_months} months ago"'
+            command = f'git -C {repo_path} log --pretty=format:"%ae%x01%ct%x01%H" --since="{num_months} months ago"'
+        if revision:
+            command += f" {revision}"
+        return command
 
-    def update_line_num_stats(self, repo_path, commit_hash, user_commit_stats, yyyy_mm, curr_user):
-        # Get the line stats for each file in the given commit
-        command = f'git -C {repo_path} show --numstat --diff-filter=d {commit_hash}'
-        result = run_commandline_command(command)
+    def update_line_num_stats(self, repo_path, commit_hash, user_commit_stats, yyyy_mm, curr_user, result):
+        # result is the numstat output of the given commit (git show --numstat --diff-filter=d)
         total_added = 0
         total_deleted = 0
         file_line_stats = {}  # Dictionary to store file line stats
         add_pdf_stats = False
         if args and args.user_emails:
             add_pdf_stats = curr_user == args.user_emails.strip().lower()
-        if result:
+        if result is not None:
             if add_pdf_stats:
                 repo_name = os.path.basename(repo_path)
                 if repo_name not in self.pdf_stats:
@@ -142,11 +174,7 @@ class ModelTeamGitParser:
                 if added + deleted == 0:
                     continue
                 # handle renames /home/{ xyx => abc }/test.py -> /home/abc/test.py
-                if "=>" in file_path:
-                    pattern = re.compile(r"(.*){.* => (.*)}(.*)")
-                    file_path = pattern.sub(r"\1\2\3", file_path)
-                file_extension = get_file_extension(file_path)
-                parser = get_language_parser(file_extension, None, file_path, self.keep_only_public_libraries)
+                file_path, file_extension, parser = get_path_info(file_path)
                 if not parser:
                     continue
                 parsed_stats.append((file_path, file_extension, added, deleted))
@@ -179,8 +207,8 @@ class ModelTeamGitParser:
                         language[END_TIME] = yyyy_mm
                     elif language[END_TIME] < yyyy_mm:
                         language[END_TIME] = yyyy_mm
-                    # Special case. Dealing with git diff. "/" is used as separator even in windows
-                    file_line_stats[f"{repo_path}/{file_path}"] = [added, deleted]
+                    # Relative path as in git diff. "/" is used as separator even in windows
+                    file_line_stats[file_path] = [added, deleted]
             if add_pdf_stats and total_added > 100:
                 self.pdf_stats[repo_name]["big_commits"][commit_hash] = total_added
         return file_line_stats
@@ -193,30 +221,121 @@ class ModelTeamGitParser:
         # If allowed_users is empty, then all users are allowed
         return True
 
+    @staticmethod
+    def get_since_timestamp(repo_path, num_months):
+        """
+        :return: Timestamp that git log uses for --since="<num_months> months ago"
+        """
+        result = run_commandline_command(f'git -C {repo_path} rev-parse --since="{num_months} months ago"')
+        if result is None:
+            return None
+        return int(result.strip().split("=")[1])
+
+    @staticmethod
+    def get_processed_commits(repo_path, num_months, repo_state, cutoff_yyyy_mm):
+        """
+        --incremental_dir. Commits processed by the previous run, i.e. the ones reachable from each user's watermark.
+        Commits before cutoff_yyyy_mm are left out, so the ones in the window are processed again
+        :return: Map of user to set of commits. Users whose watermark is gone (e.g. force push) are not included and
+        are processed from scratch
+        """
+        watermark_commits = {}
+        processed_commits = {}
+        for user, (watermark, _) in repo_state.items():
+            if watermark not in watermark_commits:
+                result = run_commandline_command(
+                    f'git -C {repo_path} rev-list --timestamp {watermark} --since="{num_months} months ago"')
+                if result is not None:
+                    timestamps_and_commits = [line.split() for line in result.splitlines()]
+                    result = {commit_hash for commit_timestamp, commit_hash in timestamps_and_commits
+                              if timestamp_to_yyyy_mm(int(commit_timestamp)) >= cutoff_yyyy_mm}
+                watermark_commits[watermark] = result
+            if watermark_commits[watermark] is not None:
+                processed_commits[user] = watermark_commits[watermark]
+        return processed_commits
+
+    @staticmethod
+    def merge_previous_profiles(user_stats, users, repo_state, processed_commits, head, cutoff_yyyy_mm):
+        """
+        --incremental_dir. Merge the stats of the new commits into the profiles saved by the previous run. Saved
+        profiles are already evaluated, so only the snippets of the new commits are sent to the models
+        """
+        for user in users:
+            merged = user in processed_commits
+            if merged:
+                user_stats[user] = merge_user_profiles(repo_state[user][1], user_stats[user], cutoff_yyyy_mm)
+            # Saved with the profile once it is evaluated. See save_incremental_state
+            user_stats[user][TMP_WATERMARK] = {"head": head, "merged": merged}
+
     def generate_user_profiles(self, repo_path, user_stats, labels, usernames, repo_name, min_months, num_months):
-        user_commits = self.get_commits_for_each_user(repo_path, min_months, num_months, usernames)
+        repo_state = {}
+        processed_commits = None
+        head = None
+        cutoff_yyyy_mm = None
+        if args and args.incremental_dir:
+            head = run_commandline_command(f"git -C {repo_path} rev-parse HEAD")
+            since_ts = self.get_since_timestamp(repo_path, num_months)
+            if head and since_ts is not None:
+                head = head.strip()
+                cutoff_yyyy_mm = get_cutoff_yyyy_mm(since_ts)
+                repo_state = load_repo_state(args.incremental_dir, repo_path)
+                processed_commits = self.get_processed_commits(repo_path, num_months, repo_state, cutoff_yyyy_mm)
+            else:
+                head = None
+        user_commits = self.get_commits_for_each_user(repo_path, min_months, num_months, usernames, processed_commits,
+                                                      head)
         ignored_users = 0
         if user_commits:
+            allowed_users = []
             for user in user_commits.keys():
                 if not self.is_allowed_user(repo_name, user):
                     ignored_users += 1
                     continue
-                self.process_user(labels, repo_path, user, user_commits, user_stats)
+                allowed_users.append(user)
+            self.process_users(labels, repo_path, allowed_users, user_commits, user_stats)
+            if head:
+                self.merge_previous_profiles(user_stats, allowed_users, repo_state, processed_commits, head,
+                                             cutoff_yyyy_mm)
             if ignored_users:
                 print(f"Ignored {ignored_users} users for {repo_name}", flush=True)
         else:
             print(f"Not enough contribution for {usernames} in {repo_name} ({min_months} months)", flush=True)
 
-    def process_user(self, labels, repo_path, user, user_commits, user_stats):
-        commits = user_commits[user]
-        if user not in user_stats:
-            user_stats[user] = {}
-        user_commit_stats = user_stats[user]
-        user_commit_stats[LANGS] = {}
-        # iterate through each commit from oldest to newest
-        sorted_commits = sorted(commits[COMMITS], key=lambda x: x[1])
-        for commit in sorted_commits:
-            self.process_commit(commit, user_commit_stats, labels, repo_path, user)
+    def process_users(self, labels, repo_path, users, user_commits, user_stats):
+        """
+        Process all the commits of the given users with 2 git processes per repo. First pass streams numstat of every
+        commit and plans the files to analyze, second pass streams the diff of only those files
+        """
+        commit_details = {}
+        for user in users:
+            if user not in user_stats:
+                user_stats[user] = {}
+            user_stats[user][LANGS] = {}
+            # iterate through each commit from oldest to newest
+            sorted_commits = sorted(user_commits[user][COMMITS], key=lambda x: x[1])
+            for commit_hash, commit_timestamp in sorted_commits:
+                commit_details[commit_hash] = (user, timestamp_to_yyyy_mm(commit_timestamp))
+        commits_to_analyze = {}
+        for commit_hash, numstat in stream_git_log(repo_path, commit_details.keys(), NUMSTAT_LOG_ARGS):
+            user, yyyy_mm = commit_details[commit_hash]
+            file_list_with_sig_change = self.update_line_num_stats(repo_path, commit_hash, user_stats[user], yyyy_mm,
+                                                                   user, numstat)
+            if self.needs_deep_analysis(file_list_with_sig_change):
+                # Files with less than SIGNIFICANT_CONTRIBUTION_LINE_LIMIT lines added have no snippets, but their diff
+                # is still needed to count the ones that are too big to analyze
+                commits_to_analyze[commit_hash] = file_list_with_sig_change
+        if not commits_to_analyze:
+            return
+        file_list = []
+        for file_line_stats in commits_to_analyze.values():
+            file_list.extend(file_line_stats.keys())
+        diff_args = get_patch_args(self.src_prefix, self.dest_prefix)
+        for commit_hash, lines in stream_git_log_lines(repo_path, commits_to_analyze.keys(), diff_args,
+                                                       get_diff_pathspecs(file_list), skip_quoted_file_diffs=True):
+            user, yyyy_mm = commit_details[commit_hash]
+            self.break_diff_and_process_each_file(commit_hash, lines, repo_path, commits_to_analyze[commit_hash],
+                                                  user_stats[user], labels, yyyy_mm, user, self.src_prefix,
+                                                  self.dest_prefix)
 
     @staticmethod
     def aggregate_library_helper(import_type, commits, file_extension, libraries, yyyy_mm):
@@ -232,77 +351,62 @@ class ModelTeamGitParser:
         commits[LANGS][file_extension][LIBS][import_type][yyyy_mm].append(libraries)
 
     @staticmethod
-    def get_newly_added_snippets(git_diff, repo_stats):
+    def get_newly_added_snippets(file_diff, repo_stats):
         """
         Given a git diff, return the newly added snippets. These snippets should be continuous chunks of code that got added
         It can be a new function. It should be a minimum of 10 lines of code
-        :param git_diff:
+        :param file_diff: FileDiff
         :return:
         """
-        lines = git_diff.split('\n')
         snippets = []
-        snippet = []
-        for line in lines:
-            if line.startswith('+'):
-                snippet.append(line[1:])  # remove '+' sign
-            else:
-                snippet_len = len(snippet)
-                if snippet_len >= 10:  # minimum lines of code
-                    repo_stats[SS_LC] += snippet_len
-                    snippets.append('\n'.join(snippet))
-                snippet = []  # reset snippet
-        # check for the last snippet
-        snippet_len = len(snippet)
-        if snippet_len >= 10:
-            repo_stats[SS_LC] += snippet_len
-            snippets.append('\n'.join(snippet))
+        for snippet in file_diff.get_added_runs():
+            snippet_len = len(snippet)
+            if snippet_len >= 10:  # minimum lines of code
+                repo_stats[SS_LC] += snippet_len
+                snippets.append('\n'.join(snippet))
         return snippets
 
-    def break_diff_and_process_each_file(self, commit_hash, git_diff, repo_path, file_line_stats, user_commit_stats,
+    def break_diff_and_process_each_file(self, commit_hash, lines, repo_path, file_line_stats, user_commit_stats,
                                          labels, yyyy_mm, curr_user, src_prefix, dest_prefix):
-        # Even in windows git diff uses / as separator
-        file_diffs = re.split(fr'diff --git {src_prefix}/', git_diff)
-
-        for file_diff in file_diffs[1:]:  # ignore the first element
-            file_lines = file_diff.split('\n')
-            file_name = file_lines[0].strip().split(f" {dest_prefix}/")[1]
-            # Special case. Dealing with git diff. "/" is used as separator even in windows
-            filename_with_path = f"{repo_path}/{file_name}"
-            if filename_with_path not in file_line_stats:
-                # Not a big change, so ignoring
-                continue
-            file_extension = get_file_extension(filename_with_path)
-            file_diff_content = "\n".join(file_lines[5:])  # ignore the first 5 lines. They are usually not code
-            parser = get_language_parser(file_extension, file_diff_content, filename_with_path,
-                                         self.keep_only_public_libraries)
+        """
+        :param lines: Decoded lines of the commit's diff, read as they are consumed. See read_file_diffs
+        :param file_line_stats: Files to analyze. See update_line_num_stats
+        """
+        # Other files in the diff are skipped without parsing
+        for file_diff in read_file_diffs(lines, src_prefix, dest_prefix, TOO_BIG_TO_ANALYZE_LIMIT, file_line_stats):
+            file_name = file_diff.path
+            # Parser is only used to check if the language is supported. Snippets are taken from the hunks
+            _, file_extension, parser = get_path_info(file_name)
             if not parser:
                 # Not a supported language, so ignoring
                 continue
             # if file_name not in labels[LIBS] and os.path.isfile(os.path.join(repo_path, file_name)):
-            #     library_names = parser.get_library_names(include_all_libraries=True)
+            #     library_names = parser.get_library_names(None, os.path.join(repo_path, file_name),
+            #                                              include_all_libraries=True,
+            #                                              keep_only_public_libraries=self.keep_only_public_libraries)
             #     if library_names:
             #         labels[LIBS][file_name] = library_names
-            if len(file_diff) > TOO_BIG_TO_ANALYZE_LIMIT:
+            if file_diff.too_big:
                 # Any single file diff with more than 10000 chars changed is too big to analyze
                 self.add_to_time_series_stats(user_commit_stats, file_extension, yyyy_mm, TOO_BIG_TO_ANALYZE, 1)
                 continue
-            lines_added = file_line_stats[filename_with_path][0]
-            lines_deleted = file_line_stats[filename_with_path][1]
+            lines_added = file_line_stats[file_name][0]
+            lines_deleted = file_line_stats[file_name][1]
             if lines_added < SIGNIFICANT_CONTRIBUTION_LINE_LIMIT:
                 # Not a significant contribution
                 continue
-            num_chars_changed = get_num_chars_changed(file_diff_content)
+            num_chars_changed = get_num_chars_changed(file_diff, REFORMAT_CHAR_LIMIT)
             if num_chars_changed < REFORMAT_CHAR_LIMIT:
                 self.add_to_time_series_stats(user_commit_stats, file_extension, yyyy_mm, ADDED, -1 * lines_added)
                 self.add_to_time_series_stats(user_commit_stats, file_extension, yyyy_mm, DELETED, -1 * lines_deleted)
                 continue
             # Set of files with significant contribution for each month
-            self.process_sig_contrib(commit_hash, curr_user, file_diff_content, file_extension, file_name, labels,
-                                     repo_path, user_commit_stats, yyyy_mm)
+            self.process_sig_contrib(commit_hash, curr_user, file_diff, file_extension, file_name, labels, repo_path,
+                                     user_commit_stats, yyyy_mm)
 
-    def process_sig_contrib(self, commit_hash, curr_user, file_diff_content, file_extension, file_name, labels,
-                            repo_path, commits, yyyy_mm):
-        snippets = self.get_newly_added_snippets(file_diff_content, labels)
+    def process_sig_contrib(self, commit_hash, curr_user, file_diff, file_extension, file_name, labels, repo_path,
+                            commits, yyyy_mm):
+        snippets = self.get_newly_added_snippets(file_diff, labels)
         if snippets:
             self.add_to_time_series_stats(commits, file_extension, yyyy_mm, SIGNIFICANT_CONTRIBUTION, len(snippets))
             if file_extension not in commits[LANGS]:
@@ -315,83 +419,101 @@ class ModelTeamGitParser:
 
     def deep_analysis_of_a_commit(self, repo_path, commit_hash, file_line_stats, user_commit_stats, labels, yyyy_mm,
                                   curr_user):
-        src_prefix = random.randint(0, 1000)
-        dest_prefix = random.randint(0, 1000)
-        # Analyze the actual code changes in the given commit
-        file_list = ""
-        # even in windows git diff uses / as separator
-        for file in file_line_stats.keys():
-            file = file.replace(repo_path + "/", "")
-            file_list += f'"{file}" '
-        command = f'git -C {repo_path} show --src-prefix={src_prefix}/ --dst-prefix={dest_prefix}/ {commit_hash} -- {file_list}'
-        git_diff = run_commandline_command(command)
-        if git_diff:
-            self.break_diff_and_process_each_file(commit_hash, git_diff, repo_path, file_line_stats, user_commit_stats,
-                                                  labels, yyyy_mm, curr_user, src_prefix, dest_prefix)
+        # Analyze the actual code changes in the given commit. Worker returns all the files in the commit and
+        # break_diff_and_process_each_file picks only the ones in file_line_stats
+        diff_args = get_patch_args(self.src_prefix, self.dest_prefix)
+        lines = self.git_pool.stream_diff(repo_path, commit_hash, diff_args, skip_quoted_file_diffs=True)
+        self.break_diff_and_process_each_file(commit_hash, lines, repo_path, file_line_stats, user_commit_stats,
+                                              labels, yyyy_mm, curr_user, self.src_prefix, self.dest_prefix)
 
     def process_commit(self, commit, user_commit_stats, labels, repo_path, curr_user):
+        """
+        Process a single commit (e.g. selective re-analysis). Same stats as process_users, which streams all the
+        commits of a repo and should be preferred. Numstat and diff come from long-lived git workers of the repo, so
+        there is no git process per commit
+        :param commit: (commit_hash, commit_timestamp)
+        """
         commit_hash = commit[0]
         commit_timestamp = commit[1]
         yyyy_mm = timestamp_to_yyyy_mm(commit_timestamp)
+        numstat = self.git_pool.get_diff(repo_path, commit_hash, DIFF_TREE_NUMSTAT_ARGS)
         file_list_with_sig_change = self.update_line_num_stats(repo_path, commit_hash, user_commit_stats, yyyy_mm,
-                                                               curr_user)
-        if file_list_with_sig_change:
-            # check if total lines added is < 5000 in all the files
-            total_lines_added = 0
-            for file in file_list_with_sig_change.keys():
-                total_lines_added += file_list_with_sig_change[file][0]
-            if total_lines_added < MAX_DIFF_SIZE:
-                # Any single commit with more than 5000 lines changed is too big to analyze
-                self.deep_analysis_of_a_commit(repo_path, commit_hash, file_list_with_sig_change, user_commit_stats,
-                                               labels, yyyy_mm, curr_user)
+                                                               curr_user, numstat)
+        if self.needs_deep_analysis(file_list_with_sig_change):
+            self.deep_analysis_of_a_commit(repo_path, commit_hash, file_list_with_sig_change, user_commit_stats,
+                                           labels, yyyy_mm, curr_user)
+
+    @staticmethod
+    def needs_deep_analysis(file_list_with_sig_change):
+        if not file_list_with_sig_change:
+            return False
+        # check if total lines added is < 5000 in all the files
+        total_lines_added = 0
+        for file in file_list_with_sig_change.keys():
+            total_lines_added += file_list_with_sig_change[file][0]
+        # Any single commit with more than 5000 lines changed is too big to analyze
+        return total_lines_added < MAX_DIFF_SIZE
 
     def save_libraries(self, repo_level_data, libraries_file_name, repo_name, repo_path):
-        with open(libraries_file_name, "w") as f:
+        with open(libraries_file_name, "wb") as f:
             for file_name in repo_level_data[LIBS].keys():
-                f.write("{")
-                f.write(f"\"{REPO_PATH}\": ")
-                f.write(f"{json.dumps(repo_path)}, ")
-                f.write(f"\"{REPO}\": ")
-                f.write(f"{json.dumps(repo_name)}, ")
-                f.write(f"\"{FILE}\": ")
-                f.write(
-                    f"{json.dumps(file_name)}, \"{IMPORTS}\": {json.dumps(repo_level_data[LIBS][file_name])}")
-                f.write("}\n")
+                write_jsonl(f, make_record(LIBRARY_RECORD, repo_path, repo_name, file_name,
+                                           repo_level_data[LIBS][file_name]))
 
     def load_library_data(self, libraries_file_name, repo_level_data):
         if os.path.exists(libraries_file_name):
-            with open(libraries_file_name, "r") as f:
-                for line in f:
-                    lib_data = json.loads(line)
-                    file_name = lib_data[FILE]
-                    repo_level_data[LIBS][file_name] = lib_data[IMPORTS]
+            for lib_data in read_jsonl(libraries_file_name):
+                file_name = lib_data[FILE]
+                repo_level_data[LIBS][file_name] = lib_data[IMPORTS]
+
+    def extract_repo_stats(self, repo_path, user_stats_output_file_name, user_profiles, repo_level_data, min_months,
+                           usernames, num_months):
+        """
+        Git extraction part of process_single_repo (extract stage). Writes the user stats to tmp-stats and the model
+        inputs to the features file next to it
+        :return: features
+        """
+        repo_name = os.path.basename(repo_path)
+        self.generate_user_profiles(repo_path, user_profiles, repo_level_data, usernames, repo_name, min_months,
+                                    num_months)
+        # if repo_level_data[LIBS]:
+        #     self.save_libraries(repo_level_data, repo_lib_output_file_name, repo_name, repo_path)
+        # TODO: Email validation, A/B profiles
+        features = []
+        if user_profiles:
+            # Also sets TMP_MAX_YYYY_MM of the profiles, so it has to be done before they are saved
+            features = self.build_features(user_profiles, min_months, repo_name)
+            # Snippets and features are written first, a tmp-stats file without them is from an older version
+            snippet_writer = SnippetWriter(get_snippets_file_name(user_stats_output_file_name))
+            try:
+                self.move_snippets_to_file(user_profiles, snippet_writer)
+                write_features(get_features_file_name(user_stats_output_file_name), features,
+                               self.get_remote_repo_path(repo_path, repo_name), snippet_writer)
+            finally:
+                snippet_writer.close()
+            # Store hash to file
+            with open(user_stats_output_file_name, "wb") as f:
+                for user in user_profiles:
+                    self.write_user_profile_to_file(f, repo_name, repo_path, user, user_profiles[user])
+        return features
 
     def process_single_repo(self, repo_path, user_stats_output_file_name, repo_lib_output_file_name,
-                            final_output, min_months, usernames, num_months):
+                            final_output, min_months, usernames, num_months, repo_level_data=None):
         user_profiles = {}
-        repo_level_data = {LIBS: {}, SKILLS: {}, SS_LC: 0}
+        if not repo_level_data:
+            repo_level_data = {LIBS: {}, SKILLS: {}, SS_LC: 0}
+        repo_name = os.path.basename(repo_path)
+        features = None
         if not os.path.exists(user_stats_output_file_name):
-            repo_name = os.path.basename(repo_path)
-            self.generate_user_profiles(repo_path, user_profiles, repo_level_data, usernames, repo_name, min_months,
-                                        num_months)
-            # if repo_level_data[LIBS]:
-            #     self.save_libraries(repo_level_data, repo_lib_output_file_name, repo_name, repo_path)
-            # TODO: Email validation, A/B profiles
-            if user_profiles:
-                # Store hash to file
-                with open(user_stats_output_file_name, "w") as f:
-                    for user in user_profiles:
-                        self.write_user_profile_to_file(f, repo_name, repo_path, user, user_profiles[user])
+            features = self.extract_repo_stats(repo_path, user_stats_output_file_name, user_profiles, repo_level_data,
+                                               min_months, usernames, num_months)
         if not args.skip_model_eval and os.path.exists(user_stats_output_file_name):
-            skill_min_score = float(self.config['modelteam.ai']['skill_min_score'])
-            lop_min_score = float(self.config['modelteam.ai']['lop_min_score'])
-            min_scores = {C2S: skill_min_score, LIFE_OF_PY: lop_min_score, I2S: skill_min_score}
             if not os.path.exists(final_output):
                 # if not repo_level_data[LIBS]:
                 #     self.load_library_data(repo_lib_output_file_name, repo_level_data)
                 # for file in repo_level_data[LIBS].keys():
                 #     file_extension = get_file_extension(file)
-                #     parser = get_language_parser(file_extension, "", file, self.keep_only_public_libraries)
+                #     parser = get_language_parser(file_extension)
                 #     if not parser:
                 #         repo_level_data[LIBS][file] = ""
                 #         continue
@@ -401,77 +523,213 @@ class ModelTeamGitParser:
                 #         imp = imp.strip()
                 #         libs_in_file += parser.get_import_prefix() + imp + "\n"
                 #     repo_level_data[LIBS][file] = libs_in_file
-                # when starting from tmp, we need to get repo details from the jsonl file
-                if not user_profiles:
-                    with open(user_stats_output_file_name, "r") as f:
-                        for line in f:
-                            user_stats = json.loads(line)
-                            # Same repo for all users
-                            repo_name = user_stats[REPO]
-                            repo_path = user_stats[REPO_PATH]
-                            if USER in user_stats and self.is_allowed_user(repo_name, user_stats[USER]):
-                                user_profiles[user_stats[USER]] = user_stats[STATS]
                 has_new_data = 0
-                for model_type in MODEL_TYPES:
-                    models = get_model_list(self.config, model_type)
-                    for model_path in models:
-                        # Evaluate 1 model at a time to avoid memory issues
-                        model_data = init_model(model_path, model_type, self.config, device)
-                        if model_type == C2S:
-                            model_label = f"Skill Prediction@{repo_name}"
-                        elif model_type == LIFE_OF_PY:
-                            model_label = f"Code Quality@{repo_name}"
-                        else:
-                            continue
-                        has_new_data += self.extract_skills(user_profiles, repo_level_data, min_months,
-                                                            model_data, repo_name, model_label)
-                        del model_data
-                        gc.collect()
-                if has_new_data == 0:
-                    print(f"No users with extracted skills found for {repo_path}", flush=True)
-                    return
-                if not user_profiles:
-                    print(f"No user data found for {repo_path}", flush=True)
-                    return
-                remote_repo_path = run_commandline_command(f"git -C {repo_path} config --get remote.origin.url")
-                if remote_repo_path and repo_name in remote_repo_path:
-                    repo_path = remote_repo_path
-                else:
-                    remote_repo_path = None
-                if not args.keep_repo_name:
-                    # This hash is used to dedupe skill profiles in backend merger
-                    if remote_repo_path:
-                        repo_path = sha256_hash(remote_repo_path)
+                score_store = ScoreStore()
+                snippet_reader = SnippetReader(get_snippets_file_name(user_stats_output_file_name))
+                try:
+                    # when starting from tmp, we need to get repo details from the jsonl file
+                    if not user_profiles:
+                        repo_name, repo_path = self.load_user_profiles(user_stats_output_file_name, user_profiles)
+                        features = self.load_features(user_stats_output_file_name, user_profiles, min_months,
+                                                      repo_name, snippet_reader)
+                    for model_type in MODEL_TYPES:
+                        models = get_model_list(self.config, model_type)
+                        for model_path in models:
+                            has_new_data += self.evaluate_model(model_path, model_type, user_profiles, score_store,
+                                                                repo_level_data, features, repo_name, snippet_reader)
+                finally:
+                    snippet_reader.close()
+                self.save_final_output(user_profiles, repo_name, repo_path, final_output, min_months, has_new_data,
+                                       score_store,
+                                       read_remote_repo_path(get_features_file_name(user_stats_output_file_name)))
+
+    def evaluate_repos(self, repo_jobs, min_months):
+        """
+        Two phase evaluation. Each model is loaded once and evaluated on all the repos, instead of loading every model
+        for every repo. Stats are saved to a .partial file between models, so only one repo is in memory at a time
+        :param repo_jobs: List of (user_stats_output_file_name, final_output, repo_level_data)
+        :param min_months:
+        """
+        has_new_data = {}
+        for model_type in MODEL_TYPES:
+            models = get_model_list(self.config, model_type)
+            for model_path in models:
+                for user_stats_output_file_name, final_output, repo_level_data in repo_jobs:
+                    partial_output = f"{final_output}.partial"
+                    user_profiles = {}
+                    if final_output in has_new_data:
+                        repo_name, repo_path = self.load_user_profiles(partial_output, user_profiles)
                     else:
-                        repo_path = sha256_hash(repo_name)
-                    repo_name = anonymize(repo_name)
-                with open(final_output, "w") as fo:
-                    for user in user_profiles:
-                        user_profile = user_profiles[user]
-                        if TMP_MAX_YYYY_MM in user_profile and user_profile[TMP_MAX_YYYY_MM] >= min_months:
-                            self.filter_non_public_data(user_profile)
-                            filter_skills(user_profile, min_scores)
-                            self.write_user_profile_to_file(fo, repo_name, repo_path, user, user_profile)
-
-    def write_user_profile_to_file(self, f, repo_name, repo_path, user, user_profile):
-        f.write("{")
-        f.write(f"\"{VERSION}\": {json.dumps(self.config['modelteam.ai']['version'])}, ")
-        f.write(f"\"{TIMESTAMP}\": {utc_now}, ")
-        f.write(f"\"{REPO_PATH}\": {json.dumps(repo_path)}, ")
-        f.write(f"\"{REPO}\": {json.dumps(repo_name)}, ")
-        f.write(f"\"{USER}\": {json.dumps(user)}, ")
-        f.write(f"\"{STATS}\": {json.dumps(user_profile)}")
-        f.write("}\n")
-
-    def extract_skills(self, user_profiles, repo_level_data, min_months, model_data, repo_name, model_label):
+                        repo_name, repo_path = self.load_user_profiles(user_stats_output_file_name, user_profiles)
+                        has_new_data[final_output] = 0
+                    snippet_reader = SnippetReader(get_snippets_file_name(user_stats_output_file_name))
+                    try:
+                        features = self.load_features(user_stats_output_file_name, user_profiles, min_months,
+                                                      repo_name, snippet_reader)
+                        score_store = ScoreStore()
+                        has_new_data[final_output] += self.evaluate_model(model_path, model_type, user_profiles,
+                                                                          score_store, repo_level_data, features,
+                                                                          repo_name, snippet_reader)
+                    finally:
+                        snippet_reader.close()
+                    with open(partial_output, "wb") as f:
+                        for user in user_profiles:
+                            score_store.save_user(user, user_profiles[user])
+                            self.write_user_profile_to_file(f, repo_name, repo_path, user, user_profiles[user])
+        self.model_registry.release()
+        for user_stats_output_file_name, final_output, repo_level_data in repo_jobs:
+            if final_output not in has_new_data:
+                continue
+            partial_output = f"{final_output}.partial"
+            user_profiles = {}
+            repo_name, repo_path = self.load_user_profiles(partial_output, user_profiles)
+            self.save_final_output(user_profiles, repo_name, repo_path, final_output, min_months,
+                                   has_new_data[final_output], remote_repo_path=read_remote_repo_path(
+                                       get_features_file_name(user_stats_output_file_name)))
+            os.remove(partial_output)
+
+    def load_user_profiles(self, user_stats_file_name, user_profiles):
+        """
+        Load allowed users from a tmp-stats file
+        :return: repo_name, repo_path stored in the file
+        """
+        repo_name = None
+        repo_path = None
+        for user_stats in read_jsonl(user_stats_file_name):
+            # Same repo for all users
+            repo_name = user_stats[REPO]
+            repo_path = user_stats[REPO_PATH]
+            if USER in user_stats and self.is_allowed_user(repo_name, user_stats[USER]):
+                user_profiles[user_stats[USER]] = user_stats[STATS]
+        return repo_name, repo_path
+
+    def load_features(self, user_stats_file_name, user_profiles, min_months, repo_name, snippet_reader):
+        """
+        Features written by the extract stage. Built from the profiles if the tmp-stats file doesn't have them
+        :param snippet_reader: Snippet file of the repo. Snippets of the features are read from it when they are
+        evaluated, so it has to stay open until then
+        """
+        features = read_features(get_features_file_name(user_stats_file_name), user_profiles)
+        if features is None:
+            features = self.build_features(user_profiles, min_months, repo_name, snippet_reader)
+        return features
+
+    @staticmethod
+    def move_snippets_to_file(user_profiles, snippet_writer):
+        """
+        Replace the significant code snippets of the profiles with references into the snippet file
+        """
+        for user_profile in user_profiles.values():
+            for lang_stats in user_profile.get(LANGS, {}).values():
+                for monthly_snippets in lang_stats.get(SIG_CODE_SNIPPETS, {}).values():
+                    for i in range(len(monthly_snippets)):
+                        file_name, snippet_list = monthly_snippets[i]
+                        monthly_snippets[i] = [file_name, [snippet_writer.add(snippet) for snippet in snippet_list]]
+
+    def evaluate_model(self, model_path, model_type, user_profiles, score_store, repo_level_data, features,
+                       repo_name, snippet_reader=None):
+        if model_type == C2S:
+            model_label = f"Skill Prediction@{repo_name}"
+        elif model_type == LIFE_OF_PY:
+            model_label = f"Code Quality@{repo_name}"
+        else:
+            return 0
+        # Model is loaded only if some snippets are not in the inference cache. See eval_llm_model
+        model_data = {"model_type": model_type, "model_tag": get_model_tag(model_path, model_type),
+                      "model_path": model_path}
+        return self.extract_skills(user_profiles, score_store, repo_level_data, features, model_data, model_label,
+                                   snippet_reader)
+
+    @staticmethod
+    def save_incremental_state(repo_path, user_profiles):
+        """
+        --incremental_dir. Save the evaluated profiles with the new watermark for the next run
+        :return: Number of users with a profile from the previous run
+        """
+        repo_state = {}
+        merged_users = 0
+        for user in user_profiles:
+            watermark = user_profiles[user].pop(TMP_WATERMARK, None)
+            if not watermark:
+                # Not extracted incrementally
+                continue
+            repo_state[user] = (watermark["head"], user_profiles[user])
+            if watermark["merged"]:
+                merged_users += 1
+        if repo_state:
+            save_repo_state(args.incremental_dir, repo_path, repo_state)
+        return merged_users
+
+    @staticmethod
+    def get_remote_repo_path(repo_path, repo_name):
+        """
+        :return: remote.origin.url of the repo. "" if there is no remote or it is not of this repo
+        """
+        remote_repo_path = run_commandline_command(f"git -C {repo_path} config --get remote.origin.url")
+        if remote_repo_path and repo_name in remote_repo_path:
+            return remote_repo_path
+        return ""
+
+    def save_final_output(self, user_profiles, repo_name, repo_path, final_output, min_months, has_new_data,
+                          score_store=None, remote_repo_path=None):
+        """
+        :param score_store: Scores that are not in user_profiles yet. None if the profiles were loaded from a file
+        :param remote_repo_path: Saved by the extract stage. Looked up in the repo if None
+        """
+        if args.incremental_dir:
+            if score_store:
+                score_store.save(user_profiles)
+            # Previous profiles have skills even if there are no new snippets
+            has_new_data += self.save_incremental_state(repo_path, user_profiles)
+        if has_new_data == 0:
+            print(f"No users with extracted skills found for {repo_path}", flush=True)
+            return
+        if not user_profiles:
+            print(f"No user data found for {repo_path}", flush=True)
+            return
+        skill_min_score = float(self.config['modelteam.ai']['skill_min_score'])
+        lop_min_score = float(self.config['modelteam.ai']['lop_min_score'])
+        min_scores = {C2S: skill_min_score, LIFE_OF_PY: lop_min_score, I2S: skill_min_score}
+        if remote_repo_path is None:
+            remote_repo_path = self.get_remote_repo_path(repo_path, repo_name)
+        if remote_repo_path:
+            repo_path = remote_repo_path
+        if not args.keep_repo_name:
+            # This hash is used to dedupe skill profiles in backend merger
+            if remote_repo_path:
+                repo_path = sha256_hash(remote_repo_path)
+            else:
+                repo_path = sha256_hash(repo_name)
+            repo_name = anonymize(repo_name)
+        with open(final_output, "wb") as fo:
+            for user in list(user_profiles.keys()):
+                # Profiles are dropped once written, so scores of only one user are expanded to lists at a time
+                user_profile = user_profiles.pop(user)
+                if TMP_MAX_YYYY_MM in user_profile and user_profile[TMP_MAX_YYYY_MM] >= min_months:
+                    if score_store:
+                        score_store.save_user(user, user_profile)
+                    self.filter_non_public_data(user_profile)
+                    filter_skills(user_profile, min_scores)
+                    self.write_user_profile_to_file(fo, repo_name, repo_path, user, user_profile, compatible=True)
+
+    def write_user_profile_to_file(self, f, repo_name, repo_path, user, user_profile, compatible=False):
+        """
+        :param f: File opened in binary mode
+        :param compatible: Write the same json as json.dumps. True for repo-stats, which are merged into the profile
+        """
+        record = make_record(PROFILE_RECORD, self.config['modelteam.ai']['version'], utc_now, repo_path, repo_name,
+                             user, user_profile)
+        write_jsonl(f, record, compatible)
+
+    def build_features(self, user_profiles, min_months, repo_name, snippet_reader=None):
+        """
+        Break the significant code snippets of all the users, languages and months into model inputs, so that they
+        are evaluated together and batches can be made by length. Same for every model
+        :param snippet_reader: Needed if the snippets of the profiles are references into the snippet file
+        :return: List of features
+        """
         global label_file_list
-        has_features = 0
         features = []
-        pbar = None
-        if args.show_progress:
-            total = repo_level_data[SS_LC]
-            if total and total > 0:
-                pbar = tqdm(total=total, desc=model_label, unit="lines")
         for user in user_profiles:
             user_profile = user_profiles[user]
             if SKILLS not in user_profile:
@@ -479,7 +737,7 @@ class ModelTeamGitParser:
             if TMP_MAX_YYYY_MM in user_profile and user_profile[TMP_MAX_YYYY_MM] < min_months:
                 continue
             if LANGS not in user_profile:
-                return 0
+                return []
             lang_stats = user_profile[LANGS]
             # lang, file_name, yyyy_mm, snippet, libs_added, line_count, doc_string_line_count
             for lang in lang_stats:
@@ -503,12 +761,12 @@ class ModelTeamGitParser:
                         if key in label_file_list:
                             is_labeled_file = 1
                         snippet_list = snippets[1]
+                        parser = get_language_parser(get_file_extension(file_name))
+                        if not parser:
+                            continue
                         for snippet in snippet_list:
-                            file_extension = get_file_extension(file_name)
-                            parser = get_language_parser(file_extension, snippet, file_name,
-                                                         self.keep_only_public_libraries)
-                            if not parser:
-                                continue
+                            if snippet_reader:
+                                snippet = snippet_reader.get(snippet)
                             chunks = break_code_snippets_to_chunks(file_name, snippet, T5_CHUNK_CHAR_LIMIT)
                             for chunk in chunks:
                                 lines = chunk.split("\n")
@@ -521,13 +779,18 @@ class ModelTeamGitParser:
                                                  "snippet": chunk, "libs": libs_in_file, "line_count": line_count,
                                                  "is_labeled_file": is_labeled_file,
                                                  "doc_string_line_count": doc_string_line_count})
-                                if len(features) == args.batch_size:
-                                    self.eval_llm_model(model_data, features, user_profiles, pbar)
-                                    has_features += len(features)
-                                    features = []
-        if len(features) > 0:
-            self.eval_llm_model(model_data, features, user_profiles, pbar)
-            has_features += len(features)
+        return features
+
+    def extract_skills(self, user_profiles, score_store, repo_level_data, features, model_data, model_label,
+                       snippet_reader=None):
+        pbar = None
+        if args.show_progress:
+            total = repo_level_data[SS_LC]
+            if total and total > 0:
+                pbar = tqdm(total=total, desc=model_label, unit="lines")
+        has_features = len(features)
+        if has_features > 0:
+            self.eval_llm_model(model_data, features, user_profiles, score_store, pbar, snippet_reader)
         if pbar:
             # some lines get reduced while breaking into chunks
             if pbar.total and pbar.total > pbar.n:
@@ -546,36 +809,81 @@ class ModelTeamGitParser:
                     docstring_line_count += len(norm_docstrings)
         return docstring_line_count
 
-    def eval_llm_model(self, model_data, features, user_profiles, pbar):
+    def eval_llm_model(self, model_data, features, user_profiles, score_store, pbar, snippet_reader=None):
         # print(f"Evaluating {len(features)} snippets for {model_data['model_tag']}", flush=True)
         snippet_key = "snippet"
         if model_data['model_type'] == I2S:
             snippet_key = "libs"
+        # Snippets loaded from the features file are references. Caches only need their hash, and only the snippets
+        # that are tokenized are read, a chunk at a time. See get_snippet_batches
         snippets = [feature[snippet_key] for feature in features]
         if model_data['model_type'] == LIFE_OF_PY:
             limit = LIFE_OF_PY_PREDICTION_LIMIT
         else:
             limit = SKILL_PREDICTION_LIMIT
-        skill_list, score_list, sm_score_list = eval_llm_batch_with_scores(model_data['tokenizer'], device,
-                                                                           model_data['model'], snippets,
-                                                                           model_data['new_tokens'], limit)
-        for i in range(len(features)):
-            lang = features[i]["lang"]
-            yyyy_mm = features[i]["yyyy_mm"]
-            line_count = features[i]["line_count"]
-            doc_string_line_count = features[i]["doc_string_line_count"]
-            is_labeled_file = features[i]["is_labeled_file"]
-            if pbar:
-                pbar.update(line_count)
-            ModelTeamGitParser.accumulate_score(user_profiles[features[i]["user"]], lang, yyyy_mm, score_list[i],
-                                                sm_score_list[i], skill_list[i], line_count, doc_string_line_count,
-                                                model_data['model_tag'], model_data['model_type'] == C2S,
-                                                is_labeled_file)
+        token_budget = args.batch_token_budget
+        if not token_budget:
+            token_budget = args.batch_size * T5_MAX_INPUT_TOKENS
+        skill_list = [None] * len(features)
+        score_list = [None] * len(features)
+        sm_score_list = [None] * len(features)
+        # Only the snippets that are not in the inference cache are sent to the model
+        misses = list(range(len(features)))
+        if self.inference_cache:
+            cached = self.inference_cache.get(model_data['model_tag'], snippets)
+            for i in cached:
+                skill_list[i], score_list[i], sm_score_list[i] = cached[i]
+                if pbar:
+                    pbar.update(features[i]["line_count"])
+            misses = [i for i in misses if i not in cached]
+        if misses:
+            # Only 1 model is loaded at a time to avoid memory issues
+            model = self.model_registry.get(model_data['model_path'], model_data['model_type'])
+            miss_snippets = [snippets[i] for i in misses]
+            ai_utils = get_ai_utils()
+            # Next batches are tokenized and padded while the model runs on the current one. Token ids are cached
+            padded_batches = ai_utils.get_padded_batches(model['tokenizer'], model['tokenizer_fingerprint'],
+                                                         self.token_cache, miss_snippets, token_budget,
+                                                         args.max_pending_batches, snippet_reader, model['is_qwen'])
+            for batch, input_tokens in padded_batches:
+                batch_skills, batch_scores, batch_sm_scores = ai_utils.score_batch(
+                    model['tokenizer'], self.model_registry.device, model['model'], input_tokens, model['new_tokens'],
+                    limit, is_qwen=model['is_qwen'], scorer=model['scorer'], new_token_words=model['new_token_words'])
+                for j in range(len(batch)):
+                    i = misses[batch[j]]
+                    skill_list[i] = batch_skills[j]
+                    score_list[i] = batch_scores[j]
+                    sm_score_list[i] = batch_sm_scores[j]
+                    if pbar:
+                        pbar.update(features[i]["line_count"])
+            if self.inference_cache:
+                self.inference_cache.put(model_data['model_tag'], miss_snippets, [skill_list[i] for i in misses],
+                                         [score_list[i] for i in misses], [sm_score_list[i] for i in misses])
+        self.accumulate_scores(model_data, features, user_profiles, score_store, skill_list, score_list,
+                               sm_score_list)
+
+    @staticmethod
+    def accumulate_scores(model_data, features, user_profiles, score_store, skill_list, score_list, sm_score_list):
+        if model_data['model_type'] == C2S:
+            for i in range(len(features)):
+                user_skills = user_profiles[features[i]["user"]][SKILLS]
+                code_len = features[i]["line_count"]
+                for s in skill_list[i]:
+                    if s not in user_skills:
+                        user_skills[s] = 0
+                    user_skills[s] += code_len
+        # max, min, sum, softmax max, softmax min, softmax sum, count, code_line_count, doc_string_line_count,
+        # is_labeled_file of each skill. Scores are accumulated in feature order, so the sums don't depend on how the
+        # batches were made
+        score_store.accumulate_scores(features, user_profiles, model_data['model_tag'], skill_list, score_list,
+                                      sm_score_list)
 
     @staticmethod
     def filter_non_public_data(user_profile):
         if TMP_MAX_YYYY_MM in user_profile:
             del user_profile[TMP_MAX_YYYY_MM]
+        if TMP_WATERMARK in user_profile:
+            del user_profile[TMP_WATERMARK]
         if LANGS not in user_profile:
             return
         lang_stats = user_profile[LANGS]
@@ -585,35 +893,6 @@ class ModelTeamGitParser:
             if LIBS in lang_stats[lang]:
                 del lang_stats[lang][LIBS]
 
-    @staticmethod
-    def accumulate_score(user_profile, lang, yyyy_mm, scores, sm_scores, skills, code_len, doc_string_len, tag, is_c2s,
-                         is_labeled_file):
-        for i in range(len(skills)):
-            s = skills[i]
-            score = scores[i]
-            sm_score = sm_scores[i]
-            if is_c2s:
-                if s not in user_profile[SKILLS]:
-                    user_profile[SKILLS][s] = 0
-                user_profile[SKILLS][s] += code_len
-            if tag not in user_profile[LANGS][lang][TIME_SERIES][yyyy_mm]:
-                user_profile[LANGS][lang][TIME_SERIES][yyyy_mm][tag] = {}
-            if s not in user_profile[LANGS][lang][TIME_SERIES][yyyy_mm][tag]:
-                # min, max, sum, count, code_line_count, doc_string_line_count, is_labeled_file
-                user_profile[LANGS][lang][TIME_SERIES][yyyy_mm][tag][s] = [score, score, 0, sm_score, sm_score, 0, 0, 0,
-                                                                           0, 0]
-            skill_map = user_profile[LANGS][lang][TIME_SERIES][yyyy_mm][tag][s]
-            skill_map[0] = max(skill_map[0], score)
-            skill_map[1] = min(skill_map[1], score)
-            skill_map[2] += score
-            skill_map[3] = max(skill_map[3], sm_score)
-            skill_map[4] = min(skill_map[4], sm_score)
-            skill_map[5] += sm_score
-            skill_map[6] += 1
-            skill_map[7] += code_len
-            skill_map[8] += doc_string_len
-            skill_map[9] = max(skill_map[9], is_labeled_file)
-
     @staticmethod
     def add_to_skills(skill_stats, monthly_skills_and_scores, model_path, score_type):
         model_name = f"{model_path}::{score_type}"
@@ -634,18 +913,25 @@ def load_label_files(lf_name):
     label_files = set()
     if lf_name:
         print(f"Loading label files from {lf_name}", flush=True)
-        with open(lf_name, "r") as f:
-            for line in f:
-                labels = json.loads(line)
-                if REPO not in labels or FILE not in labels:
-                    continue
-                repo = labels[REPO]
-                file = labels[FILE]
-                label_files.add(get_repo_user_key(repo, file))
+        for labels in read_jsonl(lf_name):
+            if REPO not in labels or FILE not in labels:
+                continue
+            repo = labels[REPO]
+            file = labels[FILE]
+            label_files.add(get_repo_user_key(repo, file))
         print(f"Loaded {len(label_files)} label files", flush=True)
     return label_files
 
 
+def is_tmp_stats_file(file_name):
+    """
+    --start_from_tmp. Only the tmp-stats file of each repo, not the libs, features and snippet files next to it or
+    their partial writes (e.g. _features.jsonl.tmp)
+    """
+    return (file_name.endswith(".jsonl") and not file_name.endswith("_libs.jsonl") and
+            not file_name.endswith(FEATURES_SUFFIX))
+
+
 def gen_user_name(users, team_name, max_len=255):
     if not users:
         return team_name
@@ -671,36 +957,56 @@ def gen_user_name(users, team_name, max_len=255):
 
 
 def merge_json(users, output_file_list, merged_json_file_name, team_name, end_ts):
+    """
+    Same output as json.dump of {user, timestamp, profiles, phc, team}, but each profile is written as soon as it is
+    read, so memory doesn't grow with the number of profiles
+    """
     user = gen_user_name(users, team_name)
     phc = generate_hc(os.path.abspath(sys.argv[0]))
-    merged_profile = {USER: user, TIMESTAMP: utc_now, PROFILES: [], PHC: phc}
+    header = {USER: user, TIMESTAMP: utc_now}
+    footer = {PHC: phc}
     if team_name:
-        merged_profile[TEAM] = team_name
+        footer[TEAM] = team_name
     lines_added = 0
     months = set()
     languages = set()
     skills = set()
     users = set()
 
-    for profile_json in output_file_list:
-        with open(profile_json, "r") as f:
-            for line in f:
-                profile = json.loads(line)
-                users.add(profile[USER])
-                if LANGS in profile[STATS]:
-                    for lang in profile[STATS][LANGS]:
-                        if TIME_SERIES in profile[STATS][LANGS][lang]:
-                            for month in profile[STATS][LANGS][lang][TIME_SERIES]:
-                                if month not in months:
-                                    months.add(month)
-                                if lang not in languages:
-                                    languages.add(lang)
-                                lines_added += profile[STATS][LANGS][lang][TIME_SERIES][month][ADDED]
-                if SKILLS in profile[STATS]:
-                    for skill in profile[STATS][SKILLS]:
-                        if skill not in skills:
-                            skills.add(skill)
-                merged_profile[PROFILES].append(profile)
+    if merged_json_file_name.endswith(".gz"):
+        merged_json_writer = gzip.open(merged_json_file_name, "wt")
+    else:
+        merged_json_writer = open(merged_json_file_name, "w")
+    with merged_json_writer:
+        # Drop the closing brace of the header and the opening brace of the footer
+        merged_json_writer.write(json.dumps(header)[:-1])
+        merged_json_writer.write(f", \"{PROFILES}\": [")
+        num_profiles = 0
+        for profile_json in output_file_list:
+            with open(profile_json, "rb") as f:
+                for line in f:
+                    profile = loads(line)
+                    users.add(profile[USER])
+                    if LANGS in profile[STATS]:
+                        for lang in profile[STATS][LANGS]:
+                            if TIME_SERIES in profile[STATS][LANGS][lang]:
+                                for month in profile[STATS][LANGS][lang][TIME_SERIES]:
+                                    if month not in months:
+                                        months.add(month)
+                                    if lang not in languages:
+                                        languages.add(lang)
+                                    lines_added += profile[STATS][LANGS][lang][TIME_SERIES][month][ADDED]
+                    if SKILLS in profile[STATS]:
+                        for skill in profile[STATS][SKILLS]:
+                            if skill not in skills:
+                                skills.add(skill)
+                    if num_profiles > 0:
+                        merged_json_writer.write(", ")
+                    # repo-stats lines are already in json.dumps format, see save_final_output
+                    merged_json_writer.write(line.rstrip(b"\r\n").decode("utf-8"))
+                    num_profiles += 1
+        merged_json_writer.write("], ")
+        merged_json_writer.write(json.dumps(footer)[1:])
     print("Stats for", user)
 
     time_taken_in_minutes = round((end_ts - utc_now) / 60)
@@ -710,14 +1016,55 @@ def merge_json(users, output_file_list, merged_json_file_name, team_name, end_ts
             ["Number of lines analyzed", lines_added],
             ["Number of skills extracted", len(skills)]]
     print(tabulate(data, headers=["Metric", "Value"], tablefmt="psql", showindex=False, colalign=("left", "right")))
-    if merged_json_file_name.endswith(".gz"):
-        with gzip.open(merged_json_file_name, "wt") as merged_json_writer:
-            json.dump(merged_profile, merged_json_writer)
-    else:
-        with open(merged_json_file_name, "w") as merged_json_writer:
-            json.dump(merged_profile, merged_json_writer)
     print(f"Final Output: {merged_json_file_name}")
-    return merged_profile
+
+
+def init_extraction_worker(worker_args, worker_config_file, worker_allow_list, worker_utc_now, worker_label_files):
+    """
+    Initializer for --workers processes. Module level state is set in __main__, which doesn't run in spawned workers
+    """
+    global args, allow_list_user_repos, utc_now, label_file_list, extraction_parser
+    args = worker_args
+    allow_list_user_repos = worker_allow_list
+    utc_now = worker_utc_now
+    label_file_list = worker_label_files
+    worker_config = configparser.ConfigParser()
+    worker_config.read(worker_config_file)
+    extraction_parser = ModelTeamGitParser(worker_config)
+
+
+def extract_repo_stats_in_worker(repo_path, user_stats_output_file_name, min_months, usernames, num_months):
+    """
+    Runs only the git extraction in a --workers process. Model evaluation happens in the main process once the
+    tmp-stats and features files are written
+    :return: repo_level_data and pdf stats of the repo, which are not part of the tmp-stats file
+    """
+    extraction_parser.pdf_stats = {}
+    repo_level_data = {LIBS: {}, SKILLS: {}, SS_LC: 0}
+    extraction_parser.extract_repo_stats(repo_path, user_stats_output_file_name, {}, repo_level_data, min_months,
+                                         usernames, num_months)
+    extraction_parser.git_pool.close()
+    return repo_level_data, extraction_parser.pdf_stats
+
+
+def mark_repo_processed(leases, manifest, folder, final_output, done=True):
+    if leases:
+        leases.release(folder, done)
+        manifest.add(folder, final_output if os.path.exists(final_output) else None)
+
+
+def save_merged_profile(output_path, usernames, final_outputs, pdf_stats):
+    merged_json = os.path.join(output_path, MT_PROFILE_JSON)
+    end_ts = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
+    if args.compress_output:
+        end_date = datetime.datetime.fromtimestamp(end_ts, tz=datetime.timezone.utc).strftime('%Y-%m-%d')
+        merged_json = f"{merged_json}_{end_date}.gz"
+    merge_json(usernames, final_outputs, merged_json, args.team_name, end_ts)
+    if pdf_stats:
+        # Single User Profile. Generate PDF Report
+        pdf_stats_file = os.path.join(output_path, "tmp-stats", PDF_STATS_JSON)
+        with open(pdf_stats_file, "w") as f:
+            json.dump(pdf_stats, f)
 
 
 def onerror(err):
@@ -751,17 +1098,54 @@ if __name__ == "__main__":
     parser.add_argument('--skip_model_eval', default=False, help='Skip model evaluation', action='store_true')
     parser.add_argument('--keep_repo_name', default=False, help='Retain Full Repo Name', action='store_true')
     parser.add_argument('--parallel_mode', type=str,
-                        help='Check for touch files. Can be -1, 0, 1. -1 -> Run for all 0, 1 -> Run only if hashcode(folder) == value',
+                        help='Check for touch files. Can be -1, 0, 1. -1 -> Run for all 0, 1 -> --shard 0/2, 1/2',
+                        default=None)
+    parser.add_argument('--shard', type=str,
+                        help='i/N. Process only repos with hashcode(folder) %% N == i. Repos are leased in touch-files',
                         default=None)
+    parser.add_argument('--lease_expiry_minutes', type=int,
+                        help='Repo lease of a node that stops sending heartbeats expires after this', default=30)
+    parser.add_argument('--merge_shards', default=False, action='store_true',
+                        help='Merge repo-stats of all the shards into the final profile')
     parser.add_argument('--allow_list', type=str, help='List of repos,users to be allowed. e.g. label data users only',
                         default=None)
     parser.add_argument('--start_from_tmp', default=False, help='Start from tmp', action='store_true')
     parser.add_argument('--label_file_list', type=str, help='Path to the Repo Topics JSONL', default=None)
     # Only needed for team profile
     parser.add_argument('--compress_output', default=False, help='Compress the output', action='store_true')
-    parser.add_argument('--batch_size', type=int, help='Batch size for model evaluation', default=20)
+    parser.add_argument('--batch_size', type=int,
+                        help='Batch size for model evaluation when all snippets are of max length', default=20)
+    parser.add_argument('--batch_token_budget', type=int,
+                        help='Max padded tokens in a batch. Defaults to batch_size x max input tokens', default=None)
+    parser.add_argument('--max_pending_batches', type=int, default=4,
+                        help='Batches padded ahead of the model. Bounds the memory of the batch tensors. 0 to '
+                             'pad each batch only when the model needs it')
+    parser.add_argument('--token_cache_size_mb', type=int, default=TOKEN_CACHE_SIZE_MB,
+                        help='Max size of the in-memory token ids of snippets, shared by models with the same '
+                             'tokenizer. 0 to disable')
+    parser.add_argument('--inference_cache_dir', type=str,
+                        help='Cache of model scores, can be shared across runs. Default: <output_path>/inference-cache',
+                        default=None)
+    parser.add_argument('--incremental_dir', type=str, default=None,
+                        help='Saves the profile and last processed commit of each repo/user here. Later runs process '
+                             'only the new commits and merge them into the saved profile')
+    parser.add_argument('--inference_cache_size_mb', type=int, help='Max size of the inference cache. 0 to disable',
+                        default=1024)
+    parser.add_argument('--workers', type=int,
+                        help='Number of processes for git extraction. Model evaluation runs in the main process',
+                        default=1)
+    parser.add_argument('--two_phase', default=False, action='store_true',
+                        help='Extract all the repos first and then evaluate each model once across all the repos')
+    parser.add_argument('--stage', type=str, choices=["all", "extract", "score"], default="all",
+                        help='extract: git extraction only, writes tmp-stats and features files. score: evaluate the '
+                             'tmp-stats and features files of output_path. Stages can run on different nodes')
 
     args = parser.parse_args()
+    if args.stage == "extract":
+        args.skip_model_eval = True
+    elif args.stage == "score":
+        args.start_from_tmp = True
+        args.two_phase = True
     input_path = args.input_path
     repo_list = args.repo_list
     output_path = args.output_path
@@ -774,9 +1158,20 @@ if __name__ == "__main__":
     utc_now = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
     allow_list_user_repos = load_repo_user_list(args.allow_list)
     label_file_list = load_label_files(args.label_file_list)
-    if (not input_path and not repo_list) or not output_path:
+    if (not input_path and not repo_list and not args.merge_shards and not args.start_from_tmp) or not output_path:
         print("Invalid arguments")
         exit(1)
+    shard_index, shard_count = 0, 1
+    if args.shard:
+        try:
+            shard_index, shard_count = parse_shard(args.shard)
+        except ValueError as e:
+            print(e)
+            exit(1)
+    elif args.parallel_mode is not None and 0 <= int(args.parallel_mode) <= 1:
+        shard_index, shard_count = int(args.parallel_mode), 2
+        args.shard = f"{shard_index}/{shard_count}"
+    manifest_dir = os.path.join(output_path, "manifests")
     if not usernames:
         print("Warning: No user email provided. Will generate stats for all users\nThis will take a very long time",
               flush=True)
@@ -785,6 +1180,17 @@ if __name__ == "__main__":
         if len(usernames) > 5:
             print("Warning: Too many users. This will take a very long time", flush=True)
 
+    if args.merge_shards:
+        if not args.user_emails and not args.team_name:
+            print("--merge_shards needs --user_emails or --team_name")
+            exit(1)
+        final_outputs = sorted(glob.glob(os.path.join(output_path, "repo-stats", "*_user_profile.jsonl")))
+        if not final_outputs:
+            print("No repo-stats found to merge")
+            exit(1)
+        save_merged_profile(output_path, usernames, final_outputs, merge_shard_pdf_stats(manifest_dir))
+        exit(0)
+
     cnt = 0
     skip = 0
     # iterate through all the folders in base_path and use it as repo_path
@@ -812,42 +1218,48 @@ if __name__ == "__main__":
         exit(1)
     randomized_folder_list = random.sample(folder_list, len(folder_list))
     git_parser = ModelTeamGitParser(config)
+    if not args.skip_model_eval and args.inference_cache_size_mb > 0:
+        inference_cache_dir = args.inference_cache_dir
+        if not inference_cache_dir:
+            inference_cache_dir = os.path.join(output_path, "inference-cache")
+        git_parser.inference_cache = InferenceCache(inference_cache_dir, args.inference_cache_size_mb)
+    git_parser.token_cache = TokenCache(args.token_cache_size_mb)
     os.makedirs(output_path, exist_ok=True)
     os.makedirs(os.path.join(output_path, "tmp-stats"), exist_ok=True)
     os.makedirs(os.path.join(output_path, "touch-files"), exist_ok=True)
     os.makedirs(os.path.join(output_path, "repo-stats"), exist_ok=True)
     final_outputs = []
     kill_switch = os.path.join(output_path, "touch-files", "kill_switch_mtgp")
+    leases = None
+    manifest = None
+    if args.shard is not None or args.parallel_mode is not None:
+        leases = RepoLeases(os.path.join(output_path, "touch-files"), args.lease_expiry_minutes * 60)
+        manifest = ShardManifest(manifest_dir, shard_index, shard_count)
+    extraction_pool = None
+    pending_extractions = {}
+    # --two_phase. Repos waiting for model evaluation
+    eval_jobs = {}
+    if args.workers > 1 and not args.start_from_tmp:
+        extraction_pool = ProcessPoolExecutor(max_workers=args.workers, initializer=init_extraction_worker,
+                                              initargs=(args, config_file, allow_list_user_repos, utc_now,
+                                                        label_file_list))
     for folder in randomized_folder_list:
-        if folder.endswith("_libs.jsonl"):
+        if args.start_from_tmp and not is_tmp_stats_file(folder):
             continue
         if (os.path.isdir(folder) and os.path.isdir(os.path.join(folder, ".git"))) or args.start_from_tmp:
-            if args.parallel_mode is not None:
-                par_md = int(args.parallel_mode)
+            if leases:
                 if cnt % 10 == 0 and os.path.exists(kill_switch):
                     print("Kill switch detected. Exiting")
                     break
                 if cnt % 1000 == 0:
                     print(f"Processed {cnt} out of {len(folder_list)} and {skip} skipped")
-                if 0 <= par_md <= 1:
-                    hc = consistent_hash_code(folder)
-                    if hc % 2 != par_md:
-                        skip += 1
-                        continue
-                touch_file = os.path.join(output_path, "touch-files", folder)
-                if os.path.exists(touch_file):
-                    print(f"Skipping {folder} as it is already processed")
+                if not is_in_shard(folder, shard_index, shard_count):
+                    skip += 1
+                    continue
+                if not leases.acquire(folder):
+                    print(f"Skipping {folder} as it is already processed or being processed by another node")
                     skip += 1
                     continue
-                else:
-                    # There is a very tiny chance that another process might create the file
-                    # Randomized file list should have taken care of this
-                    try:
-                        with open(touch_file, "x") as f:
-                            f.write("1")
-                    except FileExistsError:
-                        print(f"Rare Exception: Skipping {folder} as it is already processed")
-                        continue
             cnt += 1
             print(f"Processing {folder}", flush=True)
             if args.start_from_tmp:
@@ -862,25 +1274,69 @@ if __name__ == "__main__":
             final_output = os.path.join(output_path, "repo-stats", f"{file_prefix}_user_profile.jsonl")
             if os.path.exists(final_output):
                 print(f"Skipping {final_output} as it is already processed")
+            elif extraction_pool and not os.path.exists(user_stats_output_file_name):
+                future = extraction_pool.submit(extract_repo_stats_in_worker, repo_path, user_stats_output_file_name,
+                                                min_months, usernames, num_months)
+                pending_extractions[future] = (folder, repo_path, user_stats_output_file_name,
+                                               repo_lib_output_file_name, final_output)
+                continue
+            elif args.two_phase:
+                repo_level_data = {LIBS: {}, SKILLS: {}, SS_LC: 0}
+                if not os.path.exists(user_stats_output_file_name):
+                    git_parser.extract_repo_stats(repo_path, user_stats_output_file_name, {}, repo_level_data,
+                                                  min_months, usernames, num_months)
+                eval_jobs[folder] = (user_stats_output_file_name, final_output, repo_level_data)
+                continue
             else:
                 git_parser.process_single_repo(repo_path, user_stats_output_file_name, repo_lib_output_file_name,
                                                final_output, min_months, usernames, num_months)
             if os.path.exists(final_output):
                 final_outputs.append(final_output)
+            mark_repo_processed(leases, manifest, folder, final_output)
         else:
             print(f"Skipping {folder}")
-    if final_outputs and (args.user_emails or args.team_name):
-        merged_json = os.path.join(output_path, MT_PROFILE_JSON)
-        end_ts = int(datetime.datetime.now(datetime.timezone.utc).timestamp())
-        if args.compress_output:
-            end_date = datetime.datetime.fromtimestamp(end_ts, tz=datetime.timezone.utc).strftime('%Y-%m-%d')
-            merged_json = f"{merged_json}_{end_date}.gz"
-        merge_json(usernames, final_outputs, merged_json, args.team_name, end_ts)
+    if extraction_pool:
+        # tmp-stats files are the hand-off. Evaluate each repo as soon as its extraction is done
+        for future in as_completed(pending_extractions):
+            folder, repo_path, user_stats_output_file_name, repo_lib_output_file_name, final_output = \
+                pending_extractions[future]
+            try:
+                repo_level_data, pdf_stats = future.result()
+            except Exception as e:
+                print(f"Error extracting {repo_path} with error {e}", flush=True)
+                mark_repo_processed(leases, manifest, folder, final_output, done=False)
+                continue
+            git_parser.pdf_stats.update(pdf_stats)
+            if args.two_phase:
+                eval_jobs[folder] = (user_stats_output_file_name, final_output, repo_level_data)
+                continue
+            if os.path.exists(user_stats_output_file_name):
+                git_parser.process_single_repo(repo_path, user_stats_output_file_name, repo_lib_output_file_name,
+                                               final_output, min_months, usernames, num_months, repo_level_data)
+            if os.path.exists(final_output):
+                final_outputs.append(final_output)
+            mark_repo_processed(leases, manifest, folder, final_output)
+        extraction_pool.shutdown()
+    if eval_jobs:
+        if not args.skip_model_eval:
+            repo_jobs = [job for job in eval_jobs.values() if os.path.exists(job[0]) and not os.path.exists(job[1])]
+            git_parser.evaluate_repos(repo_jobs, min_months)
+        for folder, (user_stats_output_file_name, final_output, repo_level_data) in eval_jobs.items():
+            if os.path.exists(final_output):
+                final_outputs.append(final_output)
+            mark_repo_processed(leases, manifest, folder, final_output)
+    if leases:
+        leases.close()
+    if shard_count > 1:
+        # Other shards are still running. Merge is done with --merge_shards once all of them are done
         if git_parser.pdf_stats:
-            # Single User Profile. Generate PDF Report
-            pdf_stats_file = os.path.join(output_path, "tmp-stats", PDF_STATS_JSON)
-            with open(pdf_stats_file, "w") as f:
-                json.dump(git_parser.pdf_stats, f)
+            manifest.save_pdf_stats(git_parser.pdf_stats)
+        print(f"Shard {args.shard} done. Run with --merge_shards to merge repo-stats from all the shards")
+    elif final_outputs and (args.user_emails or args.team_name):
+        save_merged_profile(output_path, usernames, final_outputs, git_parser.pdf_stats)
+    git_parser.git_pool.close()
+    if git_parser.inference_cache:
+        git_parser.inference_cache.close()
     print(f"Processed {cnt} out of {len(folder_list)}")
     if cnt == 0:
         print("No valid repos found")
@@ -5,7 +5,8 @@ from configparser import ConfigParser
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
 
 from modelteam_utils.constants import MODEL_TYPES, C2S, LIFE_OF_PY, I2S
-from modelteam_utils.ai_utils import eval_llm_batch_with_scores, get_model_list, init_model
+from modelteam_utils.ai_utils import eval_llm_batch_with_scores, init_model
+from modelteam_utils.model_utils import get_model_list
 
 arg_parser = argparse.ArgumentParser(description="Download models")
 arg_parser.add_argument("--config", type=str, help="config file")
@@ -32,8 +33,9 @@ for model_type in MODEL_TYPES:
         print(f"Downloading https://huggingface.co/{model_path}", flush=True)
         model_data = init_model(model_path, model_type, model_team_config, device)
         if model_type == C2S or model_type == LIFE_OF_PY or model_type == I2S:
-            skill_list, score_list, sm_score_list = eval_llm_batch_with_scores(model_data['tokenizer'], device,
-                                                                               model_data['model'], [code],
-                                                                               model_data['new_tokens'], 3)
+            skill_list, score_list, sm_score_list = eval_llm_batch_with_scores(
+                model_data['tokenizer'], device, model_data['model'], [code], model_data['new_tokens'], 3,
+                is_qwen=model_data['is_qwen'], scorer=model_data['scorer'],
+                new_token_words=model_data['new_token_words'])
         del model_data
         gc.collect()
@@ -14,6 +14,7 @@ from PyQt5.QtWidgets import (QWidget, QLabel, QRadioButton, QVBoxLayout, QHBoxLa
 from modelteam_utils.constants import USER, REPO, STATS, SKILLS, RELEVANT, NOT_RELEVANT, TOP_SECRET, PROFILES, \
     NR_SKILLS, TIMESTAMP, MT_PROFILE_JSON, PDF_STATS_JSON
 from modelteam_utils.crypto_utils import compress_file, generate_hc
+from modelteam_utils.json_utils import load_json
 from modelteam_utils.utils import filter_skills, sha256_hash, load_skill_config
 from modelteam_utils.utils import trunc_string
 from modelteam_utils.viz_utils import generate_pdf_report
@@ -450,8 +451,7 @@ if __name__ == "__main__":
     config.read(config_file)
     skill_list = config["modelteam.ai"]["skill_list"]
     display_names = load_skill_config(skill_list, only_keys=False)
-    with open(profile_json, "r") as f:
-        merged_profile = json.load(f)
+    merged_profile = load_json(profile_json)
     result, bad_skills = edit_profile(merged_profile, choices_file, args.cli_mode)
     if result == 0 and os.path.exists(choices_file):
         print("Changes were saved. Applying changes...")
@@ -1,17 +1,22 @@
 import gzip
+import json
 import os
 import pickle
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import torch
 import transformers
 from huggingface_hub import try_to_load_from_cache
 from peft import PeftConfig, PeftModel
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, AutoModelForCausalLM, BatchEncoding
 
 from .constants import SKILL_PREDICTION_LIMIT, LIFE_OF_PY_BUCKETS, C2S, LIFE_OF_PY, I2S, MLC, MT_START, MT_END, \
-    LIFE_OF_PY_BUCKET_SIZE
-from .utils import load_file_to_list, convert_list_to_index, load_skill_config
+    LIFE_OF_PY_BUCKET_SIZE, GENERATE_SCORER, FORWARD_SCORER, T5_MAX_INPUT_TOKENS, TOKENIZE_CHUNK_SIZE
+from .model_utils import get_model_scorer, get_model_tag
+from .snippet_utils import get_snippet_size
+from .utils import load_file_to_list, convert_list_to_index, load_skill_config, sha256_hash
 
 
 def get_multi_label_classification_scores(arr, index, names):
@@ -73,65 +78,234 @@ def eval_llm_batch_with_scores_old(tokenizer, device, model, codes, new_tokens,
     return skill_list, next_best_prob_list, soft_max_list
 
 
-def eval_llm_batch_with_scores(tokenizer, device, model, codes, new_tokens, limit=SKILL_PREDICTION_LIMIT,
-                               is_qwen=False):
+def get_seq2seq_scores(model, input_tokens):
+    """
+    Logits of the 2nd new token, same as output.scores[1] of generate(max_new_tokens=2) up to a per-row constant
+    (log_softmax), which doesn't change the ranking or the softmax over new tokens.
+    Encoder runs once and the decoder is fed the greedy first token. Generation loop and logits processors are skipped
+    :param model: Seq2Seq model
+    :param input_tokens: Tokenizer output
+    :return: [batch, vocab] logits
+    """
+    input_ids = input_tokens["input_ids"]
+    attention_mask = input_tokens["attention_mask"]
+    decoder_start_token_id = model.generation_config.decoder_start_token_id
+    if decoder_start_token_id is None:
+        decoder_start_token_id = model.config.decoder_start_token_id
+    encoder_outputs = model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask, return_dict=True)
+    decoder_input_ids = torch.full((input_ids.shape[0], 1), decoder_start_token_id, dtype=torch.long,
+                                   device=input_ids.device)
+    output = model(encoder_outputs=encoder_outputs, attention_mask=attention_mask, decoder_input_ids=decoder_input_ids,
+                   use_cache=True, return_dict=True)
+    first_token = output.logits[:, -1, :].argmax(dim=-1, keepdim=True)
+    output = model(encoder_outputs=encoder_outputs, attention_mask=attention_mask, decoder_input_ids=first_token,
+                   past_key_values=output.past_key_values, use_cache=True, return_dict=True)
+    return output.logits[:, -1, :]
+
+
+def get_qwen_prompts(tokenizer, codes):
+    new_codes = []
+    for prompt in codes:
+        messages = [
+            {"role": "system", "content": "You are Qwen, created by Alibaba Cloud. You are a helpful assistant."},
+            {"role": "user", "content": f"{MT_START}{prompt}{MT_END}"}
+        ]
+        text = tokenizer.apply_chat_template(
+            messages,
+            tokenize=False,
+            add_generation_prompt=True
+        )
+        new_codes.append(text)
+    return new_codes
+
+
+def tokenize_batch(tokenizer, codes, is_qwen=False):
+    """
+    :return: Tokenizer output on cpu. Moved to the device by score_batch
+    """
+    if is_qwen:
+        codes = get_qwen_prompts(tokenizer, codes)
+        return tokenizer(codes, return_tensors="pt", padding=True, truncation=True)
+    return tokenizer(codes, return_tensors="pt", padding=True, truncation=True, max_length=T5_MAX_INPUT_TOKENS)
+
+
+def get_tokenizer_fingerprint(tokenizer):
+    """
+    Tokenizers with the same vocabulary, added tokens and normalization give the same token ids
+    """
+    if tokenizer.is_fast:
+        tokenizer_config = json.loads(tokenizer.backend_tokenizer.to_str())
+        # Set by each call
+        tokenizer_config.pop("truncation", None)
+        tokenizer_config.pop("padding", None)
+    else:
+        tokenizer_config = [type(tokenizer).__name__, sorted(tokenizer.get_vocab().items())]
+    return sha256_hash(json.dumps(tokenizer_config, sort_keys=True))
+
+
+def pad_token_ids(tokenizer, token_ids):
+    """
+    Same tensors as tokenizer(codes, return_tensors="pt", padding=True), built from the token ids of each snippet
+    :param token_ids: int32 token ids of each snippet in the batch. See TokenCache
+    """
+    max_length = max(len(ids) for ids in token_ids)
+    input_ids = torch.full((len(token_ids), max_length), tokenizer.pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(token_ids), max_length), dtype=torch.long)
+    for i in range(len(token_ids)):
+        ids = torch.from_numpy(token_ids[i]).long()
+        if tokenizer.padding_side == "left":
+            input_ids[i, max_length - len(ids):] = ids
+            attention_mask[i, max_length - len(ids):] = 1
+        else:
+            input_ids[i, :len(ids)] = ids
+            attention_mask[i, :len(ids)] = 1
+    return BatchEncoding({"input_ids": input_ids, "attention_mask": attention_mask})
+
+
+def get_snippet_batches(tokenizer, tokenizer_fingerprint, token_cache, snippets, token_budget, snippet_reader=None,
+                        is_qwen=False):
+    """
+    Snippets are sorted by length and tokenized TOKENIZE_CHUNK_SIZE at a time, so the first batches are ready before
+    all the snippets are tokenized. The snippets of each chunk are batched by token count
+    :param token_cache: TokenCache, only the snippets that are not in it are read and tokenized
+    :param token_budget: Max padded tokens in a batch. See get_token_budget_batches
+    :param snippet_reader: Needed if snippets are references into the snippet file
+    :param is_qwen: Snippets are tokenized with the chat prompt and without the T5 max length, same as tokenize_batch
+    :return: Generator of (batch, tokenizer output). Each batch is a list of snippet indices
+    """
     if is_qwen:
-        new_codes = []
-        for prompt in codes:
-            messages = [
-                {"role": "system", "content": "You are Qwen, created by Alibaba Cloud. You are a helpful assistant."},
-                {"role": "user", "content": f"{MT_START}{prompt}{MT_END}"}
-            ]
-            text = tokenizer.apply_chat_template(
-                messages,
-                tokenize=False,
-                add_generation_prompt=True
-            )
-            new_codes.append(text)
-        codes = new_codes
+        def encode(codes, **kwargs):
+            return tokenizer(get_qwen_prompts(tokenizer, codes), **kwargs)
+
+        max_length = None
+    else:
+        encode = tokenizer
+        max_length = T5_MAX_INPUT_TOKENS
+    # Length is close enough to the token count to keep snippets of the same length in the same chunk
+    order = sorted(range(len(snippets)), key=lambda x: get_snippet_size(snippets[x]))
+    for start in range(0, len(order), TOKENIZE_CHUNK_SIZE):
+        chunk = order[start:start + TOKENIZE_CHUNK_SIZE]
+        token_ids = token_cache.get(encode, tokenizer_fingerprint, [snippets[i] for i in chunk], max_length,
+                                    snippet_reader)
+        for batch in get_token_budget_batches([len(ids) for ids in token_ids], token_budget):
+            yield [chunk[j] for j in batch], pad_token_ids(tokenizer, [token_ids[j] for j in batch])
+
+
+def get_padded_batches(tokenizer, tokenizer_fingerprint, token_cache, snippets, token_budget, max_pending_batches,
+                       snippet_reader=None, is_qwen=False):
+    """
+    Tokenize and pad the batches in a background thread, while the model runs on the previous ones. At most
+    max_pending_batches batches are built ahead, so memory stays bounded. See get_snippet_batches
+    :param max_pending_batches: 0 to build each batch only when it is needed
+    :return: Generator of (batch, tokenizer output)
+    """
+    batches = get_snippet_batches(tokenizer, tokenizer_fingerprint, token_cache, snippets, token_budget,
+                                  snippet_reader, is_qwen)
+    if max_pending_batches <= 0:
+        yield from batches
+        return
+    # Each task builds the next batch. Only 1 thread runs them, in order, so the generator and the token cache are
+    # never used by 2 threads at once
+    executor = ThreadPoolExecutor(max_workers=1)
+    pending = deque(executor.submit(next, batches, None) for _ in range(max_pending_batches))
+    try:
+        while True:
+            batch = pending.popleft().result()
+            if batch is None:
+                break
+            pending.append(executor.submit(next, batches, None))
+            yield batch
+    finally:
+        # Consumer stopped early or failed
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def get_unique_words(new_token_words):
+    """
+    Token ids that decode to the same word are scored as one word, like the score map keyed by word. The word keeps
+    the position of its first token id and the score of its last one
+    :param new_token_words: Decoded word of each new token
+    :return: Unique words and the index of the token id that scores each word
+    """
+    word_columns = {}
+    for j, word in enumerate(new_token_words):
+        word_columns[word] = j
+    return list(word_columns.keys()), list(word_columns.values())
+
+
+def score_batch(tokenizer, device, model, input_tokens, new_tokens, limit=SKILL_PREDICTION_LIMIT, is_qwen=False,
+                scorer=GENERATE_SCORER, new_token_words=None):
+    """
+    :param input_tokens: Output of tokenize_batch or pad_token_ids
+    """
     skill_list = []
-    next_best_prob_list = []
-    soft_max_list = []
     max_new_tokens = 2
     score_index = 1
+    if is_qwen:
+        max_new_tokens = 1
+        score_index = 0
     with torch.no_grad():
-        if is_qwen:
-            input_tokens = tokenizer(codes, return_tensors="pt", padding=True, truncation=True).to(device)
-            max_new_tokens = 1
-            score_index = 0
+        input_tokens = input_tokens.to(device)
+        if scorer == FORWARD_SCORER and not is_qwen:
+            scores = get_seq2seq_scores(model, input_tokens)
         else:
-            input_tokens = tokenizer(codes, return_tensors="pt", padding=True, truncation=True, max_length=400).to(
-                device)
-        output = model.generate(**input_tokens, max_new_tokens=max_new_tokens, return_dict_in_generate=True,
-                                output_scores=True, no_repeat_ngram_size=3, do_sample=False, renormalize_logits=True)
-    for i in range(len(codes)):
-        score_map = {}
-        soft_max_map = {}
-        new_token_scores = []
-        words = []
-        for j in new_tokens:
-            word = tokenizer.decode(j)
-            score_map[word] = output.scores[score_index][i][j].item()
-            new_token_scores.append(score_map[word])
-            words.append(word)
-        soft_max_scores = softmax(new_token_scores)
-        for w, s in zip(words, soft_max_scores):
-            soft_max_map[w] = s
-        tmp_results = []
-        tmp_scores = []
-        tmp_orig_scores = []
-        top_n = sorted(score_map, key=score_map.get, reverse=True)[:limit]
-        next_best_pr = next_best_prob(soft_max_map, top_n)
-        for word in top_n:
-            tmp_results.append(word)
-            tmp_scores.append(next_best_pr[word])
-            tmp_orig_scores.append(soft_max_map[word])
-        skill_list.append(tmp_results)
-        next_best_prob_list.append(tmp_scores)
-        soft_max_list.append(tmp_orig_scores)
+            output = model.generate(**input_tokens, max_new_tokens=max_new_tokens, return_dict_in_generate=True,
+                                    output_scores=True, no_repeat_ngram_size=3, do_sample=False,
+                                    renormalize_logits=True)
+            scores = output.scores[score_index]
+        new_tokens = list(new_tokens)
+        if new_token_words is None:
+            new_token_words = [tokenizer.decode(j) for j in new_tokens]
+        words, word_columns = get_unique_words(new_token_words)
+        # [batch, new_tokens] in float64, same precision as the per word softmax
+        new_token_scores = scores.index_select(1, torch.tensor(new_tokens, device=scores.device)).double()
+        soft_max_scores = torch.softmax(new_token_scores, dim=1)
+        word_columns = torch.tensor(word_columns, device=scores.device)
+        word_scores = new_token_scores.index_select(1, word_columns)
+        word_soft_max = soft_max_scores.index_select(1, word_columns)
+        # Stable sort keeps ties in word order, same as sorted() on the score map
+        top_n = torch.sort(word_scores, dim=1, descending=True, stable=True).indices[:, :limit]
+        top_n_soft_max = word_soft_max.gather(1, top_n)
+        # See next_best_prob. Each word is normalized by the probability left after removing the better words
+        better_words_prob = torch.cumsum(top_n_soft_max, dim=1) - top_n_soft_max
+        next_best_pr = top_n_soft_max / (word_soft_max.sum(dim=1, keepdim=True) - better_words_prob)
+        next_best_pr[:, 0] = top_n_soft_max[:, 0]
+    for top_words in top_n.tolist():
+        skill_list.append([words[j] for j in top_words])
+    next_best_prob_list = next_best_pr.tolist()
+    soft_max_list = top_n_soft_max.tolist()
     return skill_list, next_best_prob_list, soft_max_list
 
 
+def eval_llm_batch_with_scores(tokenizer, device, model, codes, new_tokens, limit=SKILL_PREDICTION_LIMIT,
+                               is_qwen=False, scorer=GENERATE_SCORER, new_token_words=None):
+    input_tokens = tokenize_batch(tokenizer, codes, is_qwen)
+    return score_batch(tokenizer, device, model, input_tokens, new_tokens, limit, is_qwen, scorer, new_token_words)
+
+
+def get_token_budget_batches(token_counts, token_budget):
+    """
+    Sort the snippets by token count and group them so that each padded batch (batch size x longest snippet) stays
+    within token_budget. Short snippets are batched together instead of being padded to the length of a long one
+    :param token_counts: Token count of each snippet, with the same truncation as eval_llm_batch_with_scores
+    :param token_budget: Max padded tokens in a batch. A snippet longer than this gets a batch of its own
+    :return: List of batches. Each batch is a list of snippet indices
+    """
+    batches = []
+    batch = []
+    for i in sorted(range(len(token_counts)), key=lambda x: token_counts[x]):
+        # Sorted by length, so the current snippet is the longest in the batch
+        if batch and (len(batch) + 1) * token_counts[i] > token_budget:
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
 def smart_tokenizer_and_embedding_resize(
         new_tokens: [],
         tokenizer: transformers.PreTrainedTokenizer,
@@ -211,19 +385,6 @@ def get_life_of_py_bucket(change):
     return LIFE_OF_PY_BUCKETS[bkt_id]
 
 
-def get_model_list(config, config_key):
-    model_list = []
-    if config_key not in config:
-        return model_list
-    mc = config[config_key]
-    model_list.append(mc["path"])
-    if "alpha.path" in mc:
-        model_list.append(mc["alpha.path"])
-    if "beta.path" in mc:
-        model_list.append(mc["beta.path"])
-    return model_list
-
-
 def get_hf_cache_path_if_present(model_name):
     if os.path.isdir(model_name):
         return model_name
@@ -236,14 +397,17 @@ def get_hf_cache_path_if_present(model_name):
 
 
 def init_model(model_path, model_type, config, device):
-    model_data = {"model_type": model_type, "model_tag": f"{model_type}::{model_path}"}
+    model_data = {"model_type": model_type, "model_tag": get_model_tag(model_path, model_type)}
     if model_type == C2S or model_type == LIFE_OF_PY or model_type == I2S:
+        config_path = model_path
         model_path = get_hf_cache_path_if_present(model_path)
         skill_list = config["modelteam.ai"]["skill_list"]
         peft_config = PeftConfig.from_pretrained(model_path)
         base_model_path = get_hf_cache_path_if_present(peft_config.base_model_name_or_path)
         base_llm = get_hf_cache_path_if_present(base_model_path)
         is_qwen = 'qwen' in model_path.lower() or 'qwen' in base_model_path.lower()
+        model_data["is_qwen"] = is_qwen
+        model_data["scorer"] = get_model_scorer(config, model_type, config_path, is_causal=is_qwen)
         if is_qwen:
             model = AutoModelForCausalLM.from_pretrained(base_model_path, torch_dtype=torch.bfloat16).to(device)
         else:
@@ -258,7 +422,10 @@ def init_model(model_path, model_type, config, device):
         model.eval()
         model_data["model"] = model
         model_data["tokenizer"] = tokenizer
-        model_data["new_tokens"] = new_tokens
+        # Fixed order, so that the words are decoded only once
+        model_data["new_tokens"] = list(new_tokens)
+        model_data["new_token_words"] = [tokenizer.decode(i) for i in model_data["new_tokens"]]
+        model_data["tokenizer_fingerprint"] = get_tokenizer_fingerprint(tokenizer)
     elif model_type == MLC:
         with gzip.open(os.path.join(model_path, "model.pkl.gz"), "rb") as f:
             model = pickle.load(f)
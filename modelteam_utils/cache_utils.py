@@ -0,0 +1,134 @@
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from .snippet_utils import get_snippet_hash
+
+INFERENCE_CACHE_DB = "inference_cache.db"
+# sqlite limits the number of parameters in a query
+MAX_QUERY_PARAMS = 500
+# Evict down to this fraction of the max size, so that eviction doesn't run on every put
+EVICTION_TARGET = 0.9
+TOKEN_CACHE_SIZE_MB = 256
+
+
+class InferenceCache:
+    """
+    On-disk cache of model scores keyed by (model_tag, sha256 of the snippet). The same snippet is evaluated only once
+    per model across cherry-picks, vendored files, repos and reruns. Least recently used entries are evicted once the
+    cache is bigger than max_size_mb. Cache dir can be shared by the nodes of a run
+    """
+
+    def __init__(self, cache_dir, max_size_mb):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.connection = sqlite3.connect(os.path.join(cache_dir, INFERENCE_CACHE_DB), timeout=60)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS scores (model_tag TEXT, snippet_hash TEXT, value TEXT, "
+                                "size INTEGER, last_used REAL, PRIMARY KEY (model_tag, snippet_hash))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)")
+        self.connection.commit()
+
+    def get(self, model_tag, snippets):
+        """
+        :param model_tag:
+        :param snippets: Text or references into the snippet file, only their hashes are needed
+        :return: Map of snippet index to (skills, scores, sm_scores) for the snippets found in the cache
+        """
+        snippet_indices = {}
+        for i in range(len(snippets)):
+            snippet_indices.setdefault(get_snippet_hash(snippets[i]), []).append(i)
+        hashes = list(snippet_indices.keys())
+        results = {}
+        found = []
+        for start in range(0, len(hashes), MAX_QUERY_PARAMS):
+            batch = hashes[start:start + MAX_QUERY_PARAMS]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.connection.execute(f"SELECT snippet_hash, value FROM scores WHERE model_tag = ? AND "
+                                           f"snippet_hash IN ({placeholders})", [model_tag] + batch)
+            for snippet_hash, value in rows:
+                skills, scores, sm_scores = json.loads(value)
+                for i in snippet_indices[snippet_hash]:
+                    results[i] = (skills, scores, sm_scores)
+                found.append(snippet_hash)
+        if found:
+            now = time.time()
+            self.connection.executemany("UPDATE scores SET last_used = ? WHERE model_tag = ? AND snippet_hash = ?",
+                                        [(now, model_tag, snippet_hash) for snippet_hash in found])
+            self.connection.commit()
+        return results
+
+    def put(self, model_tag, snippets, skill_list, score_list, sm_score_list):
+        now = time.time()
+        rows = []
+        for i in range(len(snippets)):
+            value = json.dumps([skill_list[i], score_list[i], sm_score_list[i]])
+            rows.append((model_tag, get_snippet_hash(snippets[i]), value, len(value), now))
+        self.connection.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)", rows)
+        self.connection.commit()
+        self.evict()
+
+    def evict(self):
+        total_size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM scores").fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+        target_size = self.max_size_bytes * EVICTION_TARGET
+        evicted = []
+        for model_tag, snippet_hash, size in self.connection.execute(
+                "SELECT model_tag, snippet_hash, size FROM scores ORDER BY last_used"):
+            if total_size <= target_size:
+                break
+            evicted.append((model_tag, snippet_hash))
+            total_size -= size
+        self.connection.executemany("DELETE FROM scores WHERE model_tag = ? AND snippet_hash = ?", evicted)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+class TokenCache:
+    """
+    In-memory cache of the token ids of each snippet, keyed by (tokenizer fingerprint, max_length, sha256 of the
+    snippet). Snippets are tokenized once per tokenizer, instead of once for batching and again for each batch, and
+    models with the same tokenizer (e.g. alpha/beta models) reuse the ids. Least recently used ids are evicted once
+    the cache is bigger than max_size_mb
+    """
+
+    def __init__(self, max_size_mb=TOKEN_CACHE_SIZE_MB):
+        self.max_size_bytes = max_size_mb * 1024 * 1024
+        self.token_ids = OrderedDict()
+        self.size_bytes = 0
+
+    def get(self, tokenizer, tokenizer_fingerprint, snippets, max_length, snippet_reader=None):
+        """
+        :param tokenizer_fingerprint: See ai_utils.get_tokenizer_fingerprint
+        :param snippet_reader: Needed if snippets are references into the snippet file. Only misses are read
+        :return: int32 token ids of each snippet, truncated to max_length
+        """
+        keys = [(tokenizer_fingerprint, max_length, get_snippet_hash(snippet)) for snippet in snippets]
+        token_ids = [self.token_ids.get(key) for key in keys]
+        misses = [i for i in range(len(snippets)) if token_ids[i] is None]
+        for i in range(len(snippets)):
+            if token_ids[i] is not None:
+                self.token_ids.move_to_end(keys[i])
+        if misses:
+            codes = [snippets[i] for i in misses]
+            if snippet_reader:
+                codes = [snippet_reader.get(code) for code in codes]
+            encoded = tokenizer(codes, truncation=True, max_length=max_length)["input_ids"]
+            for i, ids in zip(misses, encoded):
+                token_ids[i] = np.array(ids, dtype=np.int32)
+                if keys[i] not in self.token_ids and self.max_size_bytes > 0:
+                    self.token_ids[keys[i]] = token_ids[i]
+                    self.size_bytes += token_ids[i].nbytes
+            self.evict()
+        return token_ids
+
+    def evict(self):
+        while self.size_bytes > self.max_size_bytes:
+            _, token_ids = self.token_ids.popitem(last=False)
+            self.size_bytes -= token_ids.nbytes
@@ -68,6 +68,9 @@ MAX_USERS = 1001
 MAX_DIFF_SIZE = 5000
 GIT_DIFF_BATCH_SIZE = 100
 T5_CHUNK_CHAR_LIMIT = 1500
+T5_MAX_INPUT_TOKENS = 400
+# Snippets tokenized at a time ahead of the model. Batches don't span chunks
+TOKENIZE_CHUNK_SIZE = 1024
 # This can be changed in the future. Qwen supports 32K tokens, but it takes a lot of time to train
 QWEN_CHUNK_CHAR_LIMIT = 1500
 
@@ -78,6 +81,9 @@ I2S = 'i2s'
 C2S = 'c2s'
 MLC = 'mlc'
 MODEL_TYPES = [C2S, LIFE_OF_PY]
+# How the skill token scores are read from the model. See eval_llm_batch_with_scores
+GENERATE_SCORER = 'generate'
+FORWARD_SCORER = 'forward'
 RELEVANT = "Relevant"
 NOT_RELEVANT = "Not Relevant"
 TOP_SECRET = "Top Secret"
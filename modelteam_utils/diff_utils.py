@@ -0,0 +1,153 @@
+import re
+
+# @@ -old_start[,old_count] +new_start[,new_count] @@. Count is 1 when it is omitted
+HUNK_HEADER_PATTERN = re.compile(r"@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class Hunk:
+    """
+    One @@ section of a file diff
+    """
+    __slots__ = ("old_start", "old_count", "new_start", "new_count", "lines", "added_runs")
+
+    def __init__(self, old_start, old_count, new_start, new_count):
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        # Diff lines with their "+", "-" or " " prefix
+        self.lines = []
+        # (start, end) ranges of continuous added lines in lines
+        self.added_runs = []
+
+    def get_added_runs(self):
+        """
+        :return: Generator of continuous added lines without the "+" prefix
+        """
+        for start, end in self.added_runs:
+            yield [line[1:] for line in self.lines[start:end]]
+
+
+class FileDiff:
+    """
+    Diff of a single file. Header lines (index, mode, rename, binary, ---/+++) are not kept, only the hunks
+    """
+    __slots__ = ("path", "hunks", "too_big")
+
+    def __init__(self, path):
+        self.path = path
+        self.hunks = []
+        # Hunks are not kept for file diffs that are too big to analyze
+        self.too_big = False
+
+    def get_changed_lines(self, prefix):
+        """
+        :param prefix: "+" for added lines, "-" for deleted lines
+        :return: Generator of changed lines without the prefix
+        """
+        for hunk in self.hunks:
+            for line in hunk.lines:
+                if line.startswith(prefix):
+                    yield line[1:]
+
+    def get_added_runs(self):
+        for hunk in self.hunks:
+            yield from hunk.get_added_runs()
+
+
+def parse_hunk_header(line):
+    """
+    :return: Hunk or None if the line is not a hunk header
+    """
+    match = HUNK_HEADER_PATTERN.match(line)
+    if not match:
+        return None
+    old_start, old_count, new_start, new_count = match.groups()
+    return Hunk(int(old_start), int(old_count or 1), int(new_start), int(new_count or 1))
+
+
+def end_added_run(hunk, run_start):
+    if hunk is not None and run_start is not None:
+        hunk.added_runs.append((run_start, len(hunk.lines)))
+    return None
+
+
+def read_file_diffs(lines, src_prefix, dest_prefix, max_file_diff_chars, file_names=None):
+    """
+    Parse the diff of a commit into FileDiffs while it is being read, one line at a time. Each file diff is parsed
+    once. Hunks of a file diff bigger than max_file_diff_chars (including its header) are not kept
+    :param lines: Decoded lines (without line breaks) of a single commit's diff. None for lines that can't be decoded
+    :param src_prefix: --src-prefix of the diff
+    :param dest_prefix: --dst-prefix of the diff
+    :param max_file_diff_chars: e.g. TOO_BIG_TO_ANALYZE_LIMIT
+    :param file_names: If given (e.g. a set), diffs of other files are skipped
+    :return: Generator of FileDiff. File diffs with lines that can't be decoded are not yielded
+    """
+    file_diff_header = f"diff --git {src_prefix}/"
+    file_diff = None
+    hunk = None
+    run_start = None
+    for line in lines:
+        if line is not None and line.startswith(file_diff_header):
+            run_start = end_added_run(hunk, run_start)
+            if file_diff is not None:
+                yield file_diff
+            header = line[len(file_diff_header):]
+            # Even in windows git diff uses / as separator
+            file_diff = FileDiff(header.strip().split(f" {dest_prefix}/")[1])
+            if file_names is not None and file_diff.path not in file_names:
+                file_diff = None
+            num_chars = len(header) + 1
+            hunk = None
+            continue
+        if file_diff is None:
+            # Commit header before the first file diff or a file diff that is skipped
+            continue
+        if line is None:
+            print(f"Skipping file diff of {file_diff.path}", flush=True)
+            file_diff = None
+            hunk = None
+            run_start = None
+            continue
+        if file_diff.too_big:
+            continue
+        num_chars += len(line) + 1
+        if num_chars > max_file_diff_chars:
+            file_diff.too_big = True
+            file_diff.hunks = []
+            hunk = None
+            run_start = None
+            continue
+        if hunk is None:
+            hunk = parse_hunk_header(line)
+            if hunk:
+                file_diff.hunks.append(hunk)
+                old_remaining = hunk.old_count
+                new_remaining = hunk.new_count
+            continue
+        prefix = line[:1]
+        if prefix == "\\":
+            # \ No newline at end of file
+            continue
+        if prefix == "+":
+            new_remaining -= 1
+            if run_start is None:
+                run_start = len(hunk.lines)
+        else:
+            run_start = end_added_run(hunk, run_start)
+            if prefix == "-":
+                old_remaining -= 1
+            elif prefix == " ":
+                old_remaining -= 1
+                new_remaining -= 1
+            else:
+                # Not a diff line, hunk is truncated
+                hunk = None
+                continue
+        hunk.lines.append(line)
+        if old_remaining <= 0 and new_remaining <= 0:
+            run_start = end_added_run(hunk, run_start)
+            hunk = None
+    end_added_run(hunk, run_start)
+    if file_diff is not None:
+        yield file_diff
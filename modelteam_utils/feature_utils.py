@@ -0,0 +1,70 @@
+import os
+
+from .json_utils import loads, read_jsonl, write_jsonl
+
+FEATURES_SUFFIX = "_features.jsonl"
+# First line of the file. remote.origin.url of the repo, so that the score stage doesn't need the repo
+REMOTE_REPO_PATH = "remote_repo_path"
+# Features are written column wise, FEATURE_CHUNK_SIZE features per line
+FEATURE_CHUNK_SIZE = 1024
+FEATURE_COLUMNS = ["user", "lang", "file_name", "yyyy_mm", "snippet", "libs", "line_count", "is_labeled_file",
+                   "doc_string_line_count"]
+
+
+def get_features_file_name(user_stats_file_name):
+    """
+    :param user_stats_file_name: tmp-stats file of the repo
+    :return: Features file next to it
+    """
+    if user_stats_file_name.endswith(".jsonl"):
+        user_stats_file_name = user_stats_file_name[:-len(".jsonl")]
+    return f"{user_stats_file_name}{FEATURES_SUFFIX}"
+
+
+def write_features(features_file_name, features, remote_repo_path, snippet_writer):
+    """
+    Hand-off from the extract stage to the score stage. Months are written as str, same as the month keys of the
+    profiles loaded from tmp-stats
+    :param features: Model inputs of a repo. See ModelTeamGitParser.build_features
+    :param remote_repo_path: "" if the repo doesn't have a remote
+    :param snippet_writer: Snippets are written here, the features file has only their references
+    """
+    with open(f"{features_file_name}.tmp", "wb") as f:
+        write_jsonl(f, {REMOTE_REPO_PATH: remote_repo_path})
+        for start in range(0, len(features), FEATURE_CHUNK_SIZE):
+            chunk = features[start:start + FEATURE_CHUNK_SIZE]
+            columns = {column: [feature[column] for feature in chunk] for column in FEATURE_COLUMNS}
+            columns["yyyy_mm"] = [str(yyyy_mm) for yyyy_mm in columns["yyyy_mm"]]
+            columns["snippet"] = [snippet_writer.add(snippet) for snippet in columns["snippet"]]
+            write_jsonl(f, columns)
+    os.replace(f"{features_file_name}.tmp", features_file_name)
+
+
+def read_features(features_file_name, user_profiles):
+    """
+    :param user_profiles: Features of users that are not in user_profiles (e.g. --allow_list) are skipped
+    :return: List of features in the order they were written. None if the file doesn't exist, e.g. tmp-stats of an
+    older version. Snippets are references into the snippet file, see SnippetReader
+    """
+    if not os.path.exists(features_file_name):
+        return None
+    features = []
+    records = read_jsonl(features_file_name)
+    # Skip the header
+    next(records)
+    for columns in records:
+        for values in zip(*[columns[column] for column in FEATURE_COLUMNS]):
+            feature = dict(zip(FEATURE_COLUMNS, values))
+            if feature["user"] in user_profiles:
+                features.append(feature)
+    return features
+
+
+def read_remote_repo_path(features_file_name):
+    """
+    :return: remote.origin.url saved by the extract stage. None if the file doesn't exist
+    """
+    if not os.path.exists(features_file_name):
+        return None
+    with open(features_file_name, "rb") as f:
+        return loads(f.readline())[REMOTE_REPO_PATH]
@@ -0,0 +1,293 @@
+import locale
+import subprocess
+from collections import OrderedDict
+from itertools import groupby
+from operator import itemgetter
+
+from .utils import get_supported_extensions, get_file_extension
+
+COMMIT_MARKER = b"\x00"
+FILE_DIFF_HEADER = b"diff --git "
+QUOTED_FILE_DIFF_HEADER = b'diff --git "'
+# Echoed back by git diff-tree --stdin. No diff line can start with \x01
+END_OF_COMMIT = b"\x01end\n"
+# Same output as `git show --numstat --diff-filter=d <commit>`. git log shows no diff for merges unless asked to, --cc
+# is what git show uses by default. Numstat of a --cc merge is against its first parent, not the combined diff
+NUMSTAT_LOG_ARGS = ["--numstat", "--diff-filter=d", "--cc"]
+# diff-tree is plumbing, so recursion and the root commit diff that git log and git show do by default are explicit
+DIFF_TREE_ARGS = ["-r", "--root"]
+# git log and git show detect renames by default (diff.renames), diff-tree doesn't
+DIFF_TREE_NUMSTAT_ARGS = ["-M"] + NUMSTAT_LOG_ARGS
+MAX_DIFF_TREE_WORKERS = 8
+LITERAL_PATHSPEC = ":(literal)"
+# Windows limits the command line to 32K chars
+MAX_PATHSPEC_CHARS = 16000
+
+
+def get_patch_args(src_prefix, dest_prefix):
+    # Renames are reported as new files, same as git show limited to the new file name
+    return ["--patch", "--no-renames", f"--src-prefix={src_prefix}/", f"--dst-prefix={dest_prefix}/"]
+
+
+def decode_git_output(data):
+    """
+    Decode git output the same way subprocess.check_output(..., universal_newlines=True) does
+    :param data: raw bytes
+    :return: decoded text or None if the output can't be decoded
+    """
+    try:
+        text = data.decode(locale.getpreferredencoding(False))
+    except UnicodeDecodeError as e:
+        print(f"Error decoding git output with error {e}", flush=True)
+        return None
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def drop_quoted_file_diffs(lines):
+    """
+    Drop file diffs with quoted (non-ascii or special char) paths. git show can't be limited to these files as their
+    numstat path is quoted too, so they are never analyzed
+    :param lines: lines (bytes) of a single commit's diff
+    :return:
+    """
+    skip_file_diff = False
+    for line in lines:
+        if line.startswith(FILE_DIFF_HEADER):
+            skip_file_diff = line.startswith(QUOTED_FILE_DIFF_HEADER)
+        if not skip_file_diff:
+            yield line
+
+
+def get_commit_output(lines, skip_quoted_file_diffs):
+    if skip_quoted_file_diffs:
+        lines = drop_quoted_file_diffs(lines)
+    return decode_git_output(b"".join(lines))
+
+
+def decode_git_lines(lines):
+    """
+    Decode git output one line at a time. Lines are split on \n only, a lone carriage return is part of the line (e.g.
+    in a string literal), so it doesn't break a hunk. \r\n line endings are dropped, same as decode_git_output
+    :param lines: raw lines (bytes), each ending with \n
+    :return: Generator of lines without line breaks. None for a line that can't be decoded
+    """
+    encoding = locale.getpreferredencoding(False)
+    for line in lines:
+        try:
+            text = line.decode(encoding)
+        except UnicodeDecodeError as e:
+            print(f"Error decoding git output with error {e}", flush=True)
+            yield None
+            continue
+        if text.endswith("\n"):
+            text = text[:-1]
+        if text.endswith("\r"):
+            text = text[:-1]
+        yield text
+
+
+def run_git_log(repo_path, commit_hashes, log_args, pathspecs=None):
+    """
+    Run a single git log over the given commits
+    :return: Generator of raw output lines (bytes). Each commit starts with COMMIT_MARKER followed by its hash
+    """
+    commit_hashes = list(commit_hashes)
+    if not commit_hashes:
+        # git log --stdin without any revision defaults to HEAD
+        return
+    command = ["git", "-C", repo_path, "log", "--no-walk=unsorted", "--stdin", "--format=%x00%H"] + log_args
+    if pathspecs:
+        command.append("--")
+        command.extend(pathspecs)
+    try:
+        process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    except Exception as e:
+        print(f"Error running command: {command} with error {e}", flush=True)
+        return
+    try:
+        # git reads all the revisions from stdin before it starts writing, so this can't deadlock
+        process.stdin.write("".join(f"{commit_hash}\n" for commit_hash in commit_hashes).encode())
+        process.stdin.close()
+        yield from process.stdout
+    except BrokenPipeError as e:
+        print(f"Error running command: {command} with error {e}", flush=True)
+    finally:
+        # If the caller stops early, git exits on the closed pipe
+        process.stdout.close()
+        return_code = process.wait()
+        if return_code > 0:
+            print(f"Error running command: {command} with return code {return_code}", flush=True)
+
+
+def stream_git_log(repo_path, commit_hashes, log_args, pathspecs=None, skip_quoted_file_diffs=False):
+    """
+    Run a single git log over the given commits and yield the output of each commit as soon as it is read.
+    Commits are yielded in the given order. Commits that git filters out (e.g. pathspec doesn't match) are not yielded
+    :param repo_path:
+    :param commit_hashes: Iterable of commit hashes
+    :param log_args: Diff options for git log e.g. NUMSTAT_LOG_ARGS
+    :param pathspecs: Optional list of pathspecs to limit the diff
+    :param skip_quoted_file_diffs: See drop_quoted_file_diffs
+    :return: Generator of (commit_hash, output). output is None if it can't be decoded
+    """
+    commit_hash = None
+    lines = []
+    for line in run_git_log(repo_path, commit_hashes, log_args, pathspecs):
+        if line.startswith(COMMIT_MARKER):
+            if commit_hash:
+                yield commit_hash, get_commit_output(lines, skip_quoted_file_diffs)
+            commit_hash = line[1:].strip().decode()
+            lines = []
+        else:
+            lines.append(line)
+    if commit_hash:
+        yield commit_hash, get_commit_output(lines, skip_quoted_file_diffs)
+
+
+def get_commit_lines(lines):
+    """
+    :param lines: raw git log output
+    :return: Generator of (commit_hash, line) for every line that is not a commit header
+    """
+    commit_hash = None
+    for line in lines:
+        if line.startswith(COMMIT_MARKER):
+            commit_hash = line[1:].strip().decode()
+        elif commit_hash:
+            yield commit_hash, line
+
+
+def stream_git_log_lines(repo_path, commit_hashes, log_args, pathspecs=None, skip_quoted_file_diffs=False):
+    """
+    Same as stream_git_log, but the output of each commit is read line by line as it is consumed, so a big commit is
+    never held in memory. Commits without any output are not yielded
+    :return: Generator of (commit_hash, lines). lines is a generator of decoded lines (see decode_git_lines) that is
+    skipped if it isn't consumed before moving to the next commit
+    """
+    raw_lines = run_git_log(repo_path, commit_hashes, log_args, pathspecs)
+    for commit_hash, commit_lines in groupby(get_commit_lines(raw_lines), key=itemgetter(0)):
+        lines = (line for _, line in commit_lines)
+        if skip_quoted_file_diffs:
+            lines = drop_quoted_file_diffs(lines)
+        yield commit_hash, decode_git_lines(lines)
+
+
+def get_diff_pathspecs(file_paths):
+    """
+    Pathspecs that cover all the given files. Files are matched literally if the list fits in MAX_PATHSPEC_CHARS.
+    Otherwise supported extensions are matched by glob, so the list stays small. Files whose extension only matches
+    after normalization (e.g. foo.p-y) are added as literal paths
+    :param file_paths: relative file paths
+    :return:
+    """
+    file_paths = sorted(set(file_paths))
+    pathspecs = [f"{LITERAL_PATHSPEC}{file_path}" for file_path in file_paths]
+    if sum(len(pathspec) + 1 for pathspec in pathspecs) <= MAX_PATHSPEC_CHARS:
+        return pathspecs
+    pathspecs = [f"*.{ext}" for ext in get_supported_extensions()]
+    for file_path in file_paths:
+        if not file_path.endswith(f".{get_file_extension(file_path)}"):
+            pathspecs.append(f"{LITERAL_PATHSPEC}{file_path}")
+    return pathspecs
+
+
+class GitDiffTreeWorker:
+    """
+    Long-lived `git diff-tree --stdin` process for a repo. Commit hashes are piped in one at a time and the output is
+    read back until git echoes END_OF_COMMIT, so there is no process startup per commit
+    """
+
+    def __init__(self, repo_path, diff_args):
+        self.command = ["git", "-C", repo_path, "diff-tree", "--stdin", "--format=%x00%H"] + DIFF_TREE_ARGS + diff_args
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+    def read_commit(self, commit_hash):
+        """
+        :param commit_hash:
+        :return: Generator of raw output lines for the commit (without the commit header). On error, git is closed
+        """
+        done = False
+        try:
+            if not self.process or self.process.poll() is not None:
+                self.start()
+            self.process.stdin.write(f"{commit_hash}\n".encode() + END_OF_COMMIT)
+            self.process.stdin.flush()
+            for line in self.process.stdout:
+                if line == END_OF_COMMIT:
+                    done = True
+                    return
+                if not line.startswith(COMMIT_MARKER):
+                    yield line
+        except Exception as e:
+            print(f"Error running command: {self.command} for {commit_hash} with error {e}", flush=True)
+        finally:
+            if not done:
+                # git exited before answering (e.g. bad object) or the rest of the output was not read.
+                # It will be restarted for the next commit
+                self.close()
+
+    def get_diff(self, commit_hash, skip_quoted_file_diffs=False):
+        """
+        :param commit_hash:
+        :param skip_quoted_file_diffs: See drop_quoted_file_diffs
+        :return: Output for the commit (without the commit header) or None on error
+        """
+        lines = list(self.read_commit(commit_hash))
+        if not self.process:
+            return None
+        return get_commit_output(lines, skip_quoted_file_diffs)
+
+    def stream_diff(self, commit_hash, skip_quoted_file_diffs=False):
+        """
+        Same as get_diff, but the output is decoded line by line as it is read. See decode_git_lines
+        """
+        lines = self.read_commit(commit_hash)
+        if skip_quoted_file_diffs:
+            lines = drop_quoted_file_diffs(lines)
+        return decode_git_lines(lines)
+
+    def close(self):
+        if self.process:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            self.process.stdout.close()
+            self.process.wait()
+            self.process = None
+
+
+class GitDiffTreePool:
+    """
+    Pool of GitDiffTreeWorker, one per (repo, diff options). Least recently used workers are closed when there are
+    more than max_workers
+    """
+
+    def __init__(self, max_workers=MAX_DIFF_TREE_WORKERS):
+        self.max_workers = max_workers
+        self.workers = OrderedDict()
+
+    def get_worker(self, repo_path, diff_args):
+        key = (repo_path, tuple(diff_args))
+        if key in self.workers:
+            self.workers.move_to_end(key)
+        else:
+            self.workers[key] = GitDiffTreeWorker(repo_path, diff_args)
+            if len(self.workers) > self.max_workers:
+                _, worker = self.workers.popitem(last=False)
+                worker.close()
+        return self.workers[key]
+
+    def get_diff(self, repo_path, commit_hash, diff_args, skip_quoted_file_diffs=False):
+        return self.get_worker(repo_path, diff_args).get_diff(commit_hash, skip_quoted_file_diffs)
+
+    def stream_diff(self, repo_path, commit_hash, diff_args, skip_quoted_file_diffs=False):
+        return self.get_worker(repo_path, diff_args).stream_diff(commit_hash, skip_quoted_file_diffs)
+
+    def close(self):
+        for worker in self.workers.values():
+            worker.close()
+        self.workers.clear()
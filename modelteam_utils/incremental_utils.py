@@ -0,0 +1,143 @@
+import operator
+import os
+
+from .constants import LANGS, TIME_SERIES, SKILLS, START_TIME, END_TIME, SIG_CODE_SNIPPETS, USER, STATS, LIBS, C2S
+from .json_utils import read_jsonl, write_jsonl
+from .score_utils import NUM_SCORE_STATS
+from .utils import sha256_hash, timestamp_to_yyyy_mm
+
+WATERMARK = "watermark"
+# How each slot of the score arrays built by ScoreStore is merged
+# max, min, sum, softmax max, softmax min, softmax sum, count, code_line_count, doc_string_line_count, is_labeled_file
+SCORE_ARRAY_MERGE = [max, min, operator.add, max, min, operator.add, operator.add, operator.add, operator.add, max]
+CODE_LINE_COUNT_INDEX = NUM_SCORE_STATS + 1
+
+
+def get_cutoff_yyyy_mm(since_ts):
+    """
+    Oldest month that is fully in the --num_years window. A full run only has the commits after since_ts in the month
+    of since_ts, so that month of the previous profile is dropped and its commits are processed again
+    :param since_ts: Timestamp of git log --since="<num_months> months ago"
+    """
+    yyyy_mm = timestamp_to_yyyy_mm(since_ts)
+    if yyyy_mm % 100 == 12:
+        return yyyy_mm + 100 - 11
+    return yyyy_mm + 1
+
+
+def merge_score_arrays(old_scores, new_scores):
+    return [merge(old, new) for merge, old, new in zip(SCORE_ARRAY_MERGE, old_scores, new_scores)]
+
+
+def merge_monthly_stats(old_stats, new_stats):
+    """
+    Line counts (add, del, sig_cont, 2big) are added and score arrays of each model and skill are merged
+    """
+    for key, value in new_stats.items():
+        if key not in old_stats:
+            old_stats[key] = value
+        elif isinstance(value, dict):
+            for skill, scores in value.items():
+                if skill in old_stats[key]:
+                    old_stats[key][skill] = merge_score_arrays(old_stats[key][skill], scores)
+                else:
+                    old_stats[key][skill] = scores
+        else:
+            old_stats[key] += value
+    return old_stats
+
+
+def get_skill_line_counts(lang_stats):
+    """
+    Lines of code of each skill, same as SKILLS built by accumulate_scores. It is the sum of code_line_count of the C2S
+    scores in the time series, so the lines of months that are dropped are dropped too
+    """
+    skills = {}
+    for lang in lang_stats:
+        for monthly_stats in lang_stats[lang][TIME_SERIES].values():
+            for key, value in monthly_stats.items():
+                if isinstance(value, dict) and key.split("::")[0] == C2S:
+                    for skill, scores in value.items():
+                        skills[skill] = skills.get(skill, 0) + scores[CODE_LINE_COUNT_INDEX]
+    return skills
+
+
+def merge_user_profiles(old_profile, new_profile, cutoff_yyyy_mm):
+    """
+    Merge the profile of the new commits into the previous profile of the user. Months of the previous profile
+    before cutoff_yyyy_mm are dropped, same as a full run with --num_years. The new profile only has commits in the
+    window. Skills are recomputed from the months that are kept
+    :param cutoff_yyyy_mm: See get_cutoff_yyyy_mm
+    :return: Merged profile with string month keys
+    """
+    merged_langs = {}
+    for profile, min_yyyy_mm in [(old_profile, cutoff_yyyy_mm), (new_profile, 0)]:
+        lang_stats = profile.get(LANGS, {})
+        for lang in lang_stats:
+            merged = merged_langs.setdefault(lang, {TIME_SERIES: {}})
+            for yyyy_mm, monthly_stats in lang_stats[lang].get(TIME_SERIES, {}).items():
+                # Months are int keys before a json round trip
+                if int(yyyy_mm) < min_yyyy_mm:
+                    continue
+                yyyy_mm = str(yyyy_mm)
+                if yyyy_mm in merged[TIME_SERIES]:
+                    merge_monthly_stats(merged[TIME_SERIES][yyyy_mm], monthly_stats)
+                else:
+                    merged[TIME_SERIES][yyyy_mm] = monthly_stats
+            if START_TIME in lang_stats[lang]:
+                start_time = lang_stats[lang][START_TIME]
+                if start_time < min_yyyy_mm:
+                    # First month of the profile that is still in the window
+                    months = [int(yyyy_mm) for yyyy_mm in lang_stats[lang].get(TIME_SERIES, {})
+                              if int(yyyy_mm) >= min_yyyy_mm]
+                    start_time = min(months) if months else None
+                if start_time is not None:
+                    merged[START_TIME] = min(merged.get(START_TIME, start_time), start_time)
+            if END_TIME in lang_stats[lang] and lang_stats[lang][END_TIME] >= min_yyyy_mm:
+                merged[END_TIME] = max(merged.get(END_TIME, lang_stats[lang][END_TIME]), lang_stats[lang][END_TIME])
+            if SIG_CODE_SNIPPETS in lang_stats[lang]:
+                # Saved profiles only mark the languages that had snippets. See save_repo_state
+                merged_snippets = merged.setdefault(SIG_CODE_SNIPPETS, {})
+                for yyyy_mm, monthly_snippets in lang_stats[lang][SIG_CODE_SNIPPETS].items():
+                    if int(yyyy_mm) >= min_yyyy_mm:
+                        merged_snippets.setdefault(str(yyyy_mm), []).extend(monthly_snippets)
+    langs = {}
+    for lang in merged_langs:
+        if merged_langs[lang][TIME_SERIES]:
+            langs[lang] = merged_langs[lang]
+    return {LANGS: langs, SKILLS: get_skill_line_counts(langs)}
+
+
+def get_repo_state_file_name(state_dir, repo_path):
+    return os.path.join(state_dir, f"{sha256_hash(repo_path)}.jsonl")
+
+
+def load_repo_state(state_dir, repo_path):
+    """
+    :return: Map of user to (watermark, profile) saved by the previous run
+    """
+    repo_state = {}
+    state_file_name = get_repo_state_file_name(state_dir, repo_path)
+    if os.path.exists(state_file_name):
+        for user_state in read_jsonl(state_file_name):
+            repo_state[user_state[USER]] = (user_state[WATERMARK], user_state[STATS])
+    return repo_state
+
+
+def save_repo_state(state_dir, repo_path, repo_state):
+    """
+    :param repo_state: Map of user to (watermark, profile). Snippets are not saved as they are already evaluated
+    """
+    os.makedirs(state_dir, exist_ok=True)
+    state_file_name = get_repo_state_file_name(state_dir, repo_path)
+    with open(f"{state_file_name}.tmp", "wb") as f:
+        for user, (watermark, profile) in repo_state.items():
+            langs = {}
+            for lang, lang_stats in profile.get(LANGS, {}).items():
+                langs[lang] = dict(lang_stats)
+                if SIG_CODE_SNIPPETS in langs[lang]:
+                    langs[lang][SIG_CODE_SNIPPETS] = {}
+                if LIBS in langs[lang]:
+                    del langs[lang][LIBS]
+            write_jsonl(f, {USER: user, WATERMARK: watermark, STATS: {LANGS: langs, SKILLS: profile.get(SKILLS, {})}})
+    os.replace(f"{state_file_name}.tmp", state_file_name)
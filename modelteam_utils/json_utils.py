@@ -0,0 +1,119 @@
+import json
+import math
+import re
+
+from .constants import VERSION, TIMESTAMP, REPO_PATH, REPO, USER, STATS, FILE, IMPORTS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    JSON_BACKEND = "orjson"
+    DECODE_ERROR = orjson.JSONDecodeError
+elif msgspec is not None:
+    JSON_BACKEND = "msgspec"
+    DECODE_ERROR = msgspec.DecodeError
+else:
+    JSON_BACKEND = "json"
+    DECODE_ERROR = json.JSONDecodeError
+
+# orjson reads ints that don't fit in 64 bits as floats. Numbers with this many digits are read by json
+LONG_NUMBER_PATTERN = re.compile(r"[0-9]{19}")
+LONG_NUMBER_BYTES_PATTERN = re.compile(rb"[0-9]{19}")
+
+# Fields of each jsonl record, in the order they are written. Profile records are the lines of tmp-stats, .partial
+# and repo-stats files
+PROFILE_RECORD = (VERSION, TIMESTAMP, REPO_PATH, REPO, USER, STATS)
+LIBRARY_RECORD = (REPO_PATH, REPO, FILE, IMPORTS)
+
+
+def make_record(schema, *values):
+    """
+    :param schema: e.g. PROFILE_RECORD
+    :param values: Value of each field of the schema
+    """
+    if len(values) != len(schema):
+        raise ValueError(f"Expected {len(schema)} values for {schema}, got {len(values)}")
+    return dict(zip(schema, values))
+
+
+def has_non_finite_float(obj):
+    """
+    :return: True if obj has a NaN or Infinity float
+    """
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(has_non_finite_float(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(has_non_finite_float(value) for value in obj)
+    return False
+
+
+def dumps(obj, compatible=False):
+    """
+    :param compatible: Output is the same as json.dumps. Needed for files read by the backend or signed. Otherwise
+    orjson/msgspec output is compact and non ascii characters are not escaped, which is fine for files only read by
+    loads (tmp-stats, .partial, incremental state)
+    :return: utf-8 encoded json
+    """
+    if not compatible:
+        data = None
+        try:
+            if JSON_BACKEND == "orjson":
+                # int keys (e.g. yyyy_mm) are written as strings, same as json
+                data = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+            elif JSON_BACKEND == "msgspec":
+                data = msgspec.json.encode(obj)
+        except (TypeError, ValueError, OverflowError):
+            # ints bigger than 64 bits, strings with lone surrogates or keys msgspec can't write
+            pass
+        # orjson and msgspec write NaN and Infinity as null. Objects are scanned only if there is a null in the output
+        if data is not None and (b"null" not in data or not has_non_finite_float(obj)):
+            return data
+    return json.dumps(obj).encode("utf-8")
+
+
+def loads(data):
+    """
+    :param data: str or utf-8 bytes
+    """
+    try:
+        if JSON_BACKEND == "orjson":
+            pattern = LONG_NUMBER_BYTES_PATTERN if isinstance(data, bytes) else LONG_NUMBER_PATTERN
+            if not pattern.search(data):
+                return orjson.loads(data)
+        elif JSON_BACKEND == "msgspec":
+            return msgspec.json.decode(data)
+    except DECODE_ERROR:
+        # json also accepts NaN, ints bigger than 64 bits and lone surrogates
+        pass
+    return json.loads(data)
+
+
+def write_jsonl(f, obj, compatible=False):
+    """
+    :param f: File opened in binary mode
+    """
+    f.write(dumps(obj, compatible))
+    f.write(b"\n")
+
+
+def read_jsonl(file_name):
+    """
+    :return: Generator of records in the jsonl file
+    """
+    with open(file_name, "rb") as f:
+        for line in f:
+            yield loads(line)
+
+
+def load_json(file_name):
+    with open(file_name, "rb") as f:
+        return loads(f.read())
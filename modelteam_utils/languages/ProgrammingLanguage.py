@@ -21,22 +21,20 @@ class ProgrammingLanguage(ABC):
                         pub_libs[language].add(line.split("\t")[0].strip())
         return pub_libs
 
-    def __init__(self, extension, snippet, file_name, keep_only_public_libraries=True):
+    # Parsers are stateless and shared. See register_language_parser
+    def __init__(self, extension):
         self.extension = extension
-        self.snippet = snippet
-        self.file_name = file_name
-        self.keep_only_public_libraries = keep_only_public_libraries
 
     @abstractmethod
     def get_import_prefix(self):
         pass
 
-    def get_library_names(self, include_all_libraries=False):
+    def get_library_names(self, snippet, file_name=None, include_all_libraries=False, keep_only_public_libraries=True):
         if include_all_libraries:
-            lib_list = self.extract_imports(self.get_code_from_file(self.file_name))
+            lib_list = self.extract_imports(self.get_code_from_file(file_name))
         else:
-            lib_list = self.extract_imports(self.snippet)
-        if self.keep_only_public_libraries:
+            lib_list = self.extract_imports(snippet)
+        if keep_only_public_libraries:
             lib_list = self.filter_non_public_libraries(lib_list)
         return lib_list
 
@@ -0,0 +1,81 @@
+import gc
+import importlib
+from functools import lru_cache
+
+from .constants import GENERATE_SCORER
+
+
+def get_model_list(config, config_key):
+    model_list = []
+    if config_key not in config:
+        return model_list
+    mc = config[config_key]
+    model_list.append(mc["path"])
+    if "alpha.path" in mc:
+        model_list.append(mc["alpha.path"])
+    if "beta.path" in mc:
+        model_list.append(mc["beta.path"])
+    return model_list
+
+
+def get_model_scorer(config, config_key, model_path, is_causal=False):
+    """
+    Scorer is set per model with scorer, alpha.scorer or beta.scorer next to the model's path
+    :param is_causal: Causal models (e.g. qwen) always use GENERATE_SCORER. Forward scorer runs a seq2seq encoder
+    """
+    mc = config[config_key]
+    for prefix in ["", "alpha.", "beta."]:
+        if mc.get(f"{prefix}path") == model_path:
+            scorer = mc.get(f"{prefix}scorer", GENERATE_SCORER)
+            if is_causal and scorer != GENERATE_SCORER:
+                print(f"Scorer {scorer} is not supported for {model_path}. Using {GENERATE_SCORER}")
+                return GENERATE_SCORER
+            return scorer
+    return GENERATE_SCORER
+
+
+def get_model_tag(model_path, model_type):
+    return f"{model_type}::{model_path}"
+
+
+def get_ai_utils():
+    """
+    ai_utils imports torch, transformers and peft, which take seconds and hundreds of MB to load. It is imported
+    only when a model is evaluated, so git extraction, --skip_model_eval and merges never load them
+    """
+    return importlib.import_module(".ai_utils", __package__)
+
+
+@lru_cache(maxsize=1)
+def get_device():
+    torch = importlib.import_module("torch")
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+class ModelRegistry:
+    """
+    Keeps the last loaded model resident, so evaluating many repos with the same model loads it only once.
+    Only one model is in memory at a time, the previous one is released before the next one is loaded
+    """
+
+    def __init__(self, config, device=None):
+        """
+        :param device: Picked when the first model is loaded if not given
+        """
+        self.config = config
+        self.device = device
+        self.model_data = None
+
+    def get(self, model_path, model_type):
+        if self.model_data and self.model_data["model_tag"] == get_model_tag(model_path, model_type):
+            return self.model_data
+        self.release()
+        if self.device is None:
+            self.device = get_device()
+        self.model_data = get_ai_utils().init_model(model_path, model_type, self.config, self.device)
+        return self.model_data
+
+    def release(self):
+        if self.model_data:
+            self.model_data = None
+            gc.collect()
@@ -0,0 +1,124 @@
+from itertools import chain
+
+import numpy as np
+
+from .constants import LANGS, TIME_SERIES
+
+# max, min, sum, softmax max, softmax min, softmax sum
+NUM_SCORE_STATS = 6
+# count, code_line_count, doc_string_line_count, is_labeled_file
+NUM_COUNT_STATS = 4
+INITIAL_CAPACITY = 1024
+
+
+class ScoreStore:
+    """
+    Score stats of each (user, lang, yyyy_mm, model tag, skill) in 2 numpy arrays, one row per key, instead of a
+    10 element list per key in the user profile. Rows are written back to the user profile in the same list format
+    (see accumulate_scores) only when the profile is saved
+    """
+
+    def __init__(self):
+        # user -> (lang, yyyy_mm, tag, skill) -> row. Keys are in the order they were added
+        self.rows = {}
+        self.num_rows = 0
+        self.score_stats = np.empty((INITIAL_CAPACITY, NUM_SCORE_STATS), dtype=np.float64)
+        self.count_stats = np.empty((INITIAL_CAPACITY, NUM_COUNT_STATS), dtype=np.int64)
+
+    def grow(self):
+        capacity = 2 * len(self.score_stats)
+        score_stats = np.empty((capacity, NUM_SCORE_STATS), dtype=np.float64)
+        count_stats = np.empty((capacity, NUM_COUNT_STATS), dtype=np.int64)
+        score_stats[:self.num_rows] = self.score_stats[:self.num_rows]
+        count_stats[:self.num_rows] = self.count_stats[:self.num_rows]
+        self.score_stats = score_stats
+        self.count_stats = count_stats
+
+    def add_row(self, user_rows, key, user_profile, score, sm_score):
+        if self.num_rows == len(self.score_stats):
+            self.grow()
+        row = self.num_rows
+        self.num_rows += 1
+        user_rows[key] = row
+        lang, yyyy_mm, tag, skill = key
+        # Stats from a previous run (--incremental_dir) are merged into
+        existing = user_profile[LANGS][lang][TIME_SERIES][yyyy_mm].get(tag, {}).get(skill)
+        if existing:
+            self.score_stats[row] = existing[:NUM_SCORE_STATS]
+            self.count_stats[row] = existing[NUM_SCORE_STATS:]
+        else:
+            self.score_stats[row] = [score, score, 0, sm_score, sm_score, 0]
+            self.count_stats[row] = 0
+        return row
+
+    def get_rows(self, user, user_profile, lang, yyyy_mm, tag, skills, scores, sm_scores):
+        user_rows = self.rows.setdefault(user, {})
+        rows = []
+        for i in range(len(skills)):
+            key = (lang, yyyy_mm, tag, skills[i])
+            row = user_rows.get(key)
+            if row is None:
+                row = self.add_row(user_rows, key, user_profile, scores[i], sm_scores[i])
+            rows.append(row)
+        return rows
+
+    def accumulate_scores(self, features, user_profiles, tag, skill_list, score_list, sm_score_list):
+        """
+        Add the scores of a batch of snippets with grouped reductions. ufunc.at applies the updates in order, so the
+        sums are the same as adding the scores one snippet at a time
+        :param features: Snippets with user, lang, yyyy_mm, line_count, doc_string_line_count and is_labeled_file
+        :param tag: model tag
+        :param skill_list: Top skills of each snippet
+        :param score_list: Score of each skill
+        :param sm_score_list: Softmax score of each skill
+        """
+        rows = []
+        num_skills = []
+        for i in range(len(features)):
+            user = features[i]["user"]
+            feature_rows = self.get_rows(user, user_profiles[user], features[i]["lang"], features[i]["yyyy_mm"], tag,
+                                         skill_list[i], score_list[i], sm_score_list[i])
+            rows.extend(feature_rows)
+            num_skills.append(len(feature_rows))
+        if not rows:
+            return
+        rows = np.array(rows, dtype=np.int64)
+        scores = np.fromiter(chain.from_iterable(score_list[i][:num_skills[i]] for i in range(len(features))),
+                             dtype=np.float64, count=len(rows))
+        sm_scores = np.fromiter(chain.from_iterable(sm_score_list[i][:num_skills[i]] for i in range(len(features))),
+                                dtype=np.float64, count=len(rows))
+        score_stats = self.score_stats
+        np.maximum.at(score_stats[:, 0], rows, scores)
+        np.minimum.at(score_stats[:, 1], rows, scores)
+        np.add.at(score_stats[:, 2], rows, scores)
+        np.maximum.at(score_stats[:, 3], rows, sm_scores)
+        np.minimum.at(score_stats[:, 4], rows, sm_scores)
+        np.add.at(score_stats[:, 5], rows, sm_scores)
+        count_stats = self.count_stats
+        np.add.at(count_stats[:, 0], rows, 1)
+        for column, key in [(1, "line_count"), (2, "doc_string_line_count")]:
+            values = np.array([feature[key] for feature in features], dtype=np.int64)
+            np.add.at(count_stats[:, column], rows, np.repeat(values, num_skills))
+        is_labeled_file = np.array([feature["is_labeled_file"] for feature in features], dtype=np.int64)
+        np.maximum.at(count_stats[:, 3], rows, np.repeat(is_labeled_file, num_skills))
+
+    def save_user(self, user, user_profile):
+        """
+        Write the scores of the user to the profile and drop them from the store
+        """
+        user_rows = self.rows.pop(user, None)
+        if not user_rows:
+            return
+        rows = np.fromiter(user_rows.values(), dtype=np.int64, count=len(user_rows))
+        score_stats = self.score_stats[rows].tolist()
+        count_stats = self.count_stats[rows].tolist()
+        lang_stats = user_profile[LANGS]
+        for (lang, yyyy_mm, tag, skill), scores, counts in zip(user_rows.keys(), score_stats, count_stats):
+            monthly_stats = lang_stats[lang][TIME_SERIES][yyyy_mm]
+            if tag not in monthly_stats:
+                monthly_stats[tag] = {}
+            monthly_stats[tag][skill] = scores + counts
+
+    def save(self, user_profiles):
+        for user in user_profiles:
+            self.save_user(user, user_profiles[user])
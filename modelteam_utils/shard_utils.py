@@ -0,0 +1,185 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+from .utils import consistent_hash_code, sha256_hash
+
+LEASE_SUFFIX = ".lease"
+DONE_SUFFIX = ".done"
+MANIFEST_SUFFIX = ".jsonl"
+PDF_STATS_SUFFIX = "_pdf_stats.json"
+
+
+def parse_shard(shard):
+    """
+    :param shard: i/N e.g. 0/4 is the first of 4 shards
+    :return: (i, N)
+    """
+    parts = shard.split("/")
+    if len(parts) != 2 or not parts[0].isdigit() or not parts[1].isdigit():
+        raise ValueError(f"Invalid shard {shard}. Expected i/N e.g. 0/4")
+    shard_index = int(parts[0])
+    shard_count = int(parts[1])
+    if shard_count < 1 or shard_index >= shard_count:
+        raise ValueError(f"Invalid shard {shard}. i should be between 0 and N-1")
+    return shard_index, shard_count
+
+
+def is_in_shard(folder, shard_index, shard_count):
+    # Same as the old --parallel_mode 0/1 when shard_count is 2
+    return consistent_hash_code(folder) % shard_count == shard_index
+
+
+def get_shard_name(shard_index, shard_count):
+    return f"shard_{shard_index}_of_{shard_count}"
+
+
+class RepoLeases:
+    """
+    Leases on repos shared by all the nodes of a run through a common directory (touch-files).
+    Lease file is created atomically and its mtime is the heartbeat, which a background thread refreshes while the
+    repo is being processed. A lease that is not refreshed for expiry_seconds (crashed node) is broken and the repo is
+    picked up again. A done file is left behind once the repo is processed
+    """
+
+    def __init__(self, lease_dir, expiry_seconds):
+        self.lease_dir = lease_dir
+        self.expiry_seconds = expiry_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.active_leases = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.heartbeat_thread = None
+
+    def get_file_name(self, folder, suffix):
+        return os.path.join(self.lease_dir, f"{sha256_hash(folder)}{suffix}")
+
+    def is_done(self, folder):
+        return os.path.exists(self.get_file_name(folder, DONE_SUFFIX))
+
+    def acquire(self, folder):
+        """
+        :param folder:
+        :return: True if this process now owns the repo
+        """
+        if self.is_done(folder):
+            return False
+        lease_file = self.get_file_name(folder, LEASE_SUFFIX)
+        if not self.create_lease(lease_file, folder):
+            if not self.break_expired_lease(lease_file):
+                return False
+            if not self.create_lease(lease_file, folder):
+                return False
+        with self.lock:
+            self.active_leases[folder] = lease_file
+        self.start_heartbeat()
+        return True
+
+    def create_lease(self, lease_file, folder):
+        try:
+            with open(lease_file, "x") as f:
+                json.dump({"folder": folder, "owner": self.owner, "timestamp": int(time.time())}, f)
+            return True
+        except FileExistsError:
+            return False
+
+    def is_expired(self, lease_file):
+        return time.time() - os.path.getmtime(lease_file) > self.expiry_seconds
+
+    def break_expired_lease(self, lease_file):
+        try:
+            if not self.is_expired(lease_file):
+                return False
+            # Only one node can rename the lease, the others get FileNotFoundError
+            expired_file = f"{lease_file}.{uuid.uuid4().hex}"
+            os.rename(lease_file, expired_file)
+            if not self.is_expired(expired_file):
+                # Another node broke the lease and created a new one after we checked. Give it back
+                os.rename(expired_file, lease_file)
+                return False
+            os.remove(expired_file)
+            print(f"Lease expired. Picking up {lease_file}", flush=True)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def start_heartbeat(self):
+        if self.heartbeat_thread is None:
+            self.heartbeat_thread = threading.Thread(target=self.heartbeat, daemon=True)
+            self.heartbeat_thread.start()
+
+    def heartbeat(self):
+        interval = max(1, self.expiry_seconds // 3)
+        while not self.stop_event.wait(interval):
+            with self.lock:
+                lease_files = list(self.active_leases.values())
+            for lease_file in lease_files:
+                try:
+                    os.utime(lease_file)
+                except OSError as e:
+                    print(f"Error updating lease {lease_file} with error {e}", flush=True)
+
+    def release(self, folder, done=True):
+        """
+        :param folder:
+        :param done: If False, repo can be picked up right away by another node
+        """
+        with self.lock:
+            lease_file = self.active_leases.pop(folder, None)
+        if not lease_file:
+            return
+        if done:
+            with open(self.get_file_name(folder, DONE_SUFFIX), "w") as f:
+                json.dump({"folder": folder, "owner": self.owner, "timestamp": int(time.time())}, f)
+        try:
+            os.remove(lease_file)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        self.stop_event.set()
+        if self.heartbeat_thread:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+
+
+class ShardManifest:
+    """
+    Append only progress log of a shard, one line per repo processed by the shard
+    """
+
+    def __init__(self, manifest_dir, shard_index, shard_count):
+        os.makedirs(manifest_dir, exist_ok=True)
+        shard_name = get_shard_name(shard_index, shard_count)
+        self.file_name = os.path.join(manifest_dir, f"{shard_name}{MANIFEST_SUFFIX}")
+        self.pdf_stats_file_name = os.path.join(manifest_dir, f"{shard_name}{PDF_STATS_SUFFIX}")
+
+    def add(self, folder, final_output):
+        """
+        :param folder:
+        :param final_output: repo-stats file or None if the repo had no output
+        """
+        with open(self.file_name, "a") as f:
+            f.write(json.dumps({"folder": folder, "output": final_output, "host": socket.gethostname(),
+                                "timestamp": int(time.time())}))
+            f.write("\n")
+
+    def save_pdf_stats(self, pdf_stats):
+        with open(self.pdf_stats_file_name, "w") as f:
+            json.dump(pdf_stats, f)
+
+
+def merge_shard_pdf_stats(manifest_dir):
+    """
+    Merge pdf stats saved by each shard. Each repo is processed by only one shard
+    """
+    pdf_stats = {}
+    if os.path.isdir(manifest_dir):
+        for file_name in sorted(os.listdir(manifest_dir)):
+            if file_name.endswith(PDF_STATS_SUFFIX):
+                with open(os.path.join(manifest_dir, file_name), "r") as f:
+                    pdf_stats.update(json.load(f))
+    return pdf_stats
@@ -0,0 +1,109 @@
+import mmap
+import os
+
+from .utils import sha256_hash
+
+SNIPPETS_SUFFIX = "_snippets.bin"
+
+
+def get_snippets_file_name(user_stats_file_name):
+    """
+    :param user_stats_file_name: tmp-stats file of the repo
+    :return: Snippet file next to it
+    """
+    if user_stats_file_name.endswith(".jsonl"):
+        user_stats_file_name = user_stats_file_name[:-len(".jsonl")]
+    return f"{user_stats_file_name}{SNIPPETS_SUFFIX}"
+
+
+def is_snippet_ref(snippet):
+    """
+    :return: True for a [offset, length, sha256] reference into the snippet file, False for snippet text
+    """
+    return isinstance(snippet, list)
+
+
+def get_snippet_hash(snippet):
+    """
+    :param snippet: Reference or text
+    :return: sha256 of the snippet text, without reading the snippet file
+    """
+    if is_snippet_ref(snippet):
+        return snippet[2]
+    return sha256_hash(snippet)
+
+
+def get_snippet_size(snippet):
+    """
+    :param snippet: Reference or text
+    :return: Length in utf-8 bytes of a reference, in chars of a text
+    """
+    if is_snippet_ref(snippet):
+        return snippet[1]
+    return len(snippet)
+
+
+class SnippetWriter:
+    """
+    Append-only file of utf-8 snippets. Only a [offset, length, sha256] reference of each snippet is kept in tmp-stats
+    and features files, so they stay small and fast to reload. Same snippet is stored once
+    """
+
+    def __init__(self, file_name):
+        self.file = open(file_name, "wb")
+        self.offset = 0
+        self.refs = {}
+
+    def add(self, snippet):
+        """
+        :return: Reference to the snippet
+        """
+        snippet_hash = sha256_hash(snippet)
+        ref = self.refs.get(snippet_hash)
+        if ref is None:
+            data = snippet.encode("utf-8")
+            self.file.write(data)
+            ref = [self.offset, len(data), snippet_hash]
+            self.offset += len(data)
+            self.refs[snippet_hash] = ref
+        return ref
+
+    def close(self):
+        self.file.close()
+
+
+class SnippetReader:
+    """
+    Memory-mapped snippet file. Snippets are decoded from a view of the mapping only when they are read
+    """
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.file = None
+        self.view = None
+        if os.path.exists(file_name) and os.path.getsize(file_name) > 0:
+            self.file = open(file_name, "rb")
+            self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.view = memoryview(self.mapping)
+
+    def get(self, snippet):
+        """
+        :param snippet: Reference or text (tmp-stats of an older version)
+        :return: Snippet text
+        """
+        if not is_snippet_ref(snippet):
+            return snippet
+        offset, length, _ = snippet
+        if length == 0:
+            # File has only empty snippets, there is nothing to map
+            return ""
+        if self.view is None:
+            raise ValueError(f"Snippet file {self.file_name} is missing or empty")
+        return str(self.view[offset:offset + length], "utf-8")
+
+    def close(self):
+        if self.file:
+            self.view.release()
+            self.mapping.close()
+            self.file.close()
+            self.file = None
@@ -5,7 +5,9 @@ import math
 import os
 import re
 import subprocess
+from array import array
 from calendar import monthrange
+from functools import lru_cache
 
 from .constants import UNKNOWN, MIN_CHUNK_CHAR_LIMIT, C2S, LIFE_OF_PY, I2S, LANGS, TIME_SERIES, SKILLS
 from .languages.CSharpPL import CSharpPL
@@ -24,6 +26,10 @@ from .languages.RustPL import RustPL
 from .languages.ScalaPL import ScalaPL
 from .languages.SwiftPL import SwiftPL
 
+NON_ALPHANUMERIC_PATTERN = re.compile('[^0-9a-zA-Z]+')
+RENAME_PATTERN = re.compile(r"(.*){.* => (.*)}(.*)")
+PATH_CACHE_SIZE = 16384
+
 
 def get_edit_distance(s1, s2):
     m, n = len(s1), len(s2)
@@ -48,15 +54,81 @@ def get_edit_distance(s1, s2):
     return dp[m][n]
 
 
+def get_bounded_edit_distance(s1, s2, limit):
+    """
+    Edit distance of s1 and s2 if it is less than limit, else limit. Common prefix and suffix are skipped and only the
+    diagonal band |i - j| < limit of the table is filled, one row at a time. Stops as soon as a whole row reaches limit
+    :param s1:
+    :param s2:
+    :param limit:
+    :return:
+    """
+    # Common prefix and suffix don't change the edit distance
+    start = 0
+    while start < len(s1) and start < len(s2) and s1[start] == s2[start]:
+        start += 1
+    end1, end2 = len(s1), len(s2)
+    while end1 > start and end2 > start and s1[end1 - 1] == s2[end2 - 1]:
+        end1 -= 1
+        end2 -= 1
+    s1 = s1[start:end1]
+    s2 = s2[start:end2]
+    m, n = len(s1), len(s2)
+    # Distance is at least the difference in length
+    if abs(m - n) >= limit:
+        return limit
+    if m == 0 or n == 0:
+        return max(m, n)
+    band = limit - 1
+    prev = array('l', [min(j, limit) for j in range(n + 1)])
+    curr = array('l', [limit] * (n + 1))
+    for i in range(1, m + 1):
+        low = max(1, i - band)
+        high = min(n, i + band)
+        curr[low - 1] = min(i, limit) if low == 1 else limit
+        row_min = curr[low - 1]
+        c1 = s1[i - 1]
+        for j in range(low, high + 1):
+            if c1 == s2[j - 1]:
+                d = prev[j - 1]
+            else:
+                d = min(prev[j - 1], prev[j], curr[j - 1]) + 1
+                if d > limit:
+                    d = limit
+            curr[j] = d
+            if d < row_min:
+                row_min = d
+        if high < n:
+            # Outside the band. Read by the next row
+            curr[high + 1] = limit
+        if row_min >= limit:
+            return limit
+        prev, curr = curr, prev
+    return prev[n]
+
+
 def get_file_extension(file_path):
     base_name, ext = os.path.splitext(file_path)
     # remove all non alphanumeric characters
-    ext = re.sub('[^0-9a-zA-Z]+', '', ext)
+    ext = NON_ALPHANUMERIC_PATTERN.sub('', ext)
     if not ext:
         ext = UNKNOWN
     return ext
 
 
+@lru_cache(maxsize=PATH_CACHE_SIZE)
+def get_path_info(file_path):
+    """
+    Same few thousand paths show up in most commits of a repo, so this is memoized
+    :param file_path: Path from git numstat or diff. Renames in numstat are /home/{ xyx => abc }/test.py
+    :return: (path after the rename, extension, parser). parser is None if the language is not supported
+    """
+    if "=>" in file_path:
+        file_path = RENAME_PATTERN.sub(r"\1\2\3", file_path)
+    file_extension = get_file_extension(file_path)
+    return file_path, file_extension, get_language_parser(file_extension)
+
+
 def check_for_unsafe_command(command):
     cmd_parts = command.split(";")
     cmd_parts.extend(command.split("&&"))
@@ -91,24 +163,24 @@ def get_num_days_in_month(yyyy_mm):
     return monthrange(int(year), int(month))[1]
 
 
-def get_num_chars_changed(git_diff):
-    # Check if the change is just a reformat
-    lines = git_diff.strip().split('\n')
-    added = []
-    deleted = []
-    for line in lines:
-        if line.startswith('+'):
-            added.append(line[1:])
-        if line.startswith('-'):
-            deleted.append(line[1:])
+def get_num_chars_changed(file_diff, limit=None):
+    """
+    Check if the change is just a reformat
+    :param file_diff: FileDiff
+    :param limit: If given, the result is exact only below limit (e.g. REFORMAT_CHAR_LIMIT), which is much faster
+    :return: Edit distance between the added and deleted code ignoring whitespace
+    """
+    added = file_diff.get_changed_lines('+')
+    deleted = file_diff.get_changed_lines('-')
     added_clean = "".join(added).replace("\n", "").replace("\t", "").replace(" ", "")
     deleted_clean = "".join(deleted).replace("\n", "").replace("\t", "").replace(" ", "")
+    if limit:
+        return get_bounded_edit_distance(added_clean, deleted_clean, limit)
     return get_edit_distance(added_clean, deleted_clean)
 
 
 def get_supported_extensions():
-    return ["py", "js", "ts", "jsx", "tsx", "java", "cs", "go", "cpp", "c", "h", "php", "rb", "rs", "scala", "swift",
-            "kt", "kts", "lua", "dart", "ex", "exs"]
+    return list(LANGUAGE_PARSERS.keys())
 
 
 def get_extension_to_language_map():
@@ -143,39 +215,43 @@ def get_supported_languages():
             "c#", "rust", "scala", "swift", "kotlin", "lua", "dart", "elixir"]
 
 
-def get_language_parser(file_extension, file_diff_content, filename, keep_only_public_libraries):
-    if "go" == file_extension:
-        return GoPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "py" == file_extension:
-        return PythonPL("py", file_diff_content, filename, keep_only_public_libraries)
-    elif "js" == file_extension or "jsx" == file_extension or "ts" == file_extension or "tsx" == file_extension:
-        return JavaScriptPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "java" == file_extension:
-        return JavaPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "cpp" == file_extension or "c" == file_extension or "h" == file_extension:
-        return CppPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "php" == file_extension:
-        return PhpPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "rb" == file_extension:
-        return RubyPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "cs" == file_extension:
-        return CSharpPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "rs" == file_extension:
-        return RustPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "scala" == file_extension:
-        return ScalaPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "swift" == file_extension:
-        return SwiftPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "kt" == file_extension or "kts" == file_extension:
-        return KotlinPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "lua" == file_extension:
-        return LuaPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "dart" == file_extension:
-        return DartPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    elif "ex" == file_extension or "exs" == file_extension:
-        return ElixirPL(file_extension, file_diff_content, filename, keep_only_public_libraries)
-    else:
-        return None
+# Extension to parser. Parsers are stateless, so there is a single instance for each extension
+LANGUAGE_PARSERS = {}
+
+
+def register_language_parser(parser_class, extensions):
+    """
+    Add a language. Files with these extensions are analyzed by parser_class
+    :param parser_class: ProgrammingLanguage subclass
+    :param extensions:
+    """
+    for extension in extensions:
+        LANGUAGE_PARSERS[extension] = parser_class(extension)
+
+
+register_language_parser(PythonPL, ["py"])
+register_language_parser(JavaScriptPL, ["js", "ts", "jsx", "tsx"])
+register_language_parser(JavaPL, ["java"])
+register_language_parser(CSharpPL, ["cs"])
+register_language_parser(GoPL, ["go"])
+register_language_parser(CppPL, ["cpp", "c", "h"])
+register_language_parser(PhpPL, ["php"])
+register_language_parser(RubyPL, ["rb"])
+register_language_parser(RustPL, ["rs"])
+register_language_parser(ScalaPL, ["scala"])
+register_language_parser(SwiftPL, ["swift"])
+register_language_parser(KotlinPL, ["kt", "kts"])
+register_language_parser(LuaPL, ["lua"])
+register_language_parser(DartPL, ["dart"])
+register_language_parser(ElixirPL, ["ex", "exs"])
+
+
+def get_language_parser(file_extension):
+    """
+    :param file_extension:
+    :return: Parser for the extension or None if the language is not supported
+    """
+    return LANGUAGE_PARSERS.get(file_extension)
 
 
 # Splitting based on training data. Ideally we can split for each language
@@ -269,7 +345,7 @@ def is_test(id_str, test_ratio=20):
 # TODO: Try overlapping chunks
 def break_code_snippets_to_chunks(file_name, code, chunk_char_limit, sep=None):
     file_ext = get_file_extension(file_name)
-    parser = get_language_parser(file_ext, code, file_name, True)
+    parser = get_language_parser(file_ext)
     if not parser:
         print(f"Unknown language {file_ext} for file {file_name}", flush=True)
         return []
@@ -1,4 +1,3 @@
-import json
 import os
 from datetime import datetime, timedelta
 
@@ -9,6 +8,7 @@ from reportlab.pdfgen import canvas
 from wordcloud import WordCloud
 
 from .constants import USER, REPO, STATS, SKILLS, LANGS, TIME_SERIES, ADDED, DELETED, PROFILES, NR_SKILLS
+from .json_utils import loads, load_json
 from .utils import get_extension_to_language_map, yyyy_mm_to_quarter, trunc_string
 
 
@@ -141,8 +141,8 @@ def generate_pdf_report(merged_json_file, pdf_stats_file, output_path):
     merged_lang_stats = {}
     wc_file = os.path.join(output_path, "wordcloud.png")
     image_files = []
-    with open(merged_json_file, "r") as f:
-        merged_profile = json.load(f)
+    with open(merged_json_file, "rb") as f:
+        merged_profile = loads(f.read())
         user = merged_profile[USER]
         for user_stats in merged_profile[PROFILES]:
             repo = user_stats[REPO]
@@ -181,8 +181,7 @@ def generate_pdf_report(merged_json_file, pdf_stats_file, output_path):
     if merged_skills:
         generate_tag_cloud(merged_skills, wc_file)
         image_files.append(wc_file)
-    with open(pdf_stats_file, "r") as f:
-        pdf_stats = json.load(f)
+    pdf_stats = load_json(pdf_stats_file)
     repo_qtr_stats = {}
     for repo in pdf_stats.keys():
         repo_qtr_stats[repo] = {}
@@ -108,10 +108,13 @@ def run_model_team_git_parser(repo_list, email_id, num_years, is_dev_mode, team_
     if team_name:
         team_path = get_output_path(team_name)
         output_path = os.path.join(team_path, curr_date)
+        # Outside the dated folder, so that it is reused across runs and not deleted by force_rerun
+        inference_cache_dir = os.path.join(team_path, "inference-cache")
     else:
         # Sanitize the email ID for the output path
         email_path = get_output_path(email_id)
         output_path = os.path.join(email_path, curr_date)
+        inference_cache_dir = os.path.join(email_path, "inference-cache")
 
     if force_rerun and os.path.exists(output_path) and output_path != "/":
         print(f"\033[91mDeleting the existing profile in {output_path} directory\033[0m")
@@ -128,6 +131,7 @@ def run_model_team_git_parser(repo_list, email_id, num_years, is_dev_mode, team_
         "--output_path", output_path,
         "--config", config,
         "--num_years", str(num_years),
+        "--inference_cache_dir", inference_cache_dir,
         "--show_progress"
     ]
     # if repo_list is a file, pass it as --repo_list else pass it as --input_path
@@ -143,6 +147,9 @@ def run_model_team_git_parser(repo_list, email_id, num_years, is_dev_mode, team_
         cmd += ["--user_emails", email_id]
     if team_name:
         cmd += ["--team_name", team_name, "--compress_output"]
+        if not force_rerun:
+            # Team refreshes only process the commits since the previous run
+            cmd += ["--incremental_dir", os.path.join(team_path, "incremental-state")]
 
     # Run the process
     run_command_stream(cmd)
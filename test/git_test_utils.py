@@ -0,0 +1,41 @@
+import os
+import subprocess
+
+
+def git(repo_path, *git_args):
+    return subprocess.check_output(["git", "-C", repo_path] + list(git_args), universal_newlines=True)
+
+
+def init_repo(repo_path):
+    os.makedirs(repo_path, exist_ok=True)
+    git(repo_path, "init", "-q", "-b", "main")
+    git(repo_path, "config", "user.email", "dev@example.com")
+    git(repo_path, "config", "user.name", "dev")
+    git(repo_path, "config", "commit.gpgsign", "false")
+
+
+def write_file(repo_path, file_name, content):
+    file_path = os.path.join(repo_path, file_name)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as f:
+        f.write(content)
+
+
+def commit(repo_path, message, files=None, timestamp=None):
+    """
+    :param files: Map of file name to content. None content deletes the file
+    :param timestamp: Author and committer date in seconds
+    :return: Commit hash
+    """
+    for file_name, content in (files or {}).items():
+        if content is None:
+            git(repo_path, "rm", "-q", file_name)
+        else:
+            write_file(repo_path, file_name, content)
+            git(repo_path, "add", file_name)
+    env = dict(os.environ)
+    if timestamp:
+        env["GIT_AUTHOR_DATE"] = f"{timestamp} +0000"
+        env["GIT_COMMITTER_DATE"] = f"{timestamp} +0000"
+    subprocess.check_call(["git", "-C", repo_path, "commit", "-q", "--allow-empty", "-m", message], env=env)
+    return git(repo_path, "rev-parse", "HEAD").strip()
@@ -0,0 +1,308 @@
+import configparser
+import threading
+import unittest
+from unittest import mock
+
+try:
+    import torch
+    from transformers import T5Config, T5ForConditionalGeneration, BatchEncoding, Qwen2Config, Qwen2ForCausalLM
+    from modelteam_utils import ai_utils
+except ImportError:
+    torch = None
+
+from modelteam_utils.cache_utils import TokenCache
+from modelteam_utils.constants import GENERATE_SCORER, FORWARD_SCORER, C2S
+from modelteam_utils.model_utils import get_model_scorer
+
+VOCAB_SIZE = 64
+NEW_TOKENS = list(range(VOCAB_SIZE - 12, VOCAB_SIZE))
+NEW_TOKEN_WORDS = [f"skill_{i}" for i in NEW_TOKENS]
+
+
+def get_tiny_seq2seq_model():
+    torch.manual_seed(0)
+    config = T5Config(vocab_size=VOCAB_SIZE, d_model=32, d_kv=8, d_ff=64, num_layers=2, num_decoder_layers=2,
+                      num_heads=4, decoder_start_token_id=0, pad_token_id=0, eos_token_id=1)
+    model = T5ForConditionalGeneration(config)
+    model.eval()
+    return model
+
+
+def get_tiny_causal_model():
+    torch.manual_seed(0)
+    config = Qwen2Config(vocab_size=VOCAB_SIZE, hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=2, pad_token_id=0, eos_token_id=1,
+                         bos_token_id=1)
+    model = Qwen2ForCausalLM(config)
+    model.generation_config.pad_token_id = 0
+    model.eval()
+    return model
+
+
+def get_input_tokens(lengths, left_padding=False):
+    """
+    Right padded batch, same as the T5 tokenizer. Left padded for qwen
+    """
+    input_ids = torch.zeros((len(lengths), max(lengths)), dtype=torch.long)
+    attention_mask = torch.zeros((len(lengths), max(lengths)), dtype=torch.long)
+    for i, length in enumerate(lengths):
+        start = max(lengths) - length if left_padding else 0
+        input_ids[i, start:start + length] = torch.randint(2, VOCAB_SIZE, (length,))
+        attention_mask[i, start:start + length] = 1
+    return BatchEncoding({"input_ids": input_ids, "attention_mask": attention_mask})
+
+
+@unittest.skipIf(torch is None, "torch and transformers are needed")
+class TestForwardScorer(unittest.TestCase):
+    def setUp(self):
+        self.model = get_tiny_seq2seq_model()
+        self.input_tokens = get_input_tokens([7, 3, 12, 1])
+
+    def score(self, scorer, limit):
+        return ai_utils.score_batch(None, "cpu", self.model, self.input_tokens, NEW_TOKENS, limit, scorer=scorer,
+                                    new_token_words=NEW_TOKEN_WORDS)
+
+    def test_same_scores_as_generate(self):
+        for limit in [1, 3, len(NEW_TOKENS)]:
+            generate_skills, generate_scores, generate_sm_scores = self.score(GENERATE_SCORER, limit)
+            forward_skills, forward_scores, forward_sm_scores = self.score(FORWARD_SCORER, limit)
+            self.assertEqual(forward_skills, generate_skills)
+            for expected, actual in [(generate_scores, forward_scores), (generate_sm_scores, forward_sm_scores)]:
+                self.assertEqual(len(actual), len(expected))
+                for expected_row, actual_row in zip(expected, actual):
+                    self.assertEqual(len(actual_row), limit)
+                    for expected_score, actual_score in zip(expected_row, actual_row):
+                        self.assertAlmostEqual(actual_score, expected_score, places=5)
+
+    def test_logits_differ_from_generate_by_a_constant(self):
+        with torch.no_grad():
+            logits = ai_utils.get_seq2seq_scores(self.model, self.input_tokens)
+            output = self.model.generate(**self.input_tokens, max_new_tokens=2, return_dict_in_generate=True,
+                                         output_scores=True, no_repeat_ngram_size=3, do_sample=False,
+                                         renormalize_logits=True)
+        self.assertTrue(torch.allclose(torch.log_softmax(logits, dim=-1), output.scores[1], atol=1e-5))
+
+
+def score_batch_old(scores, new_tokens, new_token_words, limit):
+    """
+    Per word loop of eval_llm_batch_with_scores before it was vectorized
+    """
+    skill_list = []
+    next_best_prob_list = []
+    soft_max_list = []
+    for i in range(scores.shape[0]):
+        score_map = {}
+        soft_max_map = {}
+        new_token_scores = []
+        words = []
+        for j, word in zip(new_tokens, new_token_words):
+            score_map[word] = scores[i][j].item()
+            new_token_scores.append(score_map[word])
+            words.append(word)
+        soft_max_scores = ai_utils.softmax(new_token_scores)
+        for w, s in zip(words, soft_max_scores):
+            soft_max_map[w] = s
+        top_n = sorted(score_map, key=score_map.get, reverse=True)[:limit]
+        next_best_pr = ai_utils.next_best_prob(soft_max_map, top_n)
+        skill_list.append(top_n)
+        next_best_prob_list.append([next_best_pr[word] for word in top_n])
+        soft_max_list.append([soft_max_map[word] for word in top_n])
+    return skill_list, next_best_prob_list, soft_max_list
+
+
+class FixedScoresModel:
+    """
+    generate returns the given logits as the scores of the second token
+    """
+
+    def __init__(self, scores):
+        self.scores = scores
+
+    def generate(self, **kwargs):
+        return mock.Mock(scores=[torch.zeros_like(self.scores), self.scores])
+
+
+class WordTokenizer:
+    def __init__(self, words):
+        self.words = words
+
+    def decode(self, token_id):
+        return self.words[token_id]
+
+
+@unittest.skipIf(torch is None, "torch and transformers are needed")
+class TestScoreBatch(unittest.TestCase):
+    def assert_same_as_old(self, scores, new_token_words, limit):
+        model = FixedScoresModel(scores)
+        input_tokens = get_input_tokens([3] * scores.shape[0])
+        expected = score_batch_old(scores, NEW_TOKENS, new_token_words, limit)
+        tokenizer = WordTokenizer({j: word for j, word in zip(NEW_TOKENS, new_token_words)})
+        for words in [new_token_words, None]:
+            skills, next_best_scores, soft_max_scores = ai_utils.score_batch(tokenizer, "cpu", model, input_tokens,
+                                                                             NEW_TOKENS, limit, new_token_words=words)
+            self.assertEqual(skills, expected[0])
+            for expected_scores, actual_scores in [(expected[1], next_best_scores), (expected[2], soft_max_scores)]:
+                self.assertEqual([len(row) for row in actual_scores], [len(row) for row in expected_scores])
+                for expected_row, actual_row in zip(expected_scores, actual_scores):
+                    for expected_score, actual_score in zip(expected_row, actual_row):
+                        self.assertAlmostEqual(actual_score, expected_score, places=7)
+
+    def test_random_logits(self):
+        torch.manual_seed(1)
+        for limit in [1, 5, len(NEW_TOKENS), len(NEW_TOKENS) + 3]:
+            self.assert_same_as_old(torch.randn(6, VOCAB_SIZE) * 4, NEW_TOKEN_WORDS, limit)
+
+    def test_ties(self):
+        torch.manual_seed(2)
+        self.assert_same_as_old(torch.randint(-2, 2, (6, VOCAB_SIZE)).float(), NEW_TOKEN_WORDS, 8)
+
+    def test_duplicate_words(self):
+        # Token ids that decode to the same word, e.g. with and without a leading space
+        new_token_words = [f"skill_{i % 7}" for i in NEW_TOKENS]
+        torch.manual_seed(3)
+        for limit in [1, 4, len(NEW_TOKENS)]:
+            self.assert_same_as_old(torch.randn(6, VOCAB_SIZE) * 4, new_token_words, limit)
+        self.assertEqual(ai_utils.get_unique_words(["a", "b", "a", "c", "b"]), (["a", "b", "c"], [2, 4, 3]))
+
+
+@unittest.skipIf(torch is None, "torch and transformers are needed")
+class TestTokenBudgetBatches(unittest.TestCase):
+    def assert_valid_batches(self, token_counts, token_budget):
+        batches = ai_utils.get_token_budget_batches(token_counts, token_budget)
+        # Every snippet is in exactly one batch
+        self.assertEqual(sorted(i for batch in batches for i in batch), list(range(len(token_counts))))
+        for batch in batches:
+            self.assertGreater(len(batch), 0)
+            padded_tokens = len(batch) * max(token_counts[i] for i in batch)
+            if padded_tokens > token_budget:
+                # Only a snippet longer than the budget goes over it, in a batch of its own
+                self.assertEqual(len(batch), 1)
+                self.assertGreater(token_counts[batch[0]], token_budget)
+        return batches
+
+    def test_random_counts(self):
+        random = torch.Generator().manual_seed(0)
+        for token_budget in [1, 50, 400, 2000]:
+            for _ in range(20):
+                num_snippets = int(torch.randint(0, 60, (1,), generator=random))
+                token_counts = torch.randint(1, 500, (num_snippets,), generator=random).tolist()
+                self.assert_valid_batches(token_counts, token_budget)
+
+    def test_over_budget_snippet(self):
+        batches = self.assert_valid_batches([10, 500, 20, 30, 600], 100)
+        self.assertEqual(batches, [[0, 2, 3], [1], [4]])
+
+    def test_batch_size(self):
+        self.assertEqual(self.assert_valid_batches([5] * 10, 20), [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]])
+        self.assertEqual(self.assert_valid_batches([], 20), [])
+
+
+class TestModelScorer(unittest.TestCase):
+    def test_scorer_per_model(self):
+        config = configparser.ConfigParser()
+        config.read_dict({C2S: {"path": "org/c2s", "alpha.path": "org/c2s_qwen", "alpha.scorer": FORWARD_SCORER,
+                                "beta.path": "org/c2s_beta"}})
+        self.assertEqual(get_model_scorer(config, C2S, "org/c2s"), GENERATE_SCORER)
+        self.assertEqual(get_model_scorer(config, C2S, "org/c2s_qwen"), FORWARD_SCORER)
+        # Causal models can't use the forward scorer
+        self.assertEqual(get_model_scorer(config, C2S, "org/c2s_qwen", is_causal=True), GENERATE_SCORER)
+        self.assertEqual(get_model_scorer(config, C2S, "org/other"), GENERATE_SCORER)
+
+
+@unittest.skipIf(torch is None, "torch and transformers are needed")
+class TestQwenScorer(unittest.TestCase):
+    def test_causal_model_generates(self):
+        model = get_tiny_causal_model()
+        input_tokens = get_input_tokens([7, 3, 12], left_padding=True)
+        expected = ai_utils.score_batch(None, "cpu", model, input_tokens, NEW_TOKENS, 3, is_qwen=True,
+                                        new_token_words=NEW_TOKEN_WORDS)
+        self.assertEqual([len(skills) for skills in expected[0]], [3, 3, 3])
+        # Forward scorer is ignored, a causal model has no encoder
+        self.assertEqual(ai_utils.score_batch(None, "cpu", model, input_tokens, NEW_TOKENS, 3, is_qwen=True,
+                                              scorer=FORWARD_SCORER, new_token_words=NEW_TOKEN_WORDS), expected)
+
+
+class FakeTokenizer:
+    """
+    1 token per word. Records the threads that tokenize
+    """
+    pad_token_id = 0
+    padding_side = "right"
+
+    def __init__(self):
+        self.threads = []
+
+    def __call__(self, codes, truncation=True, max_length=None):
+        self.threads.append(threading.get_ident())
+        return {"input_ids": [[2 + len(word) for word in code.split()][:max_length] for code in codes]}
+
+    @staticmethod
+    def apply_chat_template(messages, tokenize=False, add_generation_prompt=True):
+        return " ".join(message["content"] for message in messages)
+
+
+@unittest.skipIf(torch is None, "torch and transformers are needed")
+class TestPaddedBatches(unittest.TestCase):
+    def setUp(self):
+        self.snippets = [" ".join(["word"] * (i % 37 + 1)) + f" s{i}" for i in range(300)]
+
+    def get_batches(self, tokenizer, max_pending_batches, token_cache=None):
+        with mock.patch.object(ai_utils, "TOKENIZE_CHUNK_SIZE", 64):
+            return list(ai_utils.get_padded_batches(tokenizer, "fp", token_cache or TokenCache(), self.snippets, 200,
+                                                    max_pending_batches))
+
+    def test_tokenized_in_background(self):
+        tokenizer = FakeTokenizer()
+        batches = self.get_batches(tokenizer, 2)
+        self.assertEqual(len(tokenizer.threads), 5)
+        self.assertNotIn(threading.get_ident(), tokenizer.threads)
+        self.assertEqual(batches_as_lists(batches), batches_as_lists(self.get_batches(FakeTokenizer(), 0)))
+
+    def test_every_snippet_once(self):
+        batches = self.get_batches(FakeTokenizer(), 3)
+        self.assertEqual(sorted(i for batch, _ in batches for i in batch), list(range(len(self.snippets))))
+        for batch, input_tokens in batches:
+            self.assertLessEqual(input_tokens["input_ids"].numel(), 200)
+            for j, i in enumerate(batch):
+                length = len(self.snippets[i].split())
+                self.assertEqual(input_tokens["attention_mask"][j].sum().item(), length)
+                self.assertEqual(input_tokens["input_ids"][j, :length].tolist(),
+                                 [2 + len(word) for word in self.snippets[i].split()])
+
+    def test_token_ids_are_cached(self):
+        tokenizer = FakeTokenizer()
+        token_cache = TokenCache()
+        self.get_batches(tokenizer, 2, token_cache)
+        self.get_batches(tokenizer, 2, token_cache)
+        self.assertEqual(len(tokenizer.threads), 5)
+
+    def test_consumer_stops_early(self):
+        tokenizer = FakeTokenizer()
+        with mock.patch.object(ai_utils, "TOKENIZE_CHUNK_SIZE", 64):
+            padded_batches = ai_utils.get_padded_batches(tokenizer, "fp", TokenCache(), self.snippets, 200, 2)
+            next(padded_batches)
+            padded_batches.close()
+        self.assertLess(len(tokenizer.threads), 5)
+
+    def test_qwen_prompt(self):
+        snippets = [" ".join(["word"] * 500)]
+        batches = list(ai_utils.get_padded_batches(FakeTokenizer(), "fp", TokenCache(), snippets, 10000, 0,
+                                                   is_qwen=True))
+        expected = FakeTokenizer()(ai_utils.get_qwen_prompts(FakeTokenizer(), snippets))["input_ids"][0]
+        # Not truncated to the T5 max length
+        self.assertGreater(len(expected), 500)
+        self.assertEqual(batches[0][1]["input_ids"][0].tolist(), expected)
+
+    def test_tokenizer_error(self):
+        tokenizer = FakeTokenizer()
+        with mock.patch.object(FakeTokenizer, "__call__", side_effect=ValueError("tokenizer failed")):
+            with self.assertRaises(ValueError):
+                self.get_batches(tokenizer, 2)
+
+
+def batches_as_lists(batches):
+    return [(batch, input_tokens["input_ids"].tolist()) for batch, input_tokens in batches]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,138 @@
+import os
+import tempfile
+import time
+import unittest
+
+from modelteam_utils.cache_utils import InferenceCache, TokenCache
+from modelteam_utils.snippet_utils import SnippetWriter, SnippetReader
+
+C2S_TAG = "c2s::model"
+LOP_TAG = "life_of_py::model"
+
+
+def get_scores(snippet):
+    return [snippet.upper()], [0.5], [0.25]
+
+
+class TestInferenceCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = InferenceCache(self.tmp_dir.name, 1)
+
+    def tearDown(self):
+        self.cache.close()
+        self.tmp_dir.cleanup()
+
+    def put(self, cache, model_tag, snippets):
+        scores = [get_scores(snippet) for snippet in snippets]
+        cache.put(model_tag, snippets, [s[0] for s in scores], [s[1] for s in scores], [s[2] for s in scores])
+        # last_used of later puts and gets is bigger
+        time.sleep(0.01)
+
+    def test_get(self):
+        self.put(self.cache, C2S_TAG, ["a", "b"])
+        cached = self.cache.get(C2S_TAG, ["b", "c", "a", "b"])
+        self.assertEqual(cached, {0: get_scores("b"), 2: get_scores("a"), 3: get_scores("b")})
+
+    def test_entries_are_per_model(self):
+        self.put(self.cache, C2S_TAG, ["a"])
+        self.assertEqual(self.cache.get(LOP_TAG, ["a"]), {})
+
+    def test_cache_is_kept_across_runs(self):
+        self.put(self.cache, C2S_TAG, ["a"])
+        cache = InferenceCache(self.tmp_dir.name, 1)
+        try:
+            self.assertEqual(cache.get(C2S_TAG, ["a"]), {0: get_scores("a")})
+        finally:
+            cache.close()
+
+    def test_least_recently_used_are_evicted(self):
+        snippets = [f"snippet_{i}" for i in range(10)]
+        self.put(self.cache, C2S_TAG, snippets[:5])
+        self.put(self.cache, C2S_TAG, snippets[5:])
+        total_size = self.cache.connection.execute("SELECT SUM(size) FROM scores").fetchone()[0]
+        # snippet_0 is used again, so it is evicted after the other older snippets
+        self.cache.get(C2S_TAG, snippets[:1])
+        time.sleep(0.01)
+        self.cache.max_size_bytes = total_size // 2
+        self.put(self.cache, C2S_TAG, ["new"])
+        cached = self.cache.get(C2S_TAG, snippets + ["new"])
+        # Least recently used first
+        kept = [i in cached for i in list(range(1, 10)) + [0, 10]]
+        self.assertFalse(kept[0])
+        self.assertTrue(kept[-2])
+        self.assertEqual(kept, sorted(kept))
+        remaining_size = self.cache.connection.execute("SELECT SUM(size) FROM scores").fetchone()[0]
+        self.assertLessEqual(remaining_size, self.cache.max_size_bytes * 0.9)
+
+    def test_no_eviction_within_max_size(self):
+        self.put(self.cache, C2S_TAG, [f"snippet_{i}" for i in range(100)])
+        self.assertEqual(len(self.cache.get(C2S_TAG, [f"snippet_{i}" for i in range(100)])), 100)
+
+    def test_snippet_refs(self):
+        # Same keys for a snippet and its reference into the snippet file
+        snippet_writer = SnippetWriter(os.path.join(self.tmp_dir.name, "snippets.bin"))
+        refs = [snippet_writer.add(snippet) for snippet in ["a", "b"]]
+        snippet_writer.close()
+        self.put(self.cache, C2S_TAG, ["a"])
+        self.assertEqual(self.cache.get(C2S_TAG, refs), {0: get_scores("a")})
+        self.cache.put(C2S_TAG, refs[1:], [["B"]], [[0.5]], [[0.25]])
+        self.assertEqual(self.cache.get(C2S_TAG, ["b"]), {0: get_scores("b")})
+
+
+class CountingReader(SnippetReader):
+    def __init__(self, file_name):
+        super().__init__(file_name)
+        self.reads = 0
+
+    def get(self, snippet):
+        self.reads += 1
+        return super().get(snippet)
+
+
+def tokenize(codes, truncation=True, max_length=None):
+    return {"input_ids": [[ord(c) for c in code][:max_length] for code in codes]}
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        file_name = os.path.join(self.tmp_dir.name, "snippets.bin")
+        snippet_writer = SnippetWriter(file_name)
+        self.snippets = ["abc", "de", "日本"]
+        self.refs = [snippet_writer.add(snippet) for snippet in self.snippets]
+        snippet_writer.close()
+        self.snippet_reader = CountingReader(file_name)
+
+    def tearDown(self):
+        self.snippet_reader.close()
+        self.tmp_dir.cleanup()
+
+    def test_only_misses_are_read(self):
+        token_cache = TokenCache()
+        token_cache.get(tokenize, "fp", self.snippets[:1], 2)
+        token_ids = token_cache.get(tokenize, "fp", self.refs, 2, self.snippet_reader)
+        self.assertEqual([ids.tolist() for ids in token_ids], [[97, 98], [100, 101], [26085, 26412]])
+        self.assertEqual(self.snippet_reader.reads, 2)
+        token_cache.get(tokenize, "fp", self.refs, 2, self.snippet_reader)
+        self.assertEqual(self.snippet_reader.reads, 2)
+
+    def test_ids_are_per_tokenizer_and_max_length(self):
+        token_cache = TokenCache()
+        token_cache.get(tokenize, "fp", self.refs, 2, self.snippet_reader)
+        self.assertEqual([ids.tolist() for ids in token_cache.get(tokenize, "fp", self.refs, 3, self.snippet_reader)],
+                         [[97, 98, 99], [100, 101], [26085, 26412]])
+        token_cache.get(tokenize, "other", self.refs, 2, self.snippet_reader)
+        self.assertEqual(self.snippet_reader.reads, 9)
+
+    def test_least_recently_used_are_evicted(self):
+        token_cache = TokenCache(0)
+        token_cache.max_size_bytes = 20
+        token_cache.get(tokenize, "fp", self.snippets, 400)
+        # 12 + 8 + 8 bytes of int32 ids, "abc" is evicted first
+        self.assertEqual(token_cache.size_bytes, 16)
+        self.assertEqual([key[2] for key in token_cache.token_ids], [ref[2] for ref in self.refs[1:]])
+
+
+if __name__ == "__main__":
+    unittest.main()
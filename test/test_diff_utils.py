@@ -0,0 +1,234 @@
+import os
+import re
+import tempfile
+import unittest
+
+from ModelTeamGitParser import ModelTeamGitParser
+from modelteam_utils.constants import SS_LC
+from modelteam_utils.diff_utils import read_file_diffs
+from modelteam_utils.git_utils import stream_git_log_lines, get_patch_args, get_diff_pathspecs, decode_git_lines
+from test.git_test_utils import git, init_repo, commit, write_file
+
+SRC_PREFIX = "123"
+DEST_PREFIX = "456"
+# Bigger than any file diff in these tests
+NO_LIMIT = 1000000
+HEADER = ["index 1111111..2222222 100644", "--- a/x.py", "+++ b/x.py"]
+# (name, diff lines after the diff --git line of x.py, hunks as (old_start, old_count, new_start, new_count),
+# added runs)
+HUNK_CASES = [
+    ("mode only", ["old mode 100644", "new mode 100755"], [], []),
+    ("mode and content", ["old mode 100644", "new mode 100755"] + HEADER + ["@@ -1,2 +1,3 @@", " a", "+b", " c"],
+     [(1, 2, 1, 3)], [["b"]]),
+    ("new file", ["new file mode 100644", "index 0000000..1111111", "--- /dev/null", "+++ b/x.py",
+                  "@@ -0,0 +1,2 @@", "+a", "+b"], [(0, 0, 1, 2)], [["a", "b"]]),
+    ("new file with one line", ["new file mode 100644", "index 0000000..1111111", "--- /dev/null", "+++ b/x.py",
+                                "@@ -0,0 +1 @@", "+a"], [(0, 0, 1, 1)], [["a"]]),
+    ("deleted file", ["deleted file mode 100644", "index 1111111..0000000", "--- a/x.py", "+++ /dev/null",
+                      "@@ -1,2 +0,0 @@", "-a", "-b"], [(1, 2, 0, 0)], []),
+    ("rename", ["similarity index 100%", "rename from y.py", "rename to x.py"], [], []),
+    ("rename with changes", ["similarity index 90%", "rename from y.py", "rename to x.py"] + HEADER +
+     ["@@ -1 +1,2 @@", " a", "+b"], [(1, 1, 1, 2)], [["b"]]),
+    ("binary", ["new file mode 100644", "index 0000000..1111111", "Binary files /dev/null and b/x.py differ"], [],
+     []),
+    ("no newline at end of file", HEADER + ["@@ -1,2 +1,3 @@", " a", "-b", "\\ No newline at end of file", "+b",
+                                            "+c", "\\ No newline at end of file"], [(1, 2, 1, 3)], [["b", "c"]]),
+    ("hunks", HEADER + ["@@ -1 +1,2 @@", " a", "+b", "@@ -10,2 +11,3 @@", "+c", " d", "-e", "+f"],
+     [(1, 1, 1, 2), (10, 2, 11, 3)], [["b"], ["c"], ["f"]]),
+    ("added lines that look like headers", HEADER + ["@@ -1 +1,4 @@", " a", "+++ b/y.py", "+--- a/y.py",
+                                                     "+@@ -1 +1 @@"],
+     [(1, 1, 1, 4)], [["++ b/y.py", "--- a/y.py", "@@ -1 +1 @@"]]),
+    ("truncated hunk", HEADER + ["@@ -1,2 +1,6 @@", "+a", "+b", "not a diff line", "+c"], [(1, 2, 1, 6)],
+     [["a", "b"]]),
+    ("truncated at the end", HEADER + ["@@ -1,2 +1,6 @@", " a", "+b", "+c"], [(1, 2, 1, 6)], [["b", "c"]]),
+]
+
+
+def get_code(name, num_lines):
+    return "".join(f"{name}_{i} = compute({i}, '{name}')\n" for i in range(num_lines))
+
+
+def break_diff_old(git_diff, file_names, max_file_diff_chars):
+    """
+    File diffs of break_diff_and_process_each_file before it read the diff line by line
+    :return: List of (file_name, too_big, added lines)
+    """
+    file_diffs = []
+    for file_diff in re.split(fr'diff --git {SRC_PREFIX}/', git_diff)[1:]:
+        file_lines = file_diff.split('\n')
+        file_name = file_lines[0].strip().split(f" {DEST_PREFIX}/")[1]
+        if file_name not in file_names:
+            continue
+        too_big = len(file_diff) > max_file_diff_chars
+        added_lines = [] if too_big else [line[1:] for line in file_lines[5:] if line.startswith("+")]
+        file_diffs.append((file_name, too_big, added_lines))
+    return file_diffs
+
+
+def get_newly_added_snippets_old(git_diff, repo_stats):
+    """
+    get_newly_added_snippets when it was given the diff text of a file without its first 5 lines
+    """
+    snippets = []
+    snippet = []
+    for line in git_diff.split('\n'):
+        if line.startswith('+'):
+            snippet.append(line[1:])
+        else:
+            if len(snippet) >= 10:
+                repo_stats[SS_LC] += len(snippet)
+                snippets.append('\n'.join(snippet))
+            snippet = []
+    if len(snippet) >= 10:
+        repo_stats[SS_LC] += len(snippet)
+        snippets.append('\n'.join(snippet))
+    return snippets
+
+
+class TestHunks(unittest.TestCase):
+    def test_hunks_and_added_runs(self):
+        for name, lines, hunks, added_runs in HUNK_CASES:
+            with self.subTest(name):
+                file_diffs = list(read_file_diffs(["diff --git a/x.py b/x.py"] + lines, "a", "b", NO_LIMIT))
+                self.assertEqual([file_diff.path for file_diff in file_diffs], ["x.py"])
+                file_diff = file_diffs[0]
+                self.assertEqual([(hunk.old_start, hunk.old_count, hunk.new_start, hunk.new_count)
+                                  for hunk in file_diff.hunks], hunks)
+                self.assertEqual(list(file_diff.get_added_runs()), added_runs)
+                self.assertEqual([line for run in added_runs for line in run],
+                                 list(file_diff.get_changed_lines("+")))
+
+    def test_next_file_diff_after_each_case(self):
+        next_file_diff = ["diff --git a/z.py b/z.py"] + HEADER + ["@@ -0,0 +1 @@", "+z"]
+        for name, lines, _, added_runs in HUNK_CASES:
+            with self.subTest(name):
+                file_diffs = list(read_file_diffs(["diff --git a/x.py b/x.py"] + lines + next_file_diff, "a", "b",
+                                                  NO_LIMIT))
+                self.assertEqual([file_diff.path for file_diff in file_diffs], ["x.py", "z.py"])
+                self.assertEqual(list(file_diffs[0].get_added_runs()), added_runs)
+                self.assertEqual(list(file_diffs[1].get_added_runs()), [["z"]])
+
+
+class TestReadFileDiffs(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.repo_path = os.path.join(self.tmp_dir.name, "repo")
+        init_repo(self.repo_path)
+        git(self.repo_path, "config", "core.quotePath", "true")
+        self.commits = [commit(self.repo_path, "init", {"a.py": get_code("a", 30), "b.py": get_code("b", 5),
+                                                        "old name.py": get_code("old", 12)})]
+        # Multiple files, a path with a space, a rename, unicode and quoted paths next to the other file diffs
+        self.commits.append(commit(self.repo_path, "multi", {
+            "a.py": get_code("a", 10) + get_code("a_new", 15) + get_code("a", 30)[300:],
+            "b.py": get_code("b", 5) + "# é ü 日本\n" + get_code("b_new", 12),
+            "日本.py": get_code("jp", 14), 'q"uote.py': get_code("quote", 11),
+            "dir/my file.py": get_code("space", 20),
+            "old name.py": None, "new name.py": get_code("old", 12) + get_code("renamed", 2),
+            "crlf.py": get_code("crlf", 12).replace("\n", "\r\n")}))
+        git(self.repo_path, "checkout", "-q", "-b", "side")
+        self.commits.append(commit(self.repo_path, "side", {"a.py": get_code("side", 40)}))
+        git(self.repo_path, "checkout", "-q", "main")
+        self.commits.append(commit(self.repo_path, "main", {"a.py": get_code("main", 35)}))
+        # Merge with a conflict, resolved with lines that are in neither parent. git show prints it as diff --cc
+        git(self.repo_path, "merge", "-q", "--no-commit", "side", "-s", "ours")
+        write_file(self.repo_path, "a.py", get_code("resolved", 45))
+        git(self.repo_path, "add", "a.py")
+        self.commits.append(commit(self.repo_path, "merge"))
+        self.file_names = {"a.py", "b.py", "dir/my file.py", "new name.py", "crlf.py"}
+        self.quoted_file_names = {"日本.py", 'q"uote.py'}
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def read_new(self, commit_hash, max_file_diff_chars, pathspecs=None):
+        file_names = self.file_names | self.quoted_file_names
+        file_diffs = []
+        for _, lines in stream_git_log_lines(self.repo_path, [commit_hash], get_patch_args(SRC_PREFIX, DEST_PREFIX),
+                                             pathspecs, skip_quoted_file_diffs=True):
+            for file_diff in read_file_diffs(lines, SRC_PREFIX, DEST_PREFIX, max_file_diff_chars, file_names):
+                file_diffs.append((file_diff.path, file_diff.too_big, list(file_diff.get_changed_lines("+"))))
+        return file_diffs
+
+    def assert_same_as_old(self, commit_hash, max_file_diff_chars):
+        expected = break_diff_old(git(self.repo_path, "show", f"--src-prefix={SRC_PREFIX}/",
+                                      f"--dst-prefix={DEST_PREFIX}/", commit_hash, "--",
+                                      *sorted(self.file_names)), self.file_names, max_file_diff_chars)
+        # Quoted file diffs are in the diff, but they are dropped without touching the file diffs around them. The
+        # old split on the unquoted header glued them to the previous file diff
+        for pathspecs in [get_diff_pathspecs(self.file_names | self.quoted_file_names), None]:
+            self.assertEqual(self.read_new(commit_hash, max_file_diff_chars, pathspecs), expected)
+        return expected
+
+    def test_multi_file_commit(self):
+        file_diffs = self.assert_same_as_old(self.commits[1], NO_LIMIT)
+        # Quoted paths are never analyzed. Renames are new files
+        self.assertEqual([file_name for file_name, _, _ in file_diffs],
+                         ["a.py", "b.py", "crlf.py", "dir/my file.py", "new name.py"])
+        self.assertIn("# é ü 日本", file_diffs[1][2])
+        self.assertEqual(file_diffs[2][2], get_code("crlf", 12).split("\n")[:-1])
+        self.assert_same_as_old(self.commits[0], NO_LIMIT)
+
+    def test_merge(self):
+        self.assertIn("diff --cc a.py", git(self.repo_path, "show", self.commits[-1]))
+        self.assertEqual(self.assert_same_as_old(self.commits[-1], NO_LIMIT), [])
+
+    def test_max_file_diff_chars(self):
+        old_diff = git(self.repo_path, "show", f"--src-prefix={SRC_PREFIX}/", f"--dst-prefix={DEST_PREFIX}/",
+                       self.commits[1], "--", "a.py", "b.py")
+        file_diff_chars = [len(file_diff) for file_diff in re.split(fr'diff --git {SRC_PREFIX}/', old_diff)[1:]]
+        for num_chars in file_diff_chars:
+            for max_file_diff_chars in [num_chars - 1, num_chars, num_chars + 1]:
+                file_diffs = self.assert_same_as_old(self.commits[1], max_file_diff_chars)
+                self.assertTrue(any(too_big for _, too_big, _ in file_diffs) or max_file_diff_chars >= num_chars)
+        self.assertTrue(all(too_big for _, too_big, _ in self.assert_same_as_old(self.commits[1], 10)))
+
+    def test_newly_added_snippets_same_as_skipping_first_5_lines(self):
+        # Mode change with new code, binary file, new file without a newline at the end, 2 hunks and a deleted file
+        os.chmod(os.path.join(self.repo_path, "b.py"), 0o755)
+        resolved = get_code("resolved", 45).split("\n")
+        self.commits.append(commit(self.repo_path, "more", {
+            "a.py": "\n".join(resolved[:2] + get_code("hunk1", 12).split("\n")[:-1] + resolved[2:40] +
+                              get_code("hunk2", 11).split("\n")[:-1] + resolved[40:]),
+            "b.py": get_code("b", 5) + get_code("mode", 14), "binary.py": "x\x00y\n" * 20,
+            "no_eol.py": get_code("no_eol", 11)[:-1], "dir/my file.py": None}))
+        self.file_names.update(["binary.py", "no_eol.py"])
+        diff = git(self.repo_path, "show", self.commits[-1])
+        for header in ["old mode 100644", "Binary files /dev/null and b/binary.py differ", "No newline at end of file",
+                       "deleted file mode"]:
+            self.assertIn(header, diff)
+        self.assertEqual(len(git(self.repo_path, "show", self.commits[-1], "--", "a.py").split("\n@@ ")), 3)
+        old_stats = {SS_LC: 0}
+        new_stats = {SS_LC: 0}
+        for commit_hash in self.commits:
+            old_diff = git(self.repo_path, "show", f"--src-prefix={SRC_PREFIX}/", f"--dst-prefix={DEST_PREFIX}/",
+                           commit_hash, "--", *sorted(self.file_names))
+            expected = {}
+            for file_diff in re.split(fr'diff --git {SRC_PREFIX}/', old_diff)[1:]:
+                file_lines = file_diff.split('\n')
+                file_name = file_lines[0].strip().split(f" {DEST_PREFIX}/")[1]
+                expected[file_name] = get_newly_added_snippets_old("\n".join(file_lines[5:]), old_stats)
+            snippets = {}
+            for _, lines in stream_git_log_lines(self.repo_path, [commit_hash],
+                                                 get_patch_args(SRC_PREFIX, DEST_PREFIX)):
+                for file_diff in read_file_diffs(lines, SRC_PREFIX, DEST_PREFIX, NO_LIMIT, self.file_names):
+                    snippets[file_diff.path] = ModelTeamGitParser.get_newly_added_snippets(file_diff, new_stats)
+            self.assertEqual(snippets, expected)
+            self.assertEqual(new_stats, old_stats)
+        self.assertEqual(len(snippets), 5)
+        self.assertEqual(sum(len(file_snippets) for file_snippets in snippets.values()), 4)
+
+
+class TestDecodeGitLines(unittest.TestCase):
+    def test_line_breaks(self):
+        lines = [b"+a = 1\n", b"+b = 'x\ry'\r\n", "+c = 'é'\n".encode("utf-8"), b"+\xff\n", b" last"]
+        self.assertEqual(list(decode_git_lines(lines)), ["+a = 1", "+b = 'x\ry'", "+c = 'é'", None, " last"])
+
+    def test_lone_carriage_return_keeps_the_hunk(self):
+        lines = [b"diff --git a/x.py b/x.py\n", b"--- a/x.py\n", b"+++ b/x.py\n", b"@@ -1,0 +1,3 @@\n",
+                 b"+a = 1\n", b"+b = 'x\ry'\n", b"+c = 2\n"]
+        file_diffs = list(read_file_diffs(decode_git_lines(lines), "a", "b", NO_LIMIT))
+        self.assertEqual([list(run) for run in file_diffs[0].get_added_runs()], [["a = 1", "b = 'x\ry'", "c = 2"]])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+from modelteam_utils.constants import TIMESTAMP
+from test.git_test_utils import git, init_repo, commit
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ONE_MONTH = 30 * 24 * 60 * 60
+USERS = ["dev@example.com", "other@example.com"]
+
+
+def get_code(name, num_lines):
+    return "".join(f"{name}_{i} = compute({i}, '{name}')\n" for i in range(num_lines))
+
+
+def create_repo(repo_path, seed):
+    """
+    Commits of 2 users over a few months: new files, edits, renames, deletes and a reformat
+    """
+    init_repo(repo_path)
+    start = int(time.time()) - 12 * ONE_MONTH
+    files = {}
+    for i in range(12):
+        git(repo_path, "config", "user.email", USERS[(i + seed) % 2])
+        changes = {f"m{i % 4}.py": (files.get(f"m{i % 4}.py") or "") + get_code(f"py{seed}_{i}", 12 + i),
+                   f"J{i % 3}.java": get_code(f"java{seed}_{i}", 25 + seed)}
+        if i == 5:
+            changes["m0.py"] = files["m0.py"].replace("(", "( ")
+        if i == 7:
+            changes["m1.py"] = None
+            changes["moved.py"] = files["m1.py"] + get_code("moved", 3)
+        files.update(changes)
+        commit(repo_path, f"commit {i}", changes, start + i * ONE_MONTH)
+
+
+def run_parser(input_path, output_path, *parser_args):
+    subprocess.check_call([sys.executable, os.path.join(ROOT_DIR, "ModelTeamGitParser.py"), "--input_path",
+                           input_path, "--output_path", output_path, "--config", os.path.join(ROOT_DIR, "config.ini"),
+                           "--num_years", "2", "--keep_repo_name", "--skip_model_eval"] + list(parser_args),
+                          cwd=ROOT_DIR, stdout=subprocess.DEVNULL)
+
+
+def read_tmp_stats(output_path):
+    """
+    :return: Map of file name to content of every file in tmp-stats. Timestamps of profiles are dropped
+    """
+    tmp_stats = {}
+    tmp_stats_dir = os.path.join(output_path, "tmp-stats")
+    for file_name in sorted(os.listdir(tmp_stats_dir)):
+        with open(os.path.join(tmp_stats_dir, file_name), "rb") as f:
+            data = f.read()
+        if file_name.endswith(".jsonl"):
+            records = [json.loads(line) for line in data.splitlines()]
+            for record in records:
+                record.pop(TIMESTAMP, None)
+            tmp_stats[file_name] = records
+        else:
+            tmp_stats[file_name] = data
+    return tmp_stats
+
+
+class TestExecutionModes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.input_path = os.path.join(cls.tmp_dir.name, "repos")
+        for seed in range(2):
+            create_repo(os.path.join(cls.input_path, f"repo{seed}"), seed)
+        run_parser(cls.input_path, os.path.join(cls.tmp_dir.name, "serial"))
+        cls.expected = read_tmp_stats(os.path.join(cls.tmp_dir.name, "serial"))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp_dir.cleanup()
+
+    def assert_same_as_serial(self, name, *parser_args):
+        output_path = os.path.join(self.tmp_dir.name, name)
+        run_parser(self.input_path, output_path, *parser_args)
+        self.assertEqual(read_tmp_stats(output_path), self.expected)
+
+    def test_serial_run(self):
+        self.assertEqual(sorted(self.expected.keys()),
+                         [f"repo{i}{suffix}" for i in range(2)
+                          for suffix in [".jsonl", "_features.jsonl", "_snippets.bin"]])
+        for i in range(2):
+            self.assertGreater(len(self.expected[f"repo{i}_snippets.bin"]), 0)
+            self.assertEqual(sorted(record["user"] for record in self.expected[f"repo{i}.jsonl"]), USERS)
+
+    def test_workers(self):
+        self.assert_same_as_serial("workers", "--workers", "2")
+
+    def test_two_phase(self):
+        self.assert_same_as_serial("two_phase", "--two_phase")
+
+    def test_extract_stage(self):
+        self.assert_same_as_serial("extract", "--stage", "extract", "--workers", "2")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+import configparser
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+
+from ModelTeamGitParser import ModelTeamGitParser
+from modelteam_utils.constants import SS_LC, COMMITS, LANGS, TIME_SERIES, TOO_BIG_TO_ANALYZE, \
+    SIGNIFICANT_CONTRIBUTION, TOO_BIG_TO_ANALYZE_LIMIT
+from modelteam_utils.git_utils import stream_git_log, NUMSTAT_LOG_ARGS, GitDiffTreePool, DIFF_TREE_NUMSTAT_ARGS, \
+    get_patch_args
+from test.git_test_utils import git, init_repo, commit, write_file
+
+
+def get_code(name, num_lines):
+    return "".join(f"{name}_{i} = compute({i}, '{name}')\n" for i in range(num_lines))
+
+
+class TestNumstatLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.repo_path = os.path.join(self.tmp_dir.name, "repo")
+        init_repo(self.repo_path)
+        self.commits = [commit(self.repo_path, "init", {"a.py": "a\nb\n", "old.py": "x\n" * 20, "doc.txt": "d\n"})]
+        self.commits.append(commit(self.repo_path, "rename", {"old.py": None, "new.py": "x\n" * 20}))
+        git(self.repo_path, "checkout", "-q", "-b", "side")
+        self.commits.append(commit(self.repo_path, "side", {"a.py": "a\nb\nside\n", "side.py": "s\n"}))
+        git(self.repo_path, "checkout", "-q", "main")
+        self.commits.append(commit(self.repo_path, "main", {"a.py": "main\na\nb\n", "doc.txt": None}))
+        # Merge with a change that is in neither parent
+        git(self.repo_path, "merge", "-q", "--no-commit", "side")
+        write_file(self.repo_path, "merge.py", "m\n")
+        git(self.repo_path, "add", "merge.py")
+        self.commits.append(commit(self.repo_path, "merge"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_same_as_git_show(self):
+        numstats = dict(stream_git_log(self.repo_path, self.commits, NUMSTAT_LOG_ARGS))
+        self.assertEqual(list(numstats.keys()), self.commits)
+        for commit_hash in self.commits:
+            expected = git(self.repo_path, "show", "--numstat", "--diff-filter=d", "--format=", commit_hash)
+            self.assertEqual(numstats[commit_hash].strip(), expected.strip(), commit_hash)
+
+    def test_merge_is_diffed_against_first_parent(self):
+        numstats = dict(stream_git_log(self.repo_path, self.commits[-1:], NUMSTAT_LOG_ARGS))
+        file_names = sorted(line.split("\t")[2] for line in numstats[self.commits[-1]].strip().split("\n"))
+        self.assertEqual(file_names, ["a.py", "merge.py", "side.py"])
+
+    def test_commit_order(self):
+        commit_hashes = list(reversed(self.commits))
+        self.assertEqual([commit_hash for commit_hash, _ in stream_git_log(self.repo_path, commit_hashes,
+                                                                            NUMSTAT_LOG_ARGS)], commit_hashes)
+
+
+class TestGitDiffTreePool(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.repo_path = os.path.join(self.tmp_dir.name, "repo")
+        init_repo(self.repo_path)
+        self.commits = [commit(self.repo_path, "init", {"a.py": get_code("a", 30), "old.py": get_code("old", 25),
+                                                        "doc.txt": "d\n"})]
+        self.commits.append(commit(self.repo_path, "rename", {"old.py": None, "new.py": get_code("old", 25) + "x\n"}))
+        git(self.repo_path, "checkout", "-q", "-b", "side")
+        self.commits.append(commit(self.repo_path, "side", {"side.py": get_code("side", 40)}))
+        git(self.repo_path, "checkout", "-q", "main")
+        self.commits.append(commit(self.repo_path, "main", {"a.py": get_code("a", 30) + get_code("b", 22),
+                                                            "doc.txt": None, "b.java": get_code("j", 15)}))
+        git(self.repo_path, "merge", "-q", "--no-edit", "side")
+        self.commits.append(git(self.repo_path, "rev-parse", "HEAD").strip())
+        self.commits.append(commit(self.repo_path, "reformat", {"a.py": get_code("a", 30).replace(", ", ",")}))
+        self.pool = GitDiffTreePool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.tmp_dir.cleanup()
+
+    def test_numstat_same_as_git_show(self):
+        for commit_hash in self.commits:
+            expected = git(self.repo_path, "show", "--numstat", "--diff-filter=d", "--format=", commit_hash)
+            numstat = self.pool.get_diff(self.repo_path, commit_hash, DIFF_TREE_NUMSTAT_ARGS)
+            self.assertEqual(numstat.strip(), expected.strip(), commit_hash)
+
+    def test_one_process_for_many_commits(self):
+        with mock.patch.object(subprocess, "Popen", wraps=subprocess.Popen) as popen:
+            for _ in range(3):
+                for commit_hash in self.commits:
+                    self.assertIsNotNone(self.pool.get_diff(self.repo_path, commit_hash, DIFF_TREE_NUMSTAT_ARGS))
+                    list(self.pool.stream_diff(self.repo_path, commit_hash, get_patch_args(1, 2)))
+        # One numstat and one patch worker
+        self.assertEqual(popen.call_count, 2)
+
+    def test_unknown_commit(self):
+        # git reports the bad object and keeps serving the next commits
+        worker = self.pool.get_worker(self.repo_path, DIFF_TREE_NUMSTAT_ARGS)
+        self.assertEqual(worker.get_diff("0" * 40), "")
+        process = worker.process
+        self.assertTrue(worker.get_diff(self.commits[0]))
+        self.assertIs(worker.process, process)
+
+    def test_process_commit_same_as_process_users(self):
+        user = "dev@example.com"
+        timestamps = git(self.repo_path, "log", "--format=%H %ct").split()
+        timestamps = dict(zip(timestamps[::2], [int(t) for t in timestamps[1::2]]))
+        user_commits = {user: {COMMITS: [(commit_hash, timestamps[commit_hash]) for commit_hash in self.commits]}}
+        git_parser = ModelTeamGitParser(configparser.ConfigParser())
+        try:
+            expected_labels = {SS_LC: 0}
+            expected = {}
+            git_parser.process_users(expected_labels, self.repo_path, [user], user_commits, expected)
+            labels = {SS_LC: 0}
+            user_stats = {user: {"langs": {}}}
+            for commit_hash in self.commits:
+                git_parser.process_commit((commit_hash, timestamps[commit_hash]), user_stats[user], labels,
+                                          self.repo_path, user)
+        finally:
+            git_parser.git_pool.close()
+        self.assertEqual(user_stats, expected)
+        self.assertEqual(labels, expected_labels)
+        self.assertGreater(labels[SS_LC], 0)
+
+
+
+class TestTooBigToAnalyze(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.repo_path = os.path.join(self.tmp_dir.name, "repo")
+        init_repo(self.repo_path)
+        long_line = "x = '" + "x" * 1000 + "'\n"
+        # 2big counts every file with more than MIN_LINES_ADDED lines added, not only the ones that can have snippets
+        self.commit_hash = commit(self.repo_path, "big", {
+            "long_lines.py": long_line * 15, "big.py": long_line * 25, "short.py": get_code("short", 15),
+            "few_lines.py": long_line * 10, "snippet.py": get_code("snippet", 25)})
+        self.timestamp = int(git(self.repo_path, "log", "-1", "--format=%ct").strip())
+        self.assertGreater(len(long_line) * 15, TOO_BIG_TO_ANALYZE_LIMIT)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_files_below_significant_contribution(self):
+        user = "dev@example.com"
+        git_parser = ModelTeamGitParser(configparser.ConfigParser())
+        try:
+            user_stats = {}
+            git_parser.process_users({SS_LC: 0}, self.repo_path, [user],
+                                     {user: {COMMITS: [(self.commit_hash, self.timestamp)]}}, user_stats)
+            commit_stats = {LANGS: {}}
+            git_parser.process_commit((self.commit_hash, self.timestamp), commit_stats, {SS_LC: 0}, self.repo_path,
+                                      user)
+        finally:
+            git_parser.git_pool.close()
+        self.assertEqual(commit_stats, user_stats[user])
+        monthly_stats = list(user_stats[user][LANGS]["py"][TIME_SERIES].values())
+        self.assertEqual(len(monthly_stats), 1)
+        self.assertEqual(monthly_stats[0][TOO_BIG_TO_ANALYZE], 2)
+        self.assertEqual(monthly_stats[0][SIGNIFICANT_CONTRIBUTION], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Inference stack. Loaded only when a model is evaluated, see model_utils.get_ai_utils
+HEAVY_MODULES = ["torch", "transformers", "peft"]
+
+
+def get_imported_modules(module_name):
+    """
+    Import the module in a fresh interpreter
+    :return: Top level names of all the modules that got imported
+    """
+    code = f"import sys\nimport {module_name}\nprint('\\n'.join(sorted(set(m.split('.')[0] for m in sys.modules))))"
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=ROOT_DIR, universal_newlines=True)
+    return set(output.split())
+
+
+class TestImports(unittest.TestCase):
+    def test_parser_does_not_import_model_stack(self):
+        imported_modules = get_imported_modules("ModelTeamGitParser")
+        self.assertIn("modelteam_utils", imported_modules)
+        self.assertEqual([module for module in HEAVY_MODULES if module in imported_modules], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import datetime
+import os
+import tempfile
+import time
+import unittest
+
+from ModelTeamGitParser import ModelTeamGitParser
+from modelteam_utils.constants import LANGS, TIME_SERIES, SKILLS, START_TIME, END_TIME, ADDED, DELETED, \
+    SIG_CODE_SNIPPETS, LIBS
+from modelteam_utils.incremental_utils import merge_user_profiles, load_repo_state, save_repo_state, \
+    get_cutoff_yyyy_mm
+from test.git_test_utils import init_repo, commit, git
+
+C2S_TAG = "c2s::model"
+LOP_TAG = "life_of_py::model"
+CUTOFF = 202410
+
+
+def get_scores(score, code_line_count):
+    # max, min, sum, softmax max, softmax min, softmax sum, count, code_line_count, doc_string_line_count, labeled
+    return [score, score, score, score / 2, score / 2, score / 2, 1, code_line_count, 0, 0]
+
+
+class TestMergeUserProfiles(unittest.TestCase):
+    def test_expired_months_are_dropped(self):
+        old_profile = {LANGS: {"py": {TIME_SERIES: {202001: {ADDED: 50, DELETED: 0}}}}, SKILLS: {"flask": 40}}
+        self.assertEqual(merge_user_profiles(old_profile, {}, CUTOFF), {LANGS: {}, SKILLS: {}})
+
+    def test_skills_of_expired_months_are_dropped(self):
+        old_profile = {LANGS: {"py": {
+            TIME_SERIES: {"202001": {ADDED: 50, DELETED: 0, C2S_TAG: {"flask": get_scores(0.9, 40)}},
+                          "202411": {ADDED: 30, DELETED: 0, C2S_TAG: {"flask": get_scores(0.8, 25),
+                                                                      "sql": get_scores(0.7, 10)},
+                                     LOP_TAG: {"life_of_py_0": get_scores(0.5, 99)}}},
+            START_TIME: 202001, END_TIME: 202411}}, SKILLS: {"flask": 65, "sql": 10}}
+        merged = merge_user_profiles(old_profile, {LANGS: {}}, CUTOFF)
+        self.assertEqual(list(merged[LANGS]["py"][TIME_SERIES].keys()), ["202411"])
+        self.assertEqual(merged[SKILLS], {"flask": 25, "sql": 10})
+
+    def test_start_time_is_first_month_in_window(self):
+        old_profile = {LANGS: {"py": {TIME_SERIES: {"202001": {ADDED: 50}, "202412": {ADDED: 20},
+                                                    "202411": {ADDED: 5}},
+                                      START_TIME: 202001, END_TIME: 202412}}}
+        merged = merge_user_profiles(old_profile, {}, CUTOFF)
+        self.assertEqual(merged[LANGS]["py"][START_TIME], 202411)
+        self.assertEqual(merged[LANGS]["py"][END_TIME], 202412)
+        new_profile = {LANGS: {"py": {TIME_SERIES: {202410: {ADDED: 40}}, START_TIME: 202410, END_TIME: 202410}}}
+        merged = merge_user_profiles(old_profile, new_profile, CUTOFF)
+        self.assertEqual(merged[LANGS]["py"][START_TIME], 202410)
+        self.assertEqual(merged[LANGS]["py"][END_TIME], 202412)
+
+    def test_start_and_end_time_are_dropped_with_the_months(self):
+        old_profile = {LANGS: {"py": {TIME_SERIES: {"202001": {ADDED: 50}}, START_TIME: 202001, END_TIME: 202001}}}
+        new_profile = {LANGS: {"py": {TIME_SERIES: {202411: {ADDED: 5}}}}}
+        merged = merge_user_profiles(old_profile, new_profile, CUTOFF)
+        self.assertEqual(merged[LANGS]["py"], {TIME_SERIES: {"202411": {ADDED: 5}}})
+
+    def test_overlapping_months_are_merged(self):
+        old_profile = {LANGS: {"py": {
+            TIME_SERIES: {"202411": {ADDED: 30, DELETED: 4, C2S_TAG: {"flask": get_scores(0.8, 25)}}},
+            START_TIME: 202411, END_TIME: 202411, SIG_CODE_SNIPPETS: {}}}, SKILLS: {"flask": 25}}
+        new_profile = {LANGS: {
+            "py": {TIME_SERIES: {202411: {ADDED: 12, DELETED: 1, C2S_TAG: {"flask": get_scores(0.6, 15),
+                                                                           "sql": get_scores(0.7, 10)}},
+                                 202412: {ADDED: 20, DELETED: 0}},
+                   START_TIME: 202411, END_TIME: 202412, SIG_CODE_SNIPPETS: {202412: [["a.py", ["snippet"]]]}},
+            "java": {TIME_SERIES: {202412: {ADDED: 7, DELETED: 0}}}}}
+        merged = merge_user_profiles(old_profile, new_profile, CUTOFF)
+        py_stats = merged[LANGS]["py"]
+        self.assertEqual(py_stats[TIME_SERIES]["202411"], {
+            ADDED: 42, DELETED: 5, C2S_TAG: {"flask": [0.8, 0.6, 1.4, 0.4, 0.3, 0.7, 2, 40, 0, 0],
+                                             "sql": get_scores(0.7, 10)}})
+        self.assertEqual(py_stats[TIME_SERIES]["202412"], {ADDED: 20, DELETED: 0})
+        self.assertEqual((py_stats[START_TIME], py_stats[END_TIME]), (202411, 202412))
+        self.assertEqual(py_stats[SIG_CODE_SNIPPETS], {"202412": [["a.py", ["snippet"]]]})
+        self.assertEqual(merged[LANGS]["java"], {TIME_SERIES: {"202412": {ADDED: 7, DELETED: 0}}})
+        self.assertEqual(merged[SKILLS], {"flask": 40, "sql": 10})
+
+    def test_boundary_month_is_taken_from_new_profile(self):
+        # Previous run had the whole month, a full run only has the commits after --since
+        old_profile = {LANGS: {"py": {TIME_SERIES: {"202409": {ADDED: 50}, "202411": {ADDED: 5}},
+                                      START_TIME: 202409, END_TIME: 202411}}}
+        new_profile = {LANGS: {"py": {TIME_SERIES: {202409: {ADDED: 20}}, START_TIME: 202409, END_TIME: 202409}}}
+        merged = merge_user_profiles(old_profile, new_profile, CUTOFF)
+        self.assertEqual(merged[LANGS]["py"], {TIME_SERIES: {"202409": {ADDED: 20}, "202411": {ADDED: 5}},
+                                               START_TIME: 202409, END_TIME: 202411})
+
+    def test_cutoff(self):
+        # Month of --since is only partly in the window
+        self.assertEqual(get_cutoff_yyyy_mm(datetime.datetime(2024, 10, 18, 9, 30).timestamp()), 202411)
+        self.assertEqual(get_cutoff_yyyy_mm(datetime.datetime(2024, 12, 31).timestamp()), 202501)
+        self.assertEqual(get_cutoff_yyyy_mm(datetime.datetime(2025, 1, 1).timestamp()), 202502)
+
+
+class TestWatermark(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.repo_path = os.path.join(self.tmp_dir.name, "repo")
+        self.state_dir = os.path.join(self.tmp_dir.name, "state")
+        init_repo(self.repo_path)
+        self.commits = [commit(self.repo_path, f"commit {i}", {"a.py": f"{i}\n"}) for i in range(3)]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_repo_state_round_trip(self):
+        profile = {LANGS: {"py": {TIME_SERIES: {"202411": {ADDED: 30}}, START_TIME: 202411, END_TIME: 202411,
+                                  SIG_CODE_SNIPPETS: {"202411": [["a.py", ["snippet"]]]}, LIBS: {"a": ["os"]}}},
+                   SKILLS: {"flask": 25}}
+        save_repo_state(self.state_dir, self.repo_path, {"dev@example.com": (self.commits[1], profile)})
+        repo_state = load_repo_state(self.state_dir, self.repo_path)
+        watermark, saved_profile = repo_state["dev@example.com"]
+        self.assertEqual(watermark, self.commits[1])
+        # Snippets are already evaluated, only the languages that had them are marked
+        self.assertEqual(saved_profile, {LANGS: {"py": {TIME_SERIES: {"202411": {ADDED: 30}}, START_TIME: 202411,
+                                                        END_TIME: 202411, SIG_CODE_SNIPPETS: {}}},
+                                         SKILLS: {"flask": 25}})
+        self.assertIn(LIBS, profile[LANGS]["py"])
+        self.assertEqual(load_repo_state(self.state_dir, os.path.join(self.tmp_dir.name, "other_repo")), {})
+
+    def test_processed_commits(self):
+        repo_state = {"dev@example.com": (self.commits[1], {}), "other@example.com": (self.commits[1], {})}
+        processed_commits = ModelTeamGitParser.get_processed_commits(self.repo_path, 24, repo_state, CUTOFF)
+        self.assertEqual(processed_commits, {"dev@example.com": set(self.commits[:2]),
+                                             "other@example.com": set(self.commits[:2])})
+
+    def test_commits_of_boundary_month_are_processed_again(self):
+        repo_path = os.path.join(self.tmp_dir.name, "boundary")
+        init_repo(repo_path)
+        since_ts = ModelTeamGitParser.get_since_timestamp(repo_path, 24)
+        one_day = 24 * 60 * 60
+        self.assertTrue(time.time() - 732 * one_day < since_ts < time.time() - 728 * one_day)
+        commits = [commit(repo_path, "boundary month", {"a.py": "1\n"}, since_ts + 10),
+                   commit(repo_path, "now", {"a.py": "2\n"})]
+        processed_commits = ModelTeamGitParser.get_processed_commits(
+            repo_path, 24, {"dev@example.com": (commits[1], {})}, get_cutoff_yyyy_mm(since_ts))
+        self.assertEqual(processed_commits, {"dev@example.com": {commits[1]}})
+
+    def test_rewritten_watermark_is_processed_from_scratch(self):
+        watermark = self.commits[2]
+        git(self.repo_path, "reset", "-q", "--hard", self.commits[0])
+        git(self.repo_path, "reflog", "expire", "--expire=now", "--all")
+        git(self.repo_path, "gc", "-q", "--prune=now")
+        processed_commits = ModelTeamGitParser.get_processed_commits(self.repo_path, 24,
+                                                                     {"dev@example.com": (watermark, {})}, CUTOFF)
+        self.assertEqual(processed_commits, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import io
+import json
+import math
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from modelteam_utils import json_utils
+from modelteam_utils.json_utils import dumps, loads, write_jsonl, read_jsonl, make_record, PROFILE_RECORD
+
+BACKENDS = ["json"]
+if json_utils.orjson is not None:
+    BACKENDS.append("orjson")
+if json_utils.msgspec is not None:
+    BACKENDS.append("msgspec")
+DECODE_ERRORS = {"json": json.JSONDecodeError}
+if json_utils.orjson is not None:
+    DECODE_ERRORS["orjson"] = json_utils.orjson.JSONDecodeError
+if json_utils.msgspec is not None:
+    DECODE_ERRORS["msgspec"] = json_utils.msgspec.DecodeError
+
+PROFILE = {"langs": {"py": {"time_series": {202401: {"add": 10, "c2s::model": {"python": [0.5, 0.25, 1e-300, 3]}},
+                                            202402: {"add": 0, "del": 7}},
+                            "start_time": 202401, "sig_code_snippets": {202401: [["a.py", ["def f():\n\tpass 日本"]]]}}},
+           "skills": {"python": 10}, "remote": None, "labeled": True}
+
+
+def backend(name):
+    return mock.patch.multiple(json_utils, JSON_BACKEND=name, DECODE_ERROR=DECODE_ERRORS[name])
+
+
+class TestJsonBackends(unittest.TestCase):
+    def assert_round_trip(self, obj):
+        # Same as a json round trip. NaN != NaN, so the results are compared as json text
+        expected = json.dumps(json.loads(json.dumps(obj)), sort_keys=True)
+        for name in BACKENDS:
+            with backend(name):
+                self.assertEqual(json.dumps(loads(dumps(obj)), sort_keys=True), expected, name)
+
+    def test_round_trip(self):
+        self.assert_round_trip(PROFILE)
+        self.assert_round_trip([])
+        self.assert_round_trip("")
+
+    def test_non_finite_floats(self):
+        obj = {"scores": [float("nan"), float("inf"), -float("inf"), 0.5, None], "remote": None}
+        self.assert_round_trip(obj)
+        for name in BACKENDS:
+            with backend(name):
+                scores = loads(dumps(obj))["scores"]
+                self.assertTrue(math.isnan(scores[0]), name)
+                self.assertEqual(scores[1:], [float("inf"), -float("inf"), 0.5, None], name)
+
+    def test_non_string_keys(self):
+        self.assert_round_trip({202401: 1, None: 2, True: 3, 1.5: 4, "key": 5})
+        for name in BACKENDS:
+            with backend(name):
+                self.assertEqual(loads(dumps({202401: {202402: 1}})), {"202401": {"202402": 1}}, name)
+
+    def test_values_only_json_can_write(self):
+        self.assert_round_trip({"big": 2 ** 70, "small": -2 ** 70})
+        self.assert_round_trip({"surrogate": "\ud800"})
+
+    def test_compatible(self):
+        for name in BACKENDS:
+            with backend(name):
+                self.assertEqual(dumps(PROFILE, compatible=True), json.dumps(PROFILE).encode("utf-8"), name)
+
+    def test_read_and_write_jsonl(self):
+        records = [PROFILE, {"scores": [float("nan")]}, {}]
+        for name in BACKENDS:
+            with backend(name), tempfile.TemporaryDirectory() as tmp_dir:
+                file_name = os.path.join(tmp_dir, "records.jsonl")
+                with open(file_name, "wb") as f:
+                    for record in records:
+                        write_jsonl(f, record)
+                self.assertEqual([json.dumps(record, sort_keys=True) for record in read_jsonl(file_name)],
+                                 [json.dumps(json.loads(json.dumps(record)), sort_keys=True) for record in records],
+                                 name)
+
+    def test_compatible_jsonl_is_json_lines(self):
+        f = io.BytesIO()
+        write_jsonl(f, PROFILE, compatible=True)
+        self.assertEqual(f.getvalue(), json.dumps(PROFILE).encode("utf-8") + b"\n")
+
+
+class TestMakeRecord(unittest.TestCase):
+    def test_make_record(self):
+        record = make_record(PROFILE_RECORD, "0.1", 1, "/repos/r1", "r1", "dev@example.com", {})
+        self.assertEqual(list(record.keys()), list(PROFILE_RECORD))
+        with self.assertRaises(ValueError):
+            make_record(PROFILE_RECORD, "0.1")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import gzip
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import ModelTeamGitParser
+from modelteam_utils.constants import USER, TIMESTAMP, PROFILES, PHC, TEAM, STATS, LANGS, TIME_SERIES, ADDED, SKILLS, \
+    REPO
+from modelteam_utils.crypto_utils import generate_hc
+
+UTC_NOW = 1700000000
+
+
+def get_profile(user, repo, skills):
+    return {"version": "0.1", TIMESTAMP: UTC_NOW, "repo_path": f"/repos/{repo}", REPO: repo, USER: user,
+            STATS: {LANGS: {"py": {TIME_SERIES: {"202401": {ADDED: 10, "c2s::model": {"python": [0.5] * 10}}}}},
+                    SKILLS: skills}}
+
+
+class TestMergeJson(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        ModelTeamGitParser.utc_now = UTC_NOW
+        self.repo_stats = {
+            "r1": [get_profile("dev@example.com", "r1", {"python": 10}),
+                   get_profile("dév@example.com", "r1", {"sql": 3, "日本": 1})],
+            "r2": [get_profile("dev@example.com", "r2", {})],
+            "r3": []}
+        self.output_file_list = []
+        for repo, profiles in self.repo_stats.items():
+            file_name = os.path.join(self.tmp_dir.name, f"{repo}_user_profile.jsonl")
+            with open(file_name, "w") as f:
+                for profile in profiles:
+                    # Same format as save_final_output
+                    f.write(json.dumps(profile))
+                    f.write("\n")
+            self.output_file_list.append(file_name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def get_expected(self, users, team_name):
+        """
+        Profile built in memory and written with json.dump, as before the merge was streamed
+        """
+        merged_profile = {USER: ModelTeamGitParser.gen_user_name(users, team_name), TIMESTAMP: UTC_NOW,
+                          PROFILES: [], PHC: generate_hc(os.path.abspath(sys.argv[0]))}
+        if team_name:
+            merged_profile[TEAM] = team_name
+        for profiles in self.repo_stats.values():
+            merged_profile[PROFILES].extend(profiles)
+        return json.dumps(merged_profile)
+
+    def test_same_as_json_dump(self):
+        merged_json_file_name = os.path.join(self.tmp_dir.name, "mt_profile.json")
+        ModelTeamGitParser.merge_json({"dev@example.com"}, self.output_file_list, merged_json_file_name, None,
+                                      UTC_NOW + 60)
+        with open(merged_json_file_name) as f:
+            self.assertEqual(f.read(), self.get_expected({"dev@example.com"}, None))
+
+    def test_team_and_compressed_output(self):
+        merged_json_file_name = os.path.join(self.tmp_dir.name, "mt_profile.json.gz")
+        ModelTeamGitParser.merge_json(None, self.output_file_list, merged_json_file_name, "team", UTC_NOW + 60)
+        with gzip.open(merged_json_file_name, "rt") as f:
+            self.assertEqual(f.read(), self.get_expected(None, "team"))
+
+    def test_no_profiles(self):
+        merged_json_file_name = os.path.join(self.tmp_dir.name, "mt_profile.json")
+        self.repo_stats = {"r3": []}
+        ModelTeamGitParser.merge_json(None, self.output_file_list[-1:], merged_json_file_name, "team", UTC_NOW)
+        with open(merged_json_file_name) as f:
+            merged_profile = json.load(f)
+        self.assertEqual(merged_profile[PROFILES], [])
+        with open(merged_json_file_name) as f:
+            self.assertEqual(f.read(), self.get_expected(None, "team"))
+
+
+if __name__ == "__main__":
+    unittest.main()
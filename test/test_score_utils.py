@@ -0,0 +1,118 @@
+import copy
+import random
+import unittest
+
+from modelteam_utils.constants import LANGS, TIME_SERIES, ADDED
+from modelteam_utils.score_utils import ScoreStore, INITIAL_CAPACITY
+
+TAG = "c2s::model"
+SKILLS = ["python", "java", "sql", "docker", "react", "flask"]
+
+
+def accumulate_one_by_one(features, user_profiles, tag, skill_list, score_list, sm_score_list):
+    """
+    Score lists in the profile updated one snippet at a time, as before ScoreStore
+    """
+    for feature, skills, scores, sm_scores in zip(features, skill_list, score_list, sm_score_list):
+        monthly_stats = user_profiles[feature["user"]][LANGS][feature["lang"]][TIME_SERIES][feature["yyyy_mm"]]
+        for skill, score, sm_score in zip(skills, scores, sm_scores):
+            skill_stats = monthly_stats.setdefault(tag, {})
+            if skill not in skill_stats:
+                skill_stats[skill] = [score, score, 0, sm_score, sm_score, 0, 0, 0, 0, 0]
+            stats = skill_stats[skill]
+            stats[0] = max(stats[0], score)
+            stats[1] = min(stats[1], score)
+            stats[2] += score
+            stats[3] = max(stats[3], sm_score)
+            stats[4] = min(stats[4], sm_score)
+            stats[5] += sm_score
+            stats[6] += 1
+            stats[7] += feature["line_count"]
+            stats[8] += feature["doc_string_line_count"]
+            stats[9] = max(stats[9], feature["is_labeled_file"])
+
+
+def get_random_batch(rng, user_profiles, size):
+    features = []
+    skill_list = []
+    score_list = []
+    sm_score_list = []
+    for _ in range(size):
+        user = rng.choice(list(user_profiles.keys()))
+        lang = rng.choice(list(user_profiles[user][LANGS].keys()))
+        yyyy_mm = rng.choice(list(user_profiles[user][LANGS][lang][TIME_SERIES].keys()))
+        features.append({"user": user, "lang": lang, "yyyy_mm": yyyy_mm, "line_count": rng.randint(1, 40),
+                         "doc_string_line_count": rng.randint(0, 5), "is_labeled_file": rng.randint(0, 1)})
+        skills = rng.sample(SKILLS, rng.randint(0, 3))
+        skill_list.append(skills)
+        score_list.append([rng.random() for _ in skills])
+        sm_score_list.append([rng.random() for _ in skills])
+    return features, skill_list, score_list, sm_score_list
+
+
+def get_user_profiles(num_users):
+    user_profiles = {}
+    for u in range(num_users):
+        langs = {}
+        for lang in ["py", "java"]:
+            langs[lang] = {TIME_SERIES: {yyyy_mm: {ADDED: 10} for yyyy_mm in [202401, 202402, 202403]}}
+        user_profiles[f"user{u}@example.com"] = {LANGS: langs}
+    return user_profiles
+
+
+class TestScoreStore(unittest.TestCase):
+    def assert_same_as_one_by_one(self, user_profiles, batches):
+        expected = copy.deepcopy(user_profiles)
+        actual = copy.deepcopy(user_profiles)
+        score_store = ScoreStore()
+        for features, skill_list, score_list, sm_score_list in batches:
+            accumulate_one_by_one(features, expected, TAG, skill_list, score_list, sm_score_list)
+            score_store.accumulate_scores(features, actual, TAG, skill_list, score_list, sm_score_list)
+        score_store.save(actual)
+        self.assertEqual(actual, expected)
+        return score_store
+
+    def test_same_as_one_by_one(self):
+        rng = random.Random(3)
+        user_profiles = get_user_profiles(3)
+        batches = [get_random_batch(rng, user_profiles, rng.randint(1, 50)) for _ in range(20)]
+        self.assert_same_as_one_by_one(user_profiles, batches)
+
+    def test_grow(self):
+        rng = random.Random(5)
+        user_profiles = get_user_profiles(200)
+        batches = [get_random_batch(rng, user_profiles, 1000) for _ in range(3)]
+        score_store = self.assert_same_as_one_by_one(user_profiles, batches)
+        self.assertGreater(score_store.num_rows, INITIAL_CAPACITY)
+
+    def test_merge_with_saved_scores(self):
+        # Scores from a previous run (--incremental_dir)
+        rng = random.Random(11)
+        user_profiles = get_user_profiles(2)
+        features, skill_list, score_list, sm_score_list = get_random_batch(rng, user_profiles, 30)
+        accumulate_one_by_one(features, user_profiles, TAG, skill_list, score_list, sm_score_list)
+        batches = [get_random_batch(rng, user_profiles, 30) for _ in range(3)]
+        self.assert_same_as_one_by_one(user_profiles, batches)
+
+    def test_save_user(self):
+        user_profiles = get_user_profiles(2)
+        users = list(user_profiles.keys())
+        features = [{"user": user, "lang": "py", "yyyy_mm": 202401, "line_count": 12, "doc_string_line_count": 2,
+                     "is_labeled_file": 0} for user in users]
+        score_store = ScoreStore()
+        score_store.accumulate_scores(features, user_profiles, TAG, [["python"], ["sql"]], [[0.5], [0.25]],
+                                      [[0.75], [0.125]])
+        score_store.save_user(users[0], user_profiles[users[0]])
+        self.assertEqual(user_profiles[users[0]][LANGS]["py"][TIME_SERIES][202401][TAG],
+                         {"python": [0.5, 0.5, 0.5, 0.75, 0.75, 0.75, 1, 12, 2, 0]})
+        self.assertNotIn(TAG, user_profiles[users[1]][LANGS]["py"][TIME_SERIES][202401])
+        # Saved scores are dropped from the store
+        score_store.save_user(users[0], user_profiles[users[0]])
+        self.assertNotIn(users[0], score_store.rows)
+        score_store.save(user_profiles)
+        self.assertEqual(user_profiles[users[1]][LANGS]["py"][TIME_SERIES][202401][TAG],
+                         {"sql": [0.25, 0.25, 0.25, 0.125, 0.125, 0.125, 1, 12, 2, 0]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from modelteam_utils.shard_utils import parse_shard, is_in_shard, RepoLeases, ShardManifest, merge_shard_pdf_stats, \
+    LEASE_SUFFIX
+
+
+class TestShard(unittest.TestCase):
+    def test_parse_shard(self):
+        self.assertEqual(parse_shard("0/4"), (0, 4))
+        self.assertEqual(parse_shard("3/4"), (3, 4))
+        for shard in ["4/4", "1/0", "-1/2", "a/2", "1", "1/2/3"]:
+            with self.assertRaises(ValueError):
+                parse_shard(shard)
+
+    def test_each_repo_is_in_one_shard(self):
+        folders = [f"/repos/repo_{i}" for i in range(100)]
+        for shard_count in [1, 2, 5]:
+            for folder in folders:
+                shards = [i for i in range(shard_count) if is_in_shard(folder, i, shard_count)]
+                self.assertEqual(len(shards), 1)
+
+
+class TestRepoLeases(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.leases = []
+
+    def tearDown(self):
+        for leases in self.leases:
+            leases.close()
+        self.tmp_dir.cleanup()
+
+    def new_leases(self, expiry_seconds=60):
+        leases = RepoLeases(self.tmp_dir.name, expiry_seconds)
+        self.leases.append(leases)
+        return leases
+
+    def test_only_one_node_gets_the_lease(self):
+        node1 = self.new_leases()
+        node2 = self.new_leases()
+        self.assertTrue(node1.acquire("repo"))
+        self.assertFalse(node2.acquire("repo"))
+        self.assertFalse(node1.acquire("repo"))
+        self.assertTrue(node2.acquire("other_repo"))
+
+    def test_done_repo_is_not_picked_again(self):
+        node1 = self.new_leases()
+        node2 = self.new_leases()
+        self.assertTrue(node1.acquire("repo"))
+        node1.release("repo")
+        self.assertTrue(node1.is_done("repo"))
+        self.assertFalse(node2.acquire("repo"))
+        self.assertFalse(os.path.exists(node1.get_file_name("repo", LEASE_SUFFIX)))
+
+    def test_failed_repo_can_be_picked_by_another_node(self):
+        node1 = self.new_leases()
+        node2 = self.new_leases()
+        self.assertTrue(node1.acquire("repo"))
+        node1.release("repo", done=False)
+        self.assertFalse(node1.is_done("repo"))
+        self.assertTrue(node2.acquire("repo"))
+
+    def test_expired_lease_is_broken(self):
+        node1 = self.new_leases()
+        node2 = self.new_leases()
+        self.assertTrue(node1.acquire("repo"))
+        # Node 1 crashed before its heartbeat
+        node1.close()
+        lease_file = node1.get_file_name("repo", LEASE_SUFFIX)
+        old_time = time.time() - 120
+        os.utime(lease_file, (old_time, old_time))
+        self.assertTrue(node2.acquire("repo"))
+        with open(lease_file) as f:
+            self.assertEqual(json.load(f)["owner"], node2.owner)
+
+    def test_heartbeat_keeps_the_lease(self):
+        node1 = self.new_leases(expiry_seconds=3)
+        self.assertTrue(node1.acquire("repo"))
+        lease_file = node1.get_file_name("repo", LEASE_SUFFIX)
+        old_time = time.time() - 2
+        os.utime(lease_file, (old_time, old_time))
+        # Heartbeat runs every second
+        time.sleep(1.5)
+        self.assertLess(time.time() - os.path.getmtime(lease_file), 2)
+        self.assertFalse(self.new_leases(expiry_seconds=3).acquire("repo"))
+
+
+class TestShardManifest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_add(self):
+        manifest = ShardManifest(self.tmp_dir.name, 1, 2)
+        manifest.add("repo1", "repo-stats/repo1_user_profile.jsonl")
+        manifest.add("repo2", None)
+        with open(manifest.file_name) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([(record["folder"], record["output"]) for record in records],
+                         [("repo1", "repo-stats/repo1_user_profile.jsonl"), ("repo2", None)])
+
+    def test_merge_pdf_stats(self):
+        ShardManifest(self.tmp_dir.name, 0, 2).save_pdf_stats({"repo1": {"big_commits": {"a": 120}, "files": {}}})
+        ShardManifest(self.tmp_dir.name, 1, 2).save_pdf_stats({"repo2": {"big_commits": {}, "files": {}}})
+        ShardManifest(self.tmp_dir.name, 1, 2).add("repo2", None)
+        self.assertEqual(merge_shard_pdf_stats(self.tmp_dir.name),
+                         {"repo1": {"big_commits": {"a": 120}, "files": {}}, "repo2": {"big_commits": {}, "files": {}}})
+
+    def test_merge_pdf_stats_without_manifests(self):
+        self.assertEqual(merge_shard_pdf_stats(os.path.join(self.tmp_dir.name, "manifests")), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import unittest
+
+from ModelTeamGitParser import is_tmp_stats_file
+from modelteam_utils.feature_utils import write_features, read_features, get_features_file_name, FEATURE_CHUNK_SIZE
+from modelteam_utils.snippet_utils import SnippetWriter, SnippetReader, get_snippets_file_name, get_snippet_hash, \
+    get_snippet_size, is_snippet_ref
+from modelteam_utils.utils import sha256_hash
+
+SNIPPETS = ["def f():\n\tpass", "", "日本 ퟿ 🙂", "def f():\n\tpass", "x = 1\r\n"]
+
+
+def get_feature(user, snippet, i=0):
+    return {"user": user, "lang": "py", "file_name": f"f{i}.py", "yyyy_mm": 202401 + i % 12, "snippet": snippet,
+            "libs": "", "line_count": snippet.count("\n") + 1, "is_labeled_file": i % 2, "doc_string_line_count": 0}
+
+
+class TestSnippetFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.file_name = get_snippets_file_name(os.path.join(self.tmp_dir.name, "repo.jsonl"))
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, snippets):
+        snippet_writer = SnippetWriter(self.file_name)
+        try:
+            return [snippet_writer.add(snippet) for snippet in snippets]
+        finally:
+            snippet_writer.close()
+
+    def test_round_trip(self):
+        refs = self.write(SNIPPETS)
+        self.assertTrue(all(is_snippet_ref(ref) for ref in refs))
+        # Same snippet is stored once
+        self.assertEqual(refs[3], refs[0])
+        self.assertEqual(os.path.getsize(self.file_name), len("".join(set(SNIPPETS)).encode("utf-8")))
+        snippet_reader = SnippetReader(self.file_name)
+        try:
+            self.assertEqual([snippet_reader.get(ref) for ref in refs], SNIPPETS)
+            # tmp-stats of an older version have the text
+            self.assertEqual(snippet_reader.get(SNIPPETS[2]), SNIPPETS[2])
+        finally:
+            snippet_reader.close()
+        self.assertEqual([get_snippet_hash(ref) for ref in refs], [sha256_hash(snippet) for snippet in SNIPPETS])
+        self.assertEqual([get_snippet_hash(snippet) for snippet in SNIPPETS], [ref[2] for ref in refs])
+        self.assertEqual([get_snippet_size(ref) for ref in refs], [len(s.encode("utf-8")) for s in SNIPPETS])
+
+    def test_empty_file(self):
+        refs = self.write(["", ""])
+        self.assertEqual(os.path.getsize(self.file_name), 0)
+        snippet_reader = SnippetReader(self.file_name)
+        try:
+            self.assertEqual([snippet_reader.get(ref) for ref in refs], ["", ""])
+        finally:
+            snippet_reader.close()
+
+    def test_missing_file(self):
+        snippet_reader = SnippetReader(self.file_name)
+        try:
+            self.assertEqual(snippet_reader.get("text"), "text")
+            self.assertEqual(snippet_reader.get([0, 0, sha256_hash("")]), "")
+            with self.assertRaises(ValueError):
+                snippet_reader.get([0, 4, sha256_hash("text")])
+        finally:
+            snippet_reader.close()
+
+
+class TestFeaturesFile(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        user_stats_file_name = os.path.join(self.tmp_dir.name, "repo.jsonl")
+        self.features_file_name = get_features_file_name(user_stats_file_name)
+        self.snippets_file_name = get_snippets_file_name(user_stats_file_name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_snippets_are_read_lazily(self):
+        users = ["dev@example.com", "other@example.com"]
+        features = [get_feature(users[i % 2], SNIPPETS[i % len(SNIPPETS)] + str(i % 7), i)
+                    for i in range(FEATURE_CHUNK_SIZE + 5)]
+        snippet_writer = SnippetWriter(self.snippets_file_name)
+        try:
+            write_features(self.features_file_name, features, "", snippet_writer)
+        finally:
+            snippet_writer.close()
+        self.assertFalse(os.path.exists(f"{self.features_file_name}.tmp"))
+        loaded = read_features(self.features_file_name, {users[0]: {}})
+        expected = [feature for feature in features if feature["user"] == users[0]]
+        self.assertEqual(len(loaded), len(expected))
+        # Features keep the references, the snippets are read only when they are evaluated
+        self.assertTrue(all(is_snippet_ref(feature["snippet"]) for feature in loaded))
+        snippet_reader = SnippetReader(self.snippets_file_name)
+        try:
+            for feature in loaded:
+                feature["snippet"] = snippet_reader.get(feature["snippet"])
+        finally:
+            snippet_reader.close()
+        for feature in expected:
+            feature["yyyy_mm"] = str(feature["yyyy_mm"])
+        self.assertEqual(loaded, expected)
+
+    def test_older_version(self):
+        self.assertIsNone(read_features(self.features_file_name, {}))
+
+
+class TestTmpStatsFiles(unittest.TestCase):
+    def test_only_tmp_stats_files(self):
+        files = ["repo.jsonl", "repo_libs.jsonl", "repo_features.jsonl", "repo_features.jsonl.tmp",
+                 "repo_snippets.bin", "repo2.jsonl", "repo3_snippets.bin"]
+        self.assertEqual([file_name for file_name in files if is_tmp_stats_file(file_name)],
+                         ["repo.jsonl", "repo2.jsonl"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,184 @@
+import os
+import random
+import re
+import unittest
+
+from modelteam_utils.constants import REFORMAT_CHAR_LIMIT
+from modelteam_utils.diff_utils import read_file_diffs
+from modelteam_utils.languages.CSharpPL import CSharpPL
+from modelteam_utils.languages.CppPL import CppPL
+from modelteam_utils.languages.DartPL import DartPL
+from modelteam_utils.languages.ElixirPL import ElixirPL
+from modelteam_utils.languages.GoPL import GoPL
+from modelteam_utils.languages.JavaPL import JavaPL
+from modelteam_utils.languages.JavaScriptPL import JavaScriptPL
+from modelteam_utils.languages.KotlinPL import KotlinPL
+from modelteam_utils.languages.LuaPL import LuaPL
+from modelteam_utils.languages.PhpPL import PhpPL
+from modelteam_utils.languages.PythonPL import PythonPL
+from modelteam_utils.languages.RubyPL import RubyPL
+from modelteam_utils.languages.RustPL import RustPL
+from modelteam_utils.languages.ScalaPL import ScalaPL
+from modelteam_utils.languages.SwiftPL import SwiftPL
+from modelteam_utils.utils import get_edit_distance, get_bounded_edit_distance, get_num_chars_changed, \
+    get_supported_extensions, get_path_info, get_language_parser
+
+# get_supported_extensions before the parser registry
+SUPPORTED_EXTENSIONS = ["py", "js", "ts", "jsx", "tsx", "java", "cs", "go", "cpp", "c", "h", "php", "rb", "rs", "scala",
+                        "swift", "kt", "kts", "lua", "dart", "ex", "exs"]
+PATHS = ["a.py", "src/main/App.java", "lib/x.tar.gz", ".bashrc", "Makefile", "a.p-y", "a.PY", "weird.c++", "b.h",
+         "dir.v2/file", "web/a.min.js", "space name.kts", "日本/コード.go", '"q\\"uote.rb"', "a.py => b.java",
+         "src/{old => new}/a.py", "{a.py => b.go}", "dir/{ => sub}/x.scala", "a/{b => }/c.rs", "{x => y}/z.tsx",
+         "a/{b.txt => c.ex}", "a/{b.cpp => c.md}", "no_ext/{a => b}", "x.swift", "y.lua", "z.dart", "w.php", "v.cs",
+         "u.exs", "t.kt", "s.c", "r.jsx", "q.ts", "p.cpp"]
+
+
+def get_language_parser_class_old(file_extension):
+    """
+    Parser class that get_language_parser created before the parser registry
+    """
+    if "go" == file_extension:
+        return GoPL
+    elif "py" == file_extension:
+        return PythonPL
+    elif "js" == file_extension or "jsx" == file_extension or "ts" == file_extension or "tsx" == file_extension:
+        return JavaScriptPL
+    elif "java" == file_extension:
+        return JavaPL
+    elif "cpp" == file_extension or "c" == file_extension or "h" == file_extension:
+        return CppPL
+    elif "php" == file_extension:
+        return PhpPL
+    elif "rb" == file_extension:
+        return RubyPL
+    elif "cs" == file_extension:
+        return CSharpPL
+    elif "rs" == file_extension:
+        return RustPL
+    elif "scala" == file_extension:
+        return ScalaPL
+    elif "swift" == file_extension:
+        return SwiftPL
+    elif "kt" == file_extension or "kts" == file_extension:
+        return KotlinPL
+    elif "lua" == file_extension:
+        return LuaPL
+    elif "dart" == file_extension:
+        return DartPL
+    elif "ex" == file_extension or "exs" == file_extension:
+        return ElixirPL
+    else:
+        return None
+
+
+def get_path_info_old(file_path):
+    """
+    Path handling of update_line_num_stats before it was memoized
+    """
+    if "=>" in file_path:
+        pattern = re.compile(r"(.*){.* => (.*)}(.*)")
+        file_path = pattern.sub(r"\1\2\3", file_path)
+    base_name, ext = os.path.splitext(file_path)
+    ext = re.sub('[^0-9a-zA-Z]+', '', ext)
+    if not ext:
+        ext = "unknown"
+    return file_path, ext, get_language_parser_class_old(ext)
+
+
+def get_file_diff(deleted_lines, added_lines):
+    lines = ["diff --git 1/a.py 2/a.py", "--- 1/a.py", "+++ 2/a.py",
+             f"@@ -1,{len(deleted_lines)} +1,{len(added_lines)} @@"]
+    lines.extend(f"-{line}" for line in deleted_lines)
+    lines.extend(f"+{line}" for line in added_lines)
+    return next(read_file_diffs(lines, 1, 2, 100000))
+
+
+class TestBoundedEditDistance(unittest.TestCase):
+    def assert_same_as_edit_distance(self, s1, s2, limit):
+        expected = min(get_edit_distance(s1, s2), limit)
+        self.assertEqual(get_bounded_edit_distance(s1, s2, limit), expected, (s1, s2, limit))
+        self.assertEqual(get_bounded_edit_distance(s2, s1, limit), expected, (s2, s1, limit))
+
+    def test_edge_cases(self):
+        for s1, s2 in [("", ""), ("", "abc"), ("abc", "abc"), ("abc", "abd"), ("kitten", "sitting"),
+                       ("prefix_x_suffix", "prefix_yy_suffix"), ("aaaa", "aa"), ("abcdef", "fedcba")]:
+            for limit in [1, 2, 3, 5, 100]:
+                self.assert_same_as_edit_distance(s1, s2, limit)
+
+    def test_random_strings(self):
+        rng = random.Random(7)
+        for _ in range(500):
+            s1 = "".join(rng.choice("abc") for _ in range(rng.randint(0, 30)))
+            if rng.random() < 0.5:
+                # Small edits of s1, so the distance is often below the limit
+                s2 = list(s1)
+                for _ in range(rng.randint(0, 6)):
+                    position = rng.randint(0, len(s2))
+                    operation = rng.choice(["insert", "delete", "replace"])
+                    if operation == "insert" or not s2:
+                        s2.insert(position, rng.choice("abc"))
+                    elif operation == "delete":
+                        del s2[min(position, len(s2) - 1)]
+                    else:
+                        s2[min(position, len(s2) - 1)] = rng.choice("abc")
+                s2 = "".join(s2)
+            else:
+                s2 = "".join(rng.choice("abc") for _ in range(rng.randint(0, 30)))
+            self.assert_same_as_edit_distance(s1, s2, rng.randint(1, 20))
+
+    def test_long_strings_stop_at_limit(self):
+        s1 = "a" * 5000 + "b" * 5000
+        s2 = "b" * 5000 + "a" * 5000
+        self.assertEqual(get_bounded_edit_distance(s1, s2, REFORMAT_CHAR_LIMIT), REFORMAT_CHAR_LIMIT)
+
+
+class TestNumCharsChanged(unittest.TestCase):
+    def test_reformat(self):
+        file_diff = get_file_diff(["def f(a,b):", "    return a+b"], ["def f(a, b):", "\treturn a + b"])
+        self.assertEqual(get_num_chars_changed(file_diff, REFORMAT_CHAR_LIMIT), 0)
+        self.assertEqual(get_num_chars_changed(file_diff), 0)
+
+    def test_bounded_by_limit(self):
+        file_diff = get_file_diff(["x = 1"], [f"y_{i} = {i}" for i in range(20)])
+        self.assertEqual(get_num_chars_changed(file_diff, REFORMAT_CHAR_LIMIT), REFORMAT_CHAR_LIMIT)
+        self.assertGreater(get_num_chars_changed(file_diff), REFORMAT_CHAR_LIMIT)
+        small_change = get_file_diff(["x = 1"], ["x = 2"])
+        self.assertEqual(get_num_chars_changed(small_change, REFORMAT_CHAR_LIMIT), 1)
+
+
+
+class TestLanguageParsers(unittest.TestCase):
+    def test_supported_extensions(self):
+        self.assertEqual(get_supported_extensions(), SUPPORTED_EXTENSIONS)
+
+    def test_same_parser_as_before(self):
+        for file_extension in SUPPORTED_EXTENSIONS + ["unknown", "md", "PY", "c++", ""]:
+            expected_class = get_language_parser_class_old(file_extension)
+            parser = get_language_parser(file_extension)
+            if expected_class is None:
+                self.assertIsNone(parser, file_extension)
+            else:
+                self.assertIs(type(parser), expected_class, file_extension)
+                self.assertEqual(parser.extension, file_extension)
+
+
+class TestPathInfo(unittest.TestCase):
+    def test_same_as_uncached(self):
+        get_path_info.cache_clear()
+        for _ in range(2):
+            for path in PATHS:
+                file_path, file_extension, parser = get_path_info(path)
+                expected_path, expected_extension, expected_class = get_path_info_old(path)
+                self.assertEqual((file_path, file_extension), (expected_path, expected_extension), path)
+                if expected_class is None:
+                    self.assertIsNone(parser, path)
+                else:
+                    self.assertIs(type(parser), expected_class, path)
+                    self.assertEqual(parser.extension, file_extension, path)
+        self.assertEqual(get_path_info.cache_info().hits, len(PATHS))
+        supported = [path for path in PATHS if get_path_info_old(path)[2]]
+        self.assertEqual(sorted(set(get_path_info(path)[1] for path in supported)), sorted(SUPPORTED_EXTENSIONS))
+
+
+if __name__ == "__main__":
+    unittest.main()